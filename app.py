@@ -1,11 +1,14 @@
+import json
 import os
 import streamlit as st
 import pandas as pd
 import plotly.express as px
 import time
-from src.data_ingestion import extract_from_pdf, extract_from_url, parse_openapi_spec
-from src.summarization import SummarizerModule
-from src.sentiment import SentimentAnalyzerModule
+from src.data_ingestion import extract_from_pdf, extract_from_url, parse_openapi_endpoints, parse_openapi_spec
+from src.model_pool import get_model_pool
+from src.summarization import SUMMARIZER_TIERS
+from src.jobs import JobQueue, ensure_worker, start_results_server, QUEUED, RUNNING, FAILED, JOBS_QUEUE_DEPTH, JOBS_LIVE_WORKERS
+from src.metrics import start_metrics_server
 from src.utils import setup_logging, get_device as device
 
 
@@ -22,14 +25,103 @@ st.set_page_config(
 
 setup_logging()
 
-# --- Funzioni Caricamento Modelli (Cachate) ---
+# --- Funzioni Caricamento Modelli (Pool condiviso) ---
 @st.cache_resource
+def load_model_pool():
+    pool = get_model_pool()
+    # Con MODEL_POOL_PRELOAD=1 i modelli vengono caricati e riscaldati all'avvio
+    if os.getenv("MODEL_POOL_PRELOAD", "0") == "1":
+        pool.preload()
+    return pool
+
 def load_summarizer():
-    return SummarizerModule()
+    return load_model_pool().summarizer()
 
-@st.cache_resource
 def load_sentiment_analyzer():
-    return SentimentAnalyzerModule()
+    return load_model_pool().sentiment_analyzer()
+
+load_model_pool()
+
+# --- Coda Job in Background ---
+@st.cache_resource
+def load_job_queue():
+    return JobQueue()
+
+# --- Endpoint Metriche (Prometheus) ---
+# Ogni processo espone solo il proprio registro: il /metrics dell'app contiene coda, worker vivi
+# e i modelli usati direttamente dall'app (analisi del singolo testo), mentre caricamento e inferenza
+# dei modelli usati dai job sono nei worker. Con METRICS_PORT impostata anche i worker avviati
+# dall'app espongono /metrics (WORKER_METRICS_PORT, default: la porta successiva a quella dell'app)
+METRICS_PORT = os.getenv("METRICS_PORT")
+WORKER_METRICS_PORT = os.getenv("WORKER_METRICS_PORT") or (str(int(METRICS_PORT) + 1) if METRICS_PORT else None)
+
+@st.cache_resource
+def start_metrics():
+    # Con METRICS_PORT impostata, l'app espone /metrics (un solo server per processo)
+    if not METRICS_PORT:
+        return None
+    JOBS_QUEUE_DEPTH.set_function(load_job_queue().queue_depth)
+    JOBS_LIVE_WORKERS.set_function(load_job_queue().live_workers)
+    return start_metrics_server(int(METRICS_PORT))
+
+start_metrics()
+
+# --- Download dei Risultati (fuori dai rerun di Streamlit) ---
+# Il server dei download ascolta solo in locale: per un accesso remoto va esposto dietro lo stesso
+# reverse proxy (e la stessa autenticazione) dell'app, indicando in RESULTS_BASE_URL l'URL pubblico.
+# Con RESULTS_PORT=0 il server non viene avviato e i file si scaricano dall'app (letti solo su richiesta)
+RESULTS_PORT = int(os.getenv("RESULTS_PORT", "8502"))
+RESULTS_ADDR = os.getenv("RESULTS_ADDR", "127.0.0.1")
+RESULTS_BASE_URL = os.getenv("RESULTS_BASE_URL", f"http://localhost:{RESULTS_PORT}").rstrip("/")
+
+@st.cache_resource
+def start_results():
+    if not RESULTS_PORT:
+        return None
+    return start_results_server(RESULTS_PORT, RESULTS_ADDR, jobs_dir=load_job_queue().jobs_dir)
+
+start_results()
+
+def result_download(label, job_id, path, file_name):
+    """Link al server dei download o, se disattivato, download dall'app con il file letto solo su richiesta."""
+    if RESULTS_PORT:
+        st.link_button(label, f"{RESULTS_BASE_URL}/jobs/{job_id}/{os.path.basename(path)}")
+        return
+    prepared_key = f"download_{job_id}_{os.path.basename(path)}"
+    if not st.session_state.get(prepared_key):
+        if not st.button(f"Prepara: {label}", key=f"prepare_{prepared_key}"):
+            return
+        st.session_state[prepared_key] = True
+    with open(path, "rb") as f:
+        st.download_button(label, f, file_name=file_name, key=prepared_key + "_button")
+
+def render_job(param_key, on_done):
+    """
+    Mostra lo stato del job il cui id è salvato nei query param dell'URL
+    (così sopravvive a un refresh del browser) e fa polling finché non termina.
+    """
+    job_id = st.query_params.get(param_key)
+    if not job_id:
+        return
+    
+    job_queue = load_job_queue()
+    job = job_queue.get(job_id)
+    if job is None:
+        st.warning("Job non trovato.")
+        del st.query_params[param_key]
+        return
+    
+    if job["status"] in (QUEUED, RUNNING):
+        ensure_worker(job_queue, metrics_port=int(WORKER_METRICS_PORT) if WORKER_METRICS_PORT else None)
+        if job["status"] == QUEUED:
+            st.info(f"Job in coda ({job_queue.queue_depth()} in attesa). Puoi chiudere la pagina e tornare più tardi.")
+        st.progress(job["progress"], text=job["message"] or "Elaborazione in corso...")
+        time.sleep(2)
+        st.rerun()
+    elif job["status"] == FAILED:
+        st.error(f"Si è verificato un errore: {job['error']}")
+    else:
+        on_done(job)
 
 # --- Sidebar Navigazione ---
 st.sidebar.title("Navigazione")
@@ -80,6 +172,15 @@ if app_mode == "🏠 Home":
 
     st.info(f"Sistema in esecuzione su: {lol} | Accelerazione hardware rilevata: {hw}.")
 
+    pool_stats = load_model_pool().stats()
+    with st.expander("Stato modelli caricati"):
+        st.write(f"Memoria residente processo: {pool_stats['memory']['rss_mb']:.0f} MB "
+                 f"(di cui mappata da file: {pool_stats['memory']['rss_file_mb']:.0f} MB)")
+        if pool_stats["modules"]:
+            st.dataframe(pd.DataFrame(pool_stats["modules"]).T)
+        else:
+            st.write("Nessun modello ancora caricato.")
+
     st.markdown("----")
     st.link_button("Codice sorgente", "https://github.com/DataScience-Golddiggers/Faboulous-interpretr", icon="💻") 
     st.link_button("Cercaci su GitHub", "https://github.com/DataScience-Golddiggers", icon="🐙")
@@ -94,6 +195,7 @@ elif app_mode == "📄 Doc Summarizer":
     source_type = st.radio("Fonte Dati:", ["Testo Libero", "PDF", "URL Web", "OpenAPI Spec (JSON/YAML)"])
     
     input_text = ""
+    openapi_info = None
     
     if source_type == "Testo Libero":
         input_text = st.text_area("Incolla qui il testo:", height=300)
@@ -125,30 +227,54 @@ elif app_mode == "📄 Doc Summarizer":
             is_json = uploaded_file.name.endswith(".json")
             with st.spinner("Parsing specifica API..."):
                 input_text = parse_openapi_spec(content, is_json=is_json)
-                st.success("Specifica convertita in testo descrittivo.")
+                if input_text:
+                    # Record strutturati: il worker li raggruppa per tag/prefisso del path
+                    openapi_info = parse_openapi_endpoints(content, is_json=is_json)
+                    st.success(f"Specifica convertita: {len(openapi_info['endpoints'])} endpoint.")
+                else:
+                    st.error("Impossibile leggere la specifica. Controlla il formato del file.")
 
-    # Processamento
+    # Scelta del modello: automatica (lunghezza + budget di latenza) o tier fisso
+    with st.expander("Opzioni modello"):
+        tier = st.selectbox("Modello:", ["auto"] + list(SUMMARIZER_TIERS), format_func=lambda t: "Automatico" if t == "auto" else t)
+        latency_budget = st.number_input("Budget di latenza (secondi, 0 = nessun limite):", min_value=0.0, value=0.0, step=5.0)
+        skip_languages = st.checkbox("Salta i documenti in lingue non supportate dal modello (solo italiano)", value=True)
+    
+    # Processamento (in background tramite la coda di job)
     if st.button("Genera Riassunto"):
         if not input_text:
             st.warning("Per favore fornisci un testo o un file valido.")
         else:
-            try:
-                with st.spinner("Caricamento modello e generazione riassunto (può richiedere tempo)..."):
-                    summarizer = load_summarizer()
-                    summary = summarizer.summarize(input_text)
-                
-                st.subheader("Risultato:")
-                st.markdown(f"> {summary}")
-                
-                # Opzione Download
-                st.download_button("Scarica Riassunto", summary, file_name="riassunto.txt")
-                
-                # Debug: Mostra testo originale
-                with st.expander("Vedi testo originale estratto"):
-                    st.text(input_text)
-                    
-            except Exception as e:
-                st.error(f"Si è verificato un errore: {e}")
+            payload = {
+                "source_type": source_type,
+                "tier": tier,
+                "latency_budget": latency_budget or None,
+                "skip_unsupported_languages": skip_languages,
+            }
+            inputs = {"input.txt": input_text}
+            if openapi_info:
+                inputs["endpoints.json"] = json.dumps(openapi_info, ensure_ascii=False)
+            job_id = load_job_queue().submit("summarize", payload, inputs=inputs)
+            st.query_params["summary_job"] = job_id
+    
+    def show_summary(job):
+        with open(job["result"]["result_path"], "r", encoding="utf-8") as f:
+            summary = f.read()
+        
+        st.subheader("Risultato:")
+        st.markdown(f"> {summary}")
+        if job["result"].get("language"):
+            st.caption(f"Lingua rilevata: {', '.join(job['result']['language']['rows_by_language'])}")
+        
+        # Opzione Download
+        st.download_button("Scarica Riassunto", summary, file_name="riassunto.txt")
+        
+        # Debug: Mostra testo originale
+        with st.expander("Vedi testo originale estratto"):
+            with open(os.path.join(load_job_queue().job_dir(job["id"]), "input.txt"), "r", encoding="utf-8") as f:
+                st.text(f.read())
+    
+    render_job("summary_job", show_summary)
 
 # --- Pagina Sentiment ---
 elif app_mode == "😊 Sentiment Analysis":
@@ -159,10 +285,17 @@ elif app_mode == "😊 Sentiment Analysis":
     
     if input_method == "Analisi Singola":
         text = st.text_area("Scrivi una recensione:", "what a lovely day to do an exam!")
+        long_mode = st.checkbox(
+            "Modalità testo lungo (finestre scorrevoli invece del troncamento a 512 token)", value=False
+        )
         if st.button("Analizza"):
             with st.spinner("Analisi in corso..."):
                 analyzer = load_sentiment_analyzer()
-                result = analyzer.analyze(text)
+                if long_mode:
+                    result = analyzer.analyze_long([text], aggregation="mean")[0]
+                    st.caption(f"Testo analizzato in {result['windows']} finestre.")
+                else:
+                    result = analyzer.analyze(text)
                 
             label = result['label']
             score = result['score']
@@ -177,7 +310,9 @@ elif app_mode == "😊 Sentiment Analysis":
         uploaded_file = st.file_uploader("Carica CSV", type=["csv"])
         
         if uploaded_file:
-            df = pd.read_csv(uploaded_file)
+            # Solo le prime righe per l'anteprima: il file completo viene elaborato a chunk dal worker
+            df = pd.read_csv(uploaded_file, nrows=100)
+            uploaded_file.seek(0)
             st.write("Anteprima Dati:", df.head())
             
             # Cerca colonna testo
@@ -187,42 +322,59 @@ elif app_mode == "😊 Sentiment Analysis":
             if not text_col:
                 text_col = st.selectbox("Seleziona la colonna contenente il testo:", cols)
             
+            skip_languages = st.checkbox("Salta le righe in lingue non supportate dal modello (solo inglese)", value=True)
+            near_dedup = st.checkbox(
+                "Deduplica i quasi-duplicati (il modello analizza un testo per cluster e propaga la label)", value=False
+            )
+            
             if st.button("Analizza Dataset"):
-                analyzer = load_sentiment_analyzer()
-                
-                # Barra di progresso
-                progress_bar = st.progress(0)
-                results = []
-                texts = df[text_col].tolist()
-                
-                for i, text in enumerate(texts):
-                    # Gestione valori nulli
-                    if pd.isna(text):
-                        results.append(None)
-                    else:
-                        res = analyzer.analyze(str(text))
-                        results.append(res['label'])
-                    
-                    if i % 10 == 0:
-                        progress_bar.progress((i + 1) / len(texts))
-                
-                progress_bar.progress(1.0)
-                
-                df['sentiment'] = results
-                
-                st.success("Analisi completata!")
-                
-                # Visualizzazione Grafici
-                st.subheader("Distribuzione Sentiment")
-                
-                # Pie Chart
-                fig = px.pie(df, names='sentiment', title='Distribuzione Classi')
-                st.plotly_chart(fig)
-                
-                # Tabella Risultati
-                st.dataframe(df)
-                
-                # Download
-                csv = df.to_csv(index=False).encode('utf-8')
-                st.download_button("Scarica CSV con Sentiment", csv, "reviews_analyzed.csv", "text/csv")
-
+                job_id = load_job_queue().submit(
+                    "sentiment_csv",
+                    {"text_col": text_col, "skip_unsupported_languages": skip_languages, "near_dedup": near_dedup},
+                    # File-like: copiato su disco a blocchi, senza duplicarlo in memoria
+                    inputs={"input.csv": uploaded_file},
+                )
+                st.query_params["sentiment_job"] = job_id
+        
+        def show_sentiment_results(job):
+            result = job["result"]
+            
+            st.success(f"Analisi completata! {result['rows']} righe elaborate.")
+            st.caption(
+                f"Preprocessing: {result['preprocessing']['rows_out']}/{result['preprocessing']['rows_in']} righe valide "
+                f"({result['preprocessing']['rows_per_s']:.0f} righe/s)"
+            )
+            language = result.get("language")
+            if language:
+                st.caption(
+                    f"Lingue: {language['rows_skipped']} righe non supportate saltate "
+                    f"({language['compute_saved_pct']:.1f}% di calcolo risparmiato) - {language['rows_by_language']}"
+                )
+            dedup = result.get("dedup")
+            if dedup:
+                st.caption(
+                    f"Deduplica: {dedup['representatives']} testi analizzati, {dedup['propagated']} label propagate "
+                    f"({dedup['exact_duplicates']} duplicati esatti, {dedup['near_duplicates']} quasi-duplicati; "
+                    f"{100 * dedup['dedup_ratio']:.1f}% di inferenza evitata)"
+                )
+            
+            # Visualizzazione Grafici
+            st.subheader("Distribuzione Sentiment")
+            
+            # Pie Chart dai conteggi calcolati dal worker (senza rileggere il file dei risultati)
+            counts = pd.DataFrame(list(result["label_counts"].items()), columns=["sentiment", "count"])
+            fig = px.pie(counts, names='sentiment', values='count', title='Distribuzione Classi')
+            st.plotly_chart(fig)
+            
+            # Tabella Risultati (solo le prime righe)
+            preview_rows = 1000
+            st.dataframe(pd.read_csv(result["result_path"], nrows=preview_rows))
+            if result["rows"] > preview_rows:
+                st.caption(f"Mostrate le prime {preview_rows} righe: il risultato completo è nei file scaricabili.")
+            
+            # Download serviti in streaming dal server dei risultati: il file non viene letto a ogni rerun
+            result_download("Scarica CSV con Sentiment", job["id"], result["result_path"], "reviews_analyzed.csv")
+            if result.get("parquet_path"):
+                result_download("Scarica Parquet (probabilità per classe)", job["id"], result["parquet_path"], "reviews_analyzed.parquet")
+        
+        render_job("sentiment_job", show_sentiment_results)
@@ -2,34 +2,248 @@ import fitz  # PyMuPDF
 import trafilatura
 import yaml
 import json
+import os
+import re
+import hashlib
 import logging
-from typing import Optional, Dict, Any
+from collections import Counter
+from functools import wraps
+from typing import Optional, Dict, Any, List
+
+from src.preprocessing import SECTION_SEPARATOR, openapi_endpoint_text, openapi_spec_header
+from src.metrics import counter, histogram
 
 # Configura il logger se non è già stato fatto
 logger = logging.getLogger(__name__)
 
-def extract_from_pdf(file_path: str) -> str:
+INGESTION_SECONDS = histogram("ingestion_seconds", "Durata dell'estrazione del testo per tipo di sorgente", ["source"])
+INGESTION_DOCUMENTS = counter("ingestion_documents_total", "Documenti elaborati (result = ok / empty)", ["source", "result"])
+INGESTION_CHARS = counter("ingestion_chars_total", "Caratteri di testo estratti", ["source"])
+PDF_CACHE_REQUESTS = counter("pdf_cache_requests_total", "Richieste alla cache delle strutture PDF", ["result"])
+
+def _instrumented(source: str):
+    """Registra durata, esito e caratteri estratti di una funzione di ingestion che ritorna testo."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with INGESTION_SECONDS.labels(source=source).time():
+                text = fn(*args, **kwargs)
+            INGESTION_DOCUMENTS.labels(source=source, result="ok" if text else "empty").inc()
+            INGESTION_CHARS.labels(source=source).inc(len(text))
+            return text
+        return wrapper
+    return decorator
+
+# Versione dell'estrattore: va incrementata quando cambia la logica, così la cache viene invalidata
+PDF_EXTRACTOR_VERSION = 2
+PDF_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data', 'processed', 'pdf_cache'))
+
+# Tolleranza verticale (frazione di pagina) per considerare una riga sul bordo dell'area di testo:
+# intestazioni e piè di pagina si cercano tra la prima e l'ultima riga di ogni pagina,
+# ovunque si trovino (nei layout LaTeX il numero di pagina sta a ~85% dell'altezza)
+_EDGE_TOLERANCE = 0.015
+# Un titolo "in grassetto" deve avere almeno questi caratteri (evita frammenti come "eration):")
+_MIN_HEADING_CHARS = 4
+
+def _file_hash(file_path: str) -> str:
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+def _boilerplate_key(text: str) -> str:
+    # I numeri variano tra le pagine ("Pagina 3 di 10"): li normalizziamo
+    return re.sub(r"\d+", "#", text.strip().lower())
+
+def _edge_lines(lines: List[Dict]) -> Dict[str, List[int]]:
+    """Indici delle righe sul bordo superiore e inferiore dell'area di testo della pagina."""
+    if not lines:
+        return {"top": [], "bottom": []}
+    top = min(line["y0"] for line in lines)
+    bottom = max(line["y1"] for line in lines)
+    return {
+        "top": [i for i, line in enumerate(lines) if line["y0"] <= top + _EDGE_TOLERANCE],
+        "bottom": [i for i, line in enumerate(lines) if line["y1"] >= bottom - _EDGE_TOLERANCE],
+    }
+
+def _looks_like_heading(text: str) -> bool:
     """
-    Estrae testo da un file PDF preservando una struttura leggibile.
-    Usa PyMuPDF per velocità ed efficienza.
+    Un titolo inizia con maiuscola o numero e non finisce come un frammento di frase.
+    Una numerazione da sola ("2.1") è ammessa: il testo del titolo segue nella riga dopo.
     """
-    text_content = []
+    if re.fullmatch(r"\d+(\.\d+)*\.?", text.strip()):
+        return True
+    first = next((c for c in text if c.isalnum()), "")
+    return (
+        len(text) >= _MIN_HEADING_CHARS
+        and (first.isupper() or first.isdigit())
+        and not text.rstrip().endswith((")", ":", ",", ";", "-"))
+    )
+
+def _read_pdf_lines(doc) -> List[List[Dict]]:
+    """Righe di testo di ogni pagina con posizione, dimensione font e grassetto."""
+    pages = []
+    for page in doc:
+        height = page.rect.height or 1.0
+        lines = []
+        for block_no, block in enumerate(page.get_text("dict", sort=True)["blocks"]):
+            if block.get("type") != 0:  # 0 = testo, 1 = immagine
+                continue
+            for line in block["lines"]:
+                # Gli span di soli spazi contano per il testo ma non per font e grassetto
+                spans = [span for span in line["spans"] if span["text"].strip()]
+                if not spans:
+                    continue
+                lines.append({
+                    "text": "".join(span["text"] for span in line["spans"]).strip(),
+                    "size": round(max(span["size"] for span in spans), 1),
+                    "bold": all(span["flags"] & 16 for span in spans),
+                    "block": block_no,
+                    "y0": line["bbox"][1] / height,
+                    "y1": line["bbox"][3] / height,
+                })
+        pages.append(lines)
+    return pages
+
+def extract_pdf_structure(file_path: str, use_cache: bool = True) -> Dict[str, Any]:
+    """
+    Estrazione strutturata da PDF basata sui blocchi di testo (page.get_text("dict")).
+    - rimuove intestazioni, piè di pagina e numeri di pagina: prime/ultime righe dell'area
+      di testo che si ripetono su molte pagine
+    - riconosce i titoli di sezione (font più grande del corpo o righe isolate in grassetto,
+      con iniziale maiuscola o numero e senza ")" o ":" finali)
+    - mette in cache il risultato per hash del file, così riaprire un PDF grande è immediato
+    Ritorna {'pages', 'sections': [{'heading', 'text', 'page'}], 'removed_lines'}.
+    """
+    cache_path = None
+    if use_cache:
+        os.makedirs(PDF_CACHE_DIR, exist_ok=True)
+        cache_path = os.path.join(PDF_CACHE_DIR, f"{_file_hash(file_path)}-v{PDF_EXTRACTOR_VERSION}.json")
+        if os.path.exists(cache_path):
+            PDF_CACHE_REQUESTS.labels(result="hit").inc()
+            with open(cache_path, "r", encoding="utf-8") as f:
+                logger.info(f"Struttura PDF caricata dalla cache: {file_path}")
+                return json.load(f)
+        PDF_CACHE_REQUESTS.labels(result="miss").inc()
+
+    doc = fitz.open(file_path)
     try:
-        doc = fitz.open(file_path)
-        for page_num, page in enumerate(doc):
-            # Estrae testo semplice. Si potrebbe migliorare usando 'blocks' per layout complessi
-            text = page.get_text()
-            if text.strip():
-                text_content.append(text)
-        
+        pages = _read_pdf_lines(doc)
+    finally:
         doc.close()
-        full_text = "\n".join(text_content)
+
+    # 1. Intestazioni/piè di pagina: prime e ultime righe di ogni pagina che si ripetono su molte pagine
+    #    (conteggi separati per bordo: un "1" in cima a un capitolo non è un numero di pagina)
+    page_edges = [_edge_lines(lines) for lines in pages]
+    edge_pages = {"top": Counter(), "bottom": Counter()}
+    for lines, edges in zip(pages, page_edges):
+        for edge, indices in edges.items():
+            edge_pages[edge].update({_boilerplate_key(lines[i]["text"]) for i in indices})
+    min_repeats = max(2, len(pages) // 2)
+    boilerplate = {
+        edge: {key for key, count in counts.items() if count >= min_repeats}
+        for edge, counts in edge_pages.items()
+    }
+    removable = [
+        {i for edge, indices in edges.items() for i in indices
+         if _boilerplate_key(lines[i]["text"]) in boilerplate[edge]}
+        for lines, edges in zip(pages, page_edges)
+    ]
+
+    # 2. Dimensione del font del corpo: la più frequente, pesata per numero di caratteri
+    size_chars = Counter()
+    for lines in pages:
+        for line in lines:
+            size_chars[line["size"]] += len(line["text"])
+    body_size = size_chars.most_common(1)[0][0] if size_chars else 0.0
+
+    block_lines = Counter((page_no, line["block"]) for page_no, lines in enumerate(pages) for line in lines)
+
+    # 3. Ricostruzione delle sezioni
+    sections = []
+    current = {"heading": None, "paragraphs": [], "page": 1}
+    last_heading_block = None
+    removed = 0
+    for page_no, lines in enumerate(pages):
+        paragraph, last_block = [], None
+        for line_no, line in enumerate(lines):
+            if line_no in removable[page_no]:
+                removed += 1
+                continue
+
+            heading_style = len(line["text"]) <= 120 and (
+                line["size"] >= body_size * 1.15
+                or (line["bold"] and block_lines[(page_no, line["block"])] == 1)
+            )
+            # Titolo su più righe dello stesso blocco: resta un unico titolo
+            if (heading_style and current["heading"] and not current["paragraphs"] and not paragraph
+                    and last_heading_block == (page_no, line["block"])):
+                current["heading"] += " " + line["text"]
+                continue
+            if heading_style and _looks_like_heading(line["text"]):
+                last_heading_block = (page_no, line["block"])
+                if paragraph:
+                    current["paragraphs"].append("\n".join(paragraph))
+                    paragraph = []
+                if current["heading"] or current["paragraphs"]:
+                    sections.append(current)
+                current = {"heading": line["text"], "paragraphs": [], "page": page_no + 1}
+                last_block = None
+                continue
+
+            if last_block is not None and line["block"] != last_block and paragraph:
+                current["paragraphs"].append("\n".join(paragraph))
+                paragraph = []
+            paragraph.append(line["text"])
+            last_block = line["block"]
+        if paragraph:
+            current["paragraphs"].append("\n".join(paragraph))
+    if current["heading"] or current["paragraphs"]:
+        sections.append(current)
+
+    structure = {
+        "pages": len(pages),
+        "sections": [
+            {"heading": sec["heading"], "text": "\n\n".join(sec["paragraphs"]), "page": sec["page"]}
+            for sec in sections
+        ],
+        "removed_lines": removed,
+    }
+    logger.info(
+        f"PDF {file_path}: {len(pages)} pagine, {len(structure['sections'])} sezioni, "
+        f"{removed} righe di intestazione/piè di pagina rimosse."
+    )
+
+    if cache_path:
+        tmp_path = f"{cache_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(structure, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    return structure
+
+@_instrumented("pdf")
+def extract_from_pdf(file_path: str, use_cache: bool = True) -> str:
+    """
+    Estrae testo da un file PDF preservando una struttura leggibile.
+    Usa PyMuPDF per velocità ed efficienza: estrazione a blocchi, senza intestazioni
+    e piè di pagina ripetuti. Le sezioni sono separate da SECTION_SEPARATOR,
+    che il chunker usa come confine preferenziale.
+    """
+    try:
+        structure = extract_pdf_structure(file_path, use_cache=use_cache)
+        sections = []
+        for section in structure["sections"]:
+            parts = [p for p in (section["heading"], section["text"]) if p]
+            sections.append("\n\n".join(parts))
+        full_text = SECTION_SEPARATOR.join(sections)
         logger.info(f"Estratti {len(full_text)} caratteri da PDF: {file_path}")
         return full_text
     except Exception as e:
         logger.error(f"Errore nell'estrazione PDF {file_path}: {e}")
         return ""
 
+@_instrumented("url")
 def extract_from_url(url: str) -> str:
     """
     Scarica e estrae il contenuto principale da una pagina web, rimuovendo boilerplate.
@@ -51,41 +265,54 @@ def extract_from_url(url: str) -> str:
         logger.error(f"Errore nell'estrazione URL {url}: {e}")
         return ""
 
+HTTP_METHODS = ['get', 'post', 'put', 'delete', 'patch']
+
+def parse_openapi_endpoints(file_content: str, is_json: bool = False) -> Dict[str, Any]:
+    """
+    Estrae da una specifica OpenAPI (JSON/YAML) i record strutturati degli endpoint.
+    Ritorna {'title', 'description', 'endpoints': [{'method', 'path', 'tag', 'summary', 'description'}]}.
+    Il 'tag' è il primo tag dell'operazione o, in mancanza, il prefisso del path (primo segmento).
+    """
+    if is_json:
+        spec = json.loads(file_content)
+    else:
+        spec = yaml.safe_load(file_content)
+
+    info = spec.get('info', {})
+    endpoints = []
+    for path, methods in spec.get('paths', {}).items():
+        for method, details in methods.items():
+            if method not in HTTP_METHODS:
+                continue
+            details = details or {}
+            tags = details.get('tags') or []
+            prefix = "/" + path.strip("/").split("/")[0] if path.strip("/") else "/"
+            endpoints.append({
+                "method": method.upper(),
+                "path": path,
+                "tag": tags[0] if tags else prefix,
+                "summary": (details.get('summary') or '').strip(),
+                "description": (details.get('description') or '').strip(),
+            })
+
+    return {
+        "title": info.get('title', 'API Document'),
+        "description": info.get('description', ''),
+        "endpoints": endpoints,
+    }
+
+@_instrumented("openapi")
 def parse_openapi_spec(file_content: str, is_json: bool = False) -> str:
     """
     Converte una specifica OpenAPI (JSON/YAML) in un testo descrittivo discorsivo
     adatto per la summarization.
     """
     try:
-        if is_json:
-            spec = json.loads(file_content)
-        else:
-            spec = yaml.safe_load(file_content)
-            
-        output_text = []
-        
-        # Info generali
-        info = spec.get('info', {})
-        title = info.get('title', 'API Document')
-        desc = info.get('description', '')
-        output_text.append(f"Titolo API: {title}\nDescrizione Generale: {desc}\n")
-        
-        # Iterazione sui Paths
-        paths = spec.get('paths', {})
-        for path, methods in paths.items():
-            for method, details in methods.items():
-                if method in ['get', 'post', 'put', 'delete', 'patch']:
-                    summary = details.get('summary', '')
-                    description = details.get('description', '')
-                    
-                    endpoint_desc = f"Endpoint: {method.upper()} {path}"
-                    if summary:
-                        endpoint_desc += f"\nRiepilogo: {summary}"
-                    if description:
-                        endpoint_desc += f"\nDettagli: {description}"
-                    
-                    output_text.append(endpoint_desc)
-        
+        spec_info = parse_openapi_endpoints(file_content, is_json=is_json)
+        output_text = [openapi_spec_header(spec_info)]
+        for ep in spec_info["endpoints"]:
+            output_text.append(openapi_endpoint_text([f"{ep['method']} {ep['path']}"], ep["summary"], ep["description"]))
+
         final_text = "\n\n".join(output_text)
         logger.info(f"Convertita specifica OpenAPI in testo di {len(final_text)} caratteri.")
         return final_text
@@ -93,4 +320,3 @@ def parse_openapi_spec(file_content: str, is_json: bool = False) -> str:
     except Exception as e:
         logger.error(f"Errore nel parsing OpenAPI: {e}")
         return ""
-
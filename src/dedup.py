@@ -0,0 +1,431 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Add project root to sys.path (lo script può essere lanciato come `python src/dedup.py`)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.metrics import counter
+from src.preprocessing import preprocess_batch
+from src.utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEDUP_ROWS = counter(
+    "dedup_rows_total", "Righe della deduplica (representative = inferenza, propagated = label propagata)", ["result"]
+)
+
+# Permutazioni (a * x + b) mod p con p primo di Mersenne 2^61 - 1, troncate a 32 bit
+# (stesso schema di datasketch; l'overflow uint64 del prodotto è voluto)
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MASK_32 = np.uint64(0xFFFFFFFF)
+
+
+def _shingle_hashes(texts: Sequence[str], shingle_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Shingle di `shingle_size` parole consecutive, come hash a 32 bit, per tutti i testi insieme.
+    Ritorna (hash, indice del testo di ogni shingle) ordinati per testo.
+    I testi con meno parole di `shingle_size` usano le singole parole; i testi vuoti un hash fisso.
+    """
+    n = len(texts)
+    tokens = pd.Series(texts, dtype=object).fillna("").astype(str).str.lower().str.findall(r"\w+").explode()
+    tokens = tokens.dropna()
+    parents = tokens.index.to_numpy(dtype=np.int64)
+    token_hashes = pd.util.hash_array(tokens.to_numpy(dtype=object))
+
+    # Combinazione vettorizzata degli hash di parole consecutive (overflow uint64 voluto)
+    k = shingle_size
+    if len(token_hashes) >= k:
+        combined = token_hashes[:len(token_hashes) - k + 1].copy()
+        for offset in range(1, k):
+            combined = combined * np.uint64(1099511628211) + token_hashes[offset:len(token_hashes) - k + 1 + offset]
+        valid = parents[:len(parents) - k + 1] == parents[k - 1:]
+        shingles, shingle_parents = combined[valid], parents[:len(parents) - k + 1][valid]
+    else:
+        shingles, shingle_parents = np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+
+    # Testi corti: unigrammi; testi vuoti: un solo hash fisso (sono tutti identici tra loro)
+    has_shingles = np.bincount(shingle_parents, minlength=n) > 0
+    short = ~has_shingles[parents]
+    empty = np.flatnonzero(np.bincount(parents, minlength=n) == 0)
+    shingles = np.concatenate([shingles, token_hashes[short], np.zeros(len(empty), dtype=np.uint64)])
+    shingle_parents = np.concatenate([shingle_parents, parents[short], empty])
+
+    order = np.argsort(shingle_parents, kind="stable")
+    folded = (shingles >> np.uint64(32)) ^ (shingles & _MASK_32)
+    return folded[order], shingle_parents[order]
+
+
+def minhash_signatures(texts: Sequence[str], num_perm: int = 128, shingle_size: int = 3, seed: int = 42,
+                       block_size: int = 2048) -> np.ndarray:
+    """
+    Firme MinHash (n_testi, num_perm) calcolate in modo vettorizzato:
+    per ogni blocco di testi si applicano le `num_perm` permutazioni a tutti gli shingle
+    con un'unica operazione e si prende il minimo per testo con np.minimum.reduceat.
+    """
+    n = len(texts)
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, (1 << 61) - 1, size=num_perm, dtype=np.uint64)
+
+    shingles, parents = _shingle_hashes(texts, shingle_size)
+    # Ogni testo ha almeno uno shingle: gli offset delimitano segmenti non vuoti
+    offsets = np.searchsorted(parents, np.arange(n + 1))
+
+    signatures = np.empty((n, num_perm), dtype=np.uint32)
+    for start in range(0, n, block_size):
+        end = min(start + block_size, n)
+        block = shingles[offsets[start]:offsets[end]]
+        permuted = ((block[:, None] * a + b) % _MERSENNE_PRIME) & _MASK_32
+        signatures[start:end] = np.minimum.reduceat(permuted, offsets[start:end] - offsets[start], axis=0).astype(np.uint32)
+    return signatures
+
+
+def _connected_components(n: int, left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    """
+    Union-find vettorizzato: propaga il minimo indice lungo gli archi e comprime i puntatori
+    finché non converge. Ritorna per ogni nodo il nodo minimo della sua componente.
+    """
+    labels = np.arange(n, dtype=np.int64)
+    while True:
+        previous = labels.copy()
+        smallest = np.minimum(labels[left], labels[right])
+        np.minimum.at(labels, left, smallest)
+        np.minimum.at(labels, right, smallest)
+        labels = labels[labels]
+        if np.array_equal(labels, previous):
+            return labels
+
+
+def lsh_bands(num_perm: int, threshold: float) -> int:
+    """
+    Numero di bande per l'LSH: la soglia a cui una coppia diventa candidata con probabilità 1/2,
+    circa (1 / bands) ** (1 / rows), deve stare appena sotto `threshold` per non perdere coppie.
+    """
+    divisors = [b for b in range(1, num_perm + 1) if num_perm % b == 0]
+    below = [b for b in divisors if (1 / b) ** (b / num_perm) <= threshold]
+    return min(below) if below else num_perm
+
+def cluster_near_duplicates(texts: Sequence[str], threshold: float = 0.8, num_perm: int = 128, bands: Optional[int] = None,
+                            shingle_size: int = 3, signatures: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Cluster di quasi-duplicati con LSH a bande sulle firme MinHash.
+    1. per ogni banda, i testi con le stesse `num_perm // bands` righe finiscono nello stesso bucket
+       (di default il numero di bande è scelto da `threshold`, vedi lsh_bands)
+    2. ogni testo è candidato con il primo testo del bucket; la coppia viene tenuta solo se
+       la similarità di Jaccard stimata dalle firme è almeno `threshold`
+    3. le coppie vengono unite in componenti connesse (union-find)
+    Ritorna per ogni testo l'indice del rappresentante del suo cluster (il primo testo del cluster).
+    """
+    bands = bands or lsh_bands(num_perm, threshold)
+    if num_perm % bands:
+        raise ValueError(f"num_perm ({num_perm}) deve essere multiplo di bands ({bands}).")
+    n = len(texts)
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    if signatures is None:
+        signatures = minhash_signatures(texts, num_perm=num_perm, shingle_size=shingle_size)
+
+    rows = num_perm // bands
+    positions = pd.Series(np.arange(n))
+    left, right = [], []
+    for band in range(bands):
+        keys = pd.util.hash_pandas_object(pd.DataFrame(signatures[:, band * rows:(band + 1) * rows]), index=False)
+        leaders = positions.groupby(keys.to_numpy()).transform("min").to_numpy()
+        candidates = np.flatnonzero(leaders != positions.to_numpy())
+        left.append(candidates)
+        right.append(leaders[candidates])
+    left, right = np.concatenate(left), np.concatenate(right)
+
+    # Verifica dei candidati: scarta i falsi positivi dell'LSH
+    similarity = (signatures[left] == signatures[right]).mean(axis=1)
+    keep = similarity >= threshold
+    return _connected_components(n, left[keep], right[keep])
+
+
+def _band_keys(signatures: np.ndarray, bands: int) -> np.ndarray:
+    """Chiave (uint64) di ogni banda della firma: matrice (n_testi, bands)."""
+    rows = signatures.shape[1] // bands
+    keys = np.empty((len(signatures), bands), dtype=np.uint64)
+    for band in range(bands):
+        keys[:, band] = pd.util.hash_pandas_object(
+            pd.DataFrame(signatures[:, band * rows:(band + 1) * rows]), index=False
+        ).to_numpy()
+    return keys
+
+
+class NearDuplicateIndex:
+    """
+    Indice LSH dei rappresentanti che persiste tra chiamate successive (es. i chunk di un CSV):
+    i testi di ogni nuovo chunk vengono confrontati fra loro e con i rappresentanti già visti.
+    1. i duplicati esatti vengono raggruppati subito (le firme si calcolano solo sui testi distinti)
+    2. i testi distinti vengono raggruppati in cluster con cluster_near_duplicates
+    3. il leader di ogni cluster viene cercato nell'indice: per ogni banda un array ordinato
+       di chiavi, i candidati sono verificati sulla similarità stimata dalle firme
+    Ogni rappresentante riceve un id globale progressivo. L'indice occupa circa
+    4 * num_perm + 16 * bands + 16 byte per rappresentante: oltre `max_size` smette di crescere
+    (i nuovi testi si deduplicano ancora nel proprio chunk e contro i rappresentanti già indicizzati).
+    """
+    def __init__(self, threshold: float = 0.8, num_perm: int = 128, bands: Optional[int] = None,
+                 shingle_size: int = 3, max_size: Optional[int] = 200_000):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands or lsh_bands(num_perm, threshold)
+        if num_perm % self.bands:
+            raise ValueError(f"num_perm ({num_perm}) deve essere multiplo di bands ({self.bands}).")
+        self.shingle_size = shingle_size
+        self.max_size = max_size
+        # Id globali assegnati finora (anche ai rappresentanti non indicizzati oltre max_size)
+        self.num_representatives = 0
+        # Array a capacità crescente (raddoppio): i rappresentanti già indicizzati non vengono ricopiati a ogni chunk
+        self._size = 0
+        self._ids = np.empty(0, dtype=np.int64)
+        self._text_hashes = np.empty(0, dtype=np.uint64)
+        self._signatures = np.empty((0, num_perm), dtype=np.uint32)
+        self._keys = [np.empty(0, dtype=np.uint64) for _ in range(self.bands)]
+        self._positions = [np.empty(0, dtype=np.int64) for _ in range(self.bands)]
+        self.totals = Counter()
+
+    @property
+    def size(self) -> int:
+        """Rappresentanti indicizzati."""
+        return self._size
+
+    def _reserve(self, size: int):
+        if size <= len(self._ids):
+            return
+        capacity = max(size, 2 * len(self._ids), 1024)
+        if self.max_size is not None:
+            capacity = min(capacity, self.max_size)
+        for name in ("_ids", "_text_hashes", "_signatures"):
+            old = getattr(self, name)
+            grown = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            grown[:self._size] = old[:self._size]
+            setattr(self, name, grown)
+
+    def _lookup(self, signatures: np.ndarray, keys: np.ndarray) -> np.ndarray:
+        """Per ogni firma la posizione del rappresentante indicizzato più vecchio abbastanza simile (-1 se nessuno)."""
+        match = np.full(len(signatures), np.iinfo(np.int64).max, dtype=np.int64)
+        if self.size == 0 or len(signatures) == 0:
+            return np.full(len(signatures), -1, dtype=np.int64)
+        for band in range(self.bands):
+            band_keys = self._keys[band]
+            slots = np.minimum(np.searchsorted(band_keys, keys[:, band]), len(band_keys) - 1)
+            queries = np.flatnonzero(band_keys[slots] == keys[:, band])
+            candidates = self._positions[band][slots[queries]]
+            similarity = (signatures[queries] == self._signatures[candidates]).mean(axis=1)
+            verified = similarity >= self.threshold
+            np.minimum.at(match, queries[verified], candidates[verified])
+        match[match == np.iinfo(np.int64).max] = -1
+        return match
+
+    def _insert(self, ids: np.ndarray, text_hashes: np.ndarray, signatures: np.ndarray, keys: np.ndarray):
+        if self.max_size is not None:
+            room = max(self.max_size - self.size, 0)
+            ids, text_hashes, signatures, keys = ids[:room], text_hashes[:room], signatures[:room], keys[:room]
+        if len(ids) == 0:
+            return
+        offset = self.size
+        self._reserve(offset + len(ids))
+        self._ids[offset:offset + len(ids)] = ids
+        self._text_hashes[offset:offset + len(ids)] = text_hashes
+        self._signatures[offset:offset + len(ids)] = signatures
+        self._size = offset + len(ids)
+        positions = offset + np.arange(len(ids), dtype=np.int64)
+        for band in range(self.bands):
+            # A parità di chiave resta il rappresentante già indicizzato (il più vecchio)
+            all_keys = np.concatenate([self._keys[band], keys[:, band]])
+            all_positions = np.concatenate([self._positions[band], positions])
+            order = np.argsort(all_keys, kind="stable")
+            sorted_keys = all_keys[order]
+            first = np.ones(len(sorted_keys), dtype=bool)
+            first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+            self._keys[band] = sorted_keys[first]
+            self._positions[band] = all_positions[order][first]
+
+    def add(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, Dict]:
+        """
+        Deduplica `texts` fra loro e contro i rappresentanti già visti.
+        Ritorna (indici in `texts` dei nuovi rappresentanti, da passare al modello nell'ordine dato;
+        per ogni testo l'id globale del suo rappresentante; statistiche).
+        Statistiche: duplicati esatti (stesso testo del rappresentante), quasi-duplicati
+        e righe il cui rappresentante viene da una chiamata precedente.
+        """
+        start = time.perf_counter()
+        n = len(texts)
+        series = pd.Series(list(texts), dtype=object).fillna("").astype(str)
+        codes, uniques = pd.factorize(series)
+        uniques = list(uniques)
+        # I codici di factorize seguono l'ordine di prima apparizione
+        first_rows = np.flatnonzero(~pd.Series(codes).duplicated().to_numpy())
+        text_hashes = pd.util.hash_array(np.asarray(uniques, dtype=object))
+
+        if uniques:
+            signatures = minhash_signatures(uniques, num_perm=self.num_perm, shingle_size=self.shingle_size)
+            keys = _band_keys(signatures, self.bands)
+            local = cluster_near_duplicates(uniques, threshold=self.threshold, num_perm=self.num_perm,
+                                            bands=self.bands, signatures=signatures)
+        else:
+            signatures = np.empty((0, self.num_perm), dtype=np.uint32)
+            keys = np.empty((0, self.bands), dtype=np.uint64)
+            local = np.empty(0, dtype=np.int64)
+        leaders, leader_of = np.unique(local, return_inverse=True)
+
+        # Leader già rappresentati da un chunk precedente
+        match = self._lookup(signatures[leaders], keys[leaders])
+        matched = match >= 0
+        leader_ids = np.empty(len(leaders), dtype=np.int64)
+        leader_ids[matched] = self._ids[match[matched]]
+        new = np.flatnonzero(~matched)
+        leader_ids[new] = self.num_representatives + np.arange(len(new))
+        self.num_representatives += len(new)
+        self._insert(leader_ids[new], text_hashes[leaders[new]], signatures[leaders[new]], keys[leaders[new]])
+
+        row_ids = leader_ids[leader_of][codes]
+        representatives = first_rows[leaders[new]]
+
+        # Duplicato esatto: stesso testo del proprio rappresentante (anche di un chunk precedente)
+        leader_hashes = text_hashes[leaders]
+        leader_hashes[matched] = self._text_hashes[match[matched]]
+        is_representative = np.zeros(n, dtype=bool)
+        is_representative[representatives] = True
+        exact = (leader_hashes[leader_of] == text_hashes)[codes] & ~is_representative
+        from_previous = matched[leader_of][codes]
+
+        stats = {
+            "rows": n,
+            "representatives": len(representatives),
+            "propagated": n - len(representatives),
+            "exact_duplicates": int(exact.sum()),
+            "near_duplicates": int((~exact & ~is_representative).sum()),
+            "from_previous_chunks": int(from_previous.sum()),
+            "dedup_ratio": 1 - len(representatives) / n if n else 0.0,
+            "indexed": self.size,
+            "seconds": time.perf_counter() - start,
+        }
+        self.totals.update({k: stats[k] for k in ("rows", "representatives", "propagated", "exact_duplicates",
+                                                  "near_duplicates", "from_previous_chunks")})
+        DEDUP_ROWS.labels(result="representative").inc(stats["representatives"])
+        DEDUP_ROWS.labels(result="exact_duplicate").inc(stats["exact_duplicates"])
+        DEDUP_ROWS.labels(result="near_duplicate").inc(stats["near_duplicates"])
+        logger.info(
+            f"Deduplica: {stats['rows']} testi -> {stats['representatives']} rappresentanti "
+            f"({stats['exact_duplicates']} duplicati esatti, {stats['near_duplicates']} quasi-duplicati, "
+            f"{stats['from_previous_chunks']} da chunk precedenti; "
+            f"{100 * stats['dedup_ratio']:.1f}% di inferenza evitata) in {stats['seconds']:.2f}s."
+        )
+        return representatives, row_ids, stats
+
+
+def deduplicate(texts: Sequence[str], threshold: float = 0.8, **kwargs) -> Tuple[np.ndarray, np.ndarray, Dict]:
+    """
+    Ritorna (indici dei rappresentanti, per ogni testo la posizione del suo rappresentante
+    nell'array dei rappresentanti, statistiche). Solo i rappresentanti vanno passati al modello.
+    """
+    # Con un indice nuovo gli id globali coincidono con le posizioni nell'array dei rappresentanti
+    return NearDuplicateIndex(threshold=threshold, max_size=None, **kwargs).add(texts)
+
+
+def analyze_deduplicated(analyzer, texts: Sequence[str], batch_size: int = 32, threshold: float = 0.8, **kwargs):
+    """
+    Analisi sentiment con deduplica: il modello classifica solo i rappresentanti dei cluster
+    e label e probabilità vengono propagate agli altri testi.
+    Ritorna (SentimentBatchResult per tutti i testi, statistiche della deduplica).
+    """
+    texts = list(texts)
+    representatives, inverse, stats = deduplicate(texts, threshold=threshold, **kwargs)
+    result = analyzer.analyze_columnar([texts[i] for i in representatives], batch_size=batch_size)
+    return result.take(inverse), stats
+
+
+def _count_shift(labels: np.ndarray, reference: np.ndarray) -> float:
+    """Quota di righe da spostare tra le classi perché i conteggi di `labels` coincidano con quelli di `reference`."""
+    counts = pd.Series(labels).value_counts()
+    reference_counts = pd.Series(reference).value_counts()
+    difference = counts.sub(reference_counts, fill_value=0).abs().sum()
+    return float(difference / 2 / len(labels)) if len(labels) else 0.0
+
+
+def evaluate_dedup(df: pd.DataFrame, text_col: str, label_col: str, threshold: float = 0.8,
+                   analyzer=None, batch_size: int = 32) -> Dict:
+    """
+    Impatto della deduplica su un dataset etichettato.
+    - label_consistency: quota di testi la cui label coincide con quella del loro rappresentante
+      (è l'accuratezza massima ottenibile propagando le predizioni), anche separata per
+      duplicati esatti e quasi-duplicati (NaN se non ce ne sono)
+    - label_count_shift: quanto cambiano i conteggi per classe propagando le label vere
+    - con `analyzer`: accuratezza del modello con e senza deduplica, accordo tra le due predizioni
+      e variazione dei conteggi per classe (prediction_count_shift)
+    """
+    df, _ = preprocess_batch(df, text_col, drop_duplicates=False)
+    texts = df[text_col].tolist()
+    gold = df[label_col].astype(str).to_numpy()
+
+    representatives, inverse, stats = deduplicate(texts, threshold=threshold)
+    propagated_gold = gold[representatives][inverse]
+    report = dict(stats)
+    report["label_consistency"] = float((propagated_gold == gold).mean())
+    report["label_count_shift"] = _count_shift(propagated_gold, gold)
+    # Consistenza separata per duplicati esatti e quasi-duplicati: solo i secondi dipendono dalla soglia
+    representative_texts = np.asarray(texts, dtype=object)[representatives][inverse]
+    duplicates = representatives[inverse] != np.arange(len(texts))
+    exact = duplicates & (representative_texts == np.asarray(texts, dtype=object))
+    for name, mask in (("exact", exact), ("near", duplicates & ~exact)):
+        report[f"label_consistency_{name}"] = float((propagated_gold[mask] == gold[mask]).mean()) if mask.any() else float("nan")
+
+    if analyzer is not None:
+        start = time.perf_counter()
+        full = analyzer.analyze_columnar(texts, batch_size=batch_size)
+        full_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        dedup = analyzer.analyze_columnar([texts[i] for i in representatives], batch_size=batch_size).take(inverse)
+        dedup_seconds = time.perf_counter() - start + stats["seconds"]
+
+        full_labels = np.array(full.labels, dtype=object)[full.label_ids]
+        dedup_labels = np.array(dedup.labels, dtype=object)[dedup.label_ids]
+        report["prediction_agreement"] = float((full_labels == dedup_labels).mean())
+        report["prediction_count_shift"] = _count_shift(dedup_labels, full_labels)
+        report["inference_seconds_full"] = full_seconds
+        report["inference_seconds_dedup"] = dedup_seconds
+        # L'accuratezza ha senso solo se le label del dataset sono classi del modello
+        if set(gold) <= set(full.labels):
+            report["accuracy_full"] = float((full_labels == gold).mean())
+            report["accuracy_dedup"] = float((dedup_labels == gold).mean())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deduplica dei quasi-duplicati e impatto sull'accuratezza")
+    parser.add_argument("--data_path", type=str, default="data/raw/training_dataset.csv", help="CSV etichettato")
+    parser.add_argument("--text_col", type=str, default="question", help="Colonna del testo")
+    parser.add_argument("--label_col", type=str, default="label", help="Colonna della label")
+    parser.add_argument("--threshold", type=float, nargs="+", default=[0.8], help="Soglie di similarità di Jaccard da valutare")
+    parser.add_argument("--with_model", action="store_true", help="Esegue anche l'inferenza (accuratezza con e senza deduplica)")
+    parser.add_argument("--batch_size", type=int, default=32, help="Batch size di inferenza")
+    args = parser.parse_args()
+
+    setup_logging()
+    df = pd.read_csv(args.data_path)
+    analyzer = None
+    if args.with_model:
+        from src.model_pool import get_model_pool
+        analyzer = get_model_pool().sentiment_analyzer()
+
+    rows = []
+    for threshold in args.threshold:
+        report = evaluate_dedup(df, args.text_col, args.label_col, threshold=threshold,
+                                analyzer=analyzer, batch_size=args.batch_size)
+        rows.append({"threshold": threshold, **report})
+    # Le colonne dell'indice tra chunk non servono per una valutazione in un solo passaggio
+    report = pd.DataFrame(rows).drop(columns=["seconds", "from_previous_chunks", "indexed"])
+    print(report.to_string(index=False, float_format="{:.3f}".format))
+
+if __name__ == "__main__":
+    main()
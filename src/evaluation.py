@@ -4,10 +4,12 @@ import sys
 # Add project root to sys.path
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
+import json
+import time
 import logging
 import evaluate
 import pandas as pd
-from summarization import SummarizerModule
+from summarization import SummarizerModule, load_tier_profiles, TIER_PROFILES_PATH
 from tabulate import tabulate
 
 
@@ -150,12 +152,96 @@ def evaluate_summarization(num_samples=3, model_name="efederici/it5-base-summari
     
     return results
 
+def benchmark_tiers(num_samples=10, save_profiles=True):
+    """
+    Benchmarks every summarizer tier (see SUMMARIZER_TIERS) on the curated dataset,
+    reporting latency and ROUGE so the latency/quality tradeoff is visible.
+    Measured latencies are saved and used by SummarizerRouter for its estimates.
+    """
+    try:
+        rouge = evaluate.load("rouge")
+    except Exception as e:
+        logger.error(f"Failed to load ROUGE metric: {e}")
+        return
+
+    data_subset = get_manual_test_data()[:num_samples]
+    references = [item['summary'] for item in data_subset]
+    total_words = sum(len(item['text'].split()) for item in data_subset)
+
+    tiers = load_tier_profiles()
+    rows = []
+    profiles = {}
+
+    for tier_name, tier_cfg in tiers.items():
+        model_name = tier_cfg["model_name"]
+        logger.info(f"Benchmarking tier '{tier_name}' ({model_name})...")
+        try:
+            summarizer = SummarizerModule(model_name=model_name)
+        except Exception as e:
+            logger.error(f"Failed to load tier {tier_name}: {e}")
+            continue
+
+        # Warm-up so the first sample does not pay one-off initialization costs
+        summarizer.summarize(data_subset[0]['text'])
+
+        predictions = []
+        latencies = []
+        for item in data_subset:
+            start = time.perf_counter()
+            predictions.append(summarizer.summarize(item['text']))
+            latencies.append(time.perf_counter() - start)
+
+        scores = rouge.compute(predictions=predictions, references=references)
+        ms_per_word = sum(latencies) * 1000 / total_words
+        latencies_sorted = sorted(latencies)
+        p95 = latencies_sorted[min(len(latencies_sorted) - 1, int(0.95 * len(latencies_sorted)))]
+
+        rows.append([
+            tier_name,
+            model_name,
+            f"{sum(latencies) / len(latencies):.2f}s",
+            f"{p95:.2f}s",
+            f"{ms_per_word:.1f}",
+            f"{scores['rouge1']*100:.2f}%",
+            f"{scores['rouge2']*100:.2f}%",
+            f"{scores['rougeL']*100:.2f}%",
+        ])
+        profiles[tier_name] = {
+            "ms_per_word": round(ms_per_word, 2),
+            "rouge1": round(scores['rouge1'], 4),
+            "rougeL": round(scores['rougeL'], 4),
+            # Measured: the router may now pick this tier automatically
+            "provisional": False,
+        }
+        del summarizer
+
+    print("\n" + "="*50)
+    print("SUMMARIZER TIERS: LATENCY / ROUGE TRADEOFF")
+    print("="*50)
+    print(tabulate(
+        rows,
+        headers=["Tier", "Model", "Mean latency", "p95 latency", "ms/word", "ROUGE-1", "ROUGE-2", "ROUGE-L"],
+        tablefmt="simple",
+    ))
+
+    if save_profiles and profiles:
+        os.makedirs(os.path.dirname(TIER_PROFILES_PATH), exist_ok=True)
+        with open(TIER_PROFILES_PATH, "w", encoding="utf-8") as f:
+            json.dump(profiles, f, indent=2)
+        logger.info(f"Tier profiles saved to {TIER_PROFILES_PATH}")
+
+    return profiles
+
 if __name__ == "__main__":
     samples = 3
-    if len(sys.argv) > 1:
+    args = [arg for arg in sys.argv[1:] if arg != "--tiers"]
+    if args:
         try:
-            samples = int(sys.argv[1])
+            samples = int(args[0])
         except ValueError:
             pass
             
-    evaluate_summarization(num_samples=samples)
\ No newline at end of file
+    if "--tiers" in sys.argv:
+        benchmark_tiers(num_samples=samples)
+    else:
+        evaluate_summarization(num_samples=samples)
\ No newline at end of file
@@ -0,0 +1,649 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+# Add project root to sys.path (il worker può essere lanciato come `python src/jobs.py`)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.language_id import LanguageRouter
+from src.metrics import counter, gauge, histogram, start_metrics_server
+from src.utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Stati di un job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# Un worker che non aggiorna l'heartbeat da più di questo tempo è considerato morto
+WORKER_TIMEOUT_S = 60
+HEARTBEAT_INTERVAL_S = 10
+
+# Un job il cui worker muore (crash, OOM...) torna in coda al più fino a questo numero di tentativi,
+# poi viene marcato come fallito: un input che fa cadere il worker non resta in coda per sempre
+MAX_ATTEMPTS = 3
+
+# I job terminati (done/failed) da più di questi giorni vengono eliminati, cartella compresa (0 = mai)
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+CLEANUP_INTERVAL_S = 3600
+
+JOBS_QUEUE_DEPTH = gauge("jobs_queue_depth", "Job in coda in attesa di un worker")
+JOBS_LIVE_WORKERS = gauge("jobs_live_workers", "Worker con heartbeat recente")
+JOBS_TOTAL = counter("jobs_total", "Job eseguiti per tipo ed esito", ["kind", "status"])
+JOB_DURATION_SECONDS = histogram("job_duration_seconds", "Durata di esecuzione di un job", ["kind"])
+JOB_WAIT_SECONDS = histogram("job_wait_seconds", "Attesa in coda prima dell'esecuzione", ["kind"])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    message TEXT,
+    result TEXT,
+    error TEXT,
+    worker TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, created_at);
+CREATE TABLE IF NOT EXISTS workers (
+    id TEXT PRIMARY KEY,
+    pid INTEGER,
+    host TEXT,
+    heartbeat REAL NOT NULL
+);
+"""
+
+
+class JobQueue:
+    """
+    Coda di job locale basata su SQLite.
+    I dati di input e i risultati dei job stanno su disco in `data/jobs/<job_id>/`,
+    nel database restano solo stato, avanzamento e metadati (JSON).
+    Più processi (app Streamlit e worker) possono usare la stessa coda in sicurezza.
+    """
+    def __init__(self, jobs_dir: str = None, max_attempts: int = MAX_ATTEMPTS):
+        self.jobs_dir = jobs_dir or os.path.join(BASE_DIR, 'data', 'jobs')
+        self.max_attempts = max_attempts
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        self.db_path = os.path.join(self.jobs_dir, 'jobs.sqlite')
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(_SCHEMA)
+            # Code create prima dell'introduzione dei tentativi
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if "attempts" not in columns:
+                conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.jobs_dir, job_id)
+
+    # --- Lato client (app) ---
+
+    def submit(self, kind: str, payload: Dict, inputs: Dict = None) -> str:
+        """
+        Accoda un job. `inputs` mappa nomi file -> contenuto (str, bytes o file-like)
+        da salvare nella cartella del job prima che diventi visibile ai worker.
+        """
+        if kind not in JOB_HANDLERS:
+            raise ValueError(f"Tipo di job sconosciuto: {kind}. Disponibili: {list(JOB_HANDLERS)}")
+
+        job_id = uuid.uuid4().hex
+        job_dir = self.job_dir(job_id)
+        os.makedirs(job_dir, exist_ok=True)
+
+        for name, content in (inputs or {}).items():
+            path = os.path.join(job_dir, name)
+            if isinstance(content, str):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(content)
+            elif isinstance(content, (bytes, bytearray, memoryview)):
+                with open(path, "wb") as f:
+                    f.write(content)
+            else:
+                with open(path, "wb") as f:
+                    shutil.copyfileobj(content, f)
+
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, kind, QUEUED, json.dumps(payload), time.time()),
+            )
+        logger.info(f"Job {job_id} ({kind}) accodato.")
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["payload"] = json.loads(job["payload"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def queue_depth(self) -> int:
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+
+    def live_workers(self) -> int:
+        with self._connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*) FROM workers WHERE heartbeat > ?", (time.time() - WORKER_TIMEOUT_S,)
+            ).fetchone()[0]
+
+    # --- Lato worker ---
+
+    def heartbeat(self, worker_id: str):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO workers (id, pid, host, heartbeat) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET heartbeat = excluded.heartbeat",
+                (worker_id, os.getpid(), socket.gethostname(), time.time()),
+            )
+
+    def unregister(self, worker_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM workers WHERE id = ?", (worker_id,))
+
+    def claim(self, worker_id: str) -> Optional[Dict]:
+        """Prende in carico in modo atomico il job in coda più vecchio."""
+        conn = self._connect()
+        try:
+            # BEGIN IMMEDIATE: lock in scrittura, due worker non possono prendere lo stesso job
+            conn.execute("BEGIN IMMEDIATE")
+            # I job rimasti 'running' su worker morti tornano in coda,
+            # a meno che non abbiano già esaurito i tentativi
+            now = time.time()
+            dead_worker = "status = ? AND worker NOT IN (SELECT id FROM workers WHERE heartbeat > ?)"
+            conn.execute(
+                f"UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE {dead_worker} AND attempts >= ?",
+                (FAILED, f"Il worker si è interrotto durante l'esecuzione per {self.max_attempts} volte: job abbandonato.",
+                 now, RUNNING, now - WORKER_TIMEOUT_S, self.max_attempts),
+            )
+            conn.execute(
+                f"UPDATE jobs SET status = ?, worker = NULL WHERE {dead_worker}",
+                (QUEUED, RUNNING, now - WORKER_TIMEOUT_S),
+            )
+            row = conn.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, worker = ?, started_at = ?, progress = 0, attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, worker_id, time.time(), row["id"]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return self.get(row["id"])
+
+    def update_progress(self, job_id: str, progress: float, message: str = None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = ?, message = COALESCE(?, message) WHERE id = ?",
+                (min(max(progress, 0.0), 1.0), message, job_id),
+            )
+
+    def complete(self, job_id: str, result: Dict):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, progress = 1, result = ?, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id: str, error: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED, error, time.time(), job_id),
+            )
+
+    def cleanup(self, retention_days: float = JOB_RETENTION_DAYS) -> int:
+        """
+        Elimina i job terminati (done/failed) da più di `retention_days` giorni: prima la riga
+        nel database (l'app non vede più il job), poi la cartella con input e risultati.
+        Rimuove anche le cartelle orfane più vecchie del limite (es. submit interrotti).
+        Ritorna il numero di job eliminati.
+        """
+        if retention_days <= 0:
+            return 0
+        cutoff = time.time() - retention_days * 86400
+        with self._connect() as conn:
+            expired = [row["id"] for row in conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) AND finished_at < ?", (DONE, FAILED, cutoff)
+            )]
+            conn.executemany("DELETE FROM jobs WHERE id = ?", [(job_id,) for job_id in expired])
+            known = {row["id"] for row in conn.execute("SELECT id FROM jobs")}
+
+        for job_id in expired:
+            shutil.rmtree(self.job_dir(job_id), ignore_errors=True)
+        for name in os.listdir(self.jobs_dir):
+            path = self.job_dir(name)
+            if (re.fullmatch(r"[0-9a-f]{32}", name) and name not in known and os.path.isdir(path)
+                    and os.path.getmtime(path) < cutoff):
+                shutil.rmtree(path, ignore_errors=True)
+        if expired:
+            logger.info(f"Eliminati {len(expired)} job terminati da più di {retention_days:g} giorni.")
+        return len(expired)
+
+
+# --- Handler dei job ---
+# Ogni handler riceve (job, job_dir, report_progress) e ritorna il dizionario 'result'.
+# I modelli arrivano dal pool del processo worker: caricati una sola volta per processo.
+
+def _run_summarize(job: Dict, job_dir: str, report_progress: Callable) -> Dict:
+    from src.model_pool import get_model_pool
+
+    with open(os.path.join(job_dir, "input.txt"), "r", encoding="utf-8") as f:
+        text = f.read()
+
+    # Language-ID: IT5 supporta solo l'italiano, i documenti in altre lingue non vengono passati al modello
+    language_stats = None
+    if job["payload"].get("skip_unsupported_languages", True):
+        keep, langs, language_stats = LanguageRouter("summarization").route([text])
+        if not keep[0]:
+            summary = (
+                f"Lingua del documento non supportata dal modello di sintesi "
+                f"(rilevata: {langs[0]}, supportate: {', '.join(language_stats['supported'])})."
+            )
+            result_path = os.path.join(job_dir, "summary.txt")
+            with open(result_path, "w", encoding="utf-8") as f:
+                f.write(summary)
+            return {"result_path": result_path, "language": language_stats}
+
+    router = get_model_pool().summarizer_router()
+    tier = job["payload"].get("tier")
+    options = {
+        "latency_budget": job["payload"].get("latency_budget"),
+        "tier": None if tier in (None, "auto") else tier,
+        "progress_callback": lambda done, total: report_progress(done / total, f"Chunk {done}/{total}"),
+    }
+
+    # Specifiche OpenAPI: chunking per endpoint raggruppati per tag/prefisso del path
+    endpoints_path = os.path.join(job_dir, "endpoints.json")
+    if os.path.exists(endpoints_path):
+        with open(endpoints_path, "r", encoding="utf-8") as f:
+            summary = router.summarize_openapi(json.load(f), **options)
+    else:
+        # I testi estratti dai PDF hanno le sezioni separate da SECTION_SEPARATOR
+        summary = router.summarize(text, sections=job["payload"].get("source_type") == "PDF", **options)
+
+    result_path = os.path.join(job_dir, "summary.txt")
+    with open(result_path, "w", encoding="utf-8") as f:
+        f.write(summary)
+    return {"result_path": result_path, "language": language_stats}
+
+def _take_representatives(blocks: list, offsets: list, ids):
+    """
+    Risultati per id globale di rappresentante, con i risultati divisi in blocchi consecutivi
+    (`offsets[i]` = id del primo rappresentante del blocco i). Copia solo le righe richieste.
+    """
+    import numpy as np
+
+    ids = np.asarray(ids)
+    block_of = np.searchsorted(offsets, ids, side="right") - 1
+    first = blocks[0]
+    label_ids = np.empty(len(ids), dtype=first.label_ids.dtype)
+    probabilities = np.empty((len(ids), first.probabilities.shape[1]), dtype=first.probabilities.dtype)
+    for block in np.unique(block_of):
+        rows = block_of == block
+        local = ids[rows] - offsets[block]
+        label_ids[rows] = blocks[block].label_ids[local]
+        probabilities[rows] = blocks[block].probabilities[local]
+    return type(first)(label_ids, probabilities, first.labels)
+
+def _run_sentiment_csv(job: Dict, job_dir: str, report_progress: Callable) -> Dict:
+    """
+    Scoring di un CSV a memoria limitata: il file viene letto a chunk di `chunk_rows` righe,
+    ogni chunk è classificato a batch e scritto subito in coda ai file di output (CSV e Parquet).
+    In memoria restano solo il chunk corrente e i contatori aggregati.
+    """
+    from collections import Counter
+
+    import pandas as pd
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from src.model_pool import get_model_pool
+    from src.dedup import NearDuplicateIndex
+    from src.preprocessing import preprocess_batch
+    from src.sentiment import SentimentBatchResult
+
+    text_col = job["payload"]["text_col"]
+    batch_size = job["payload"].get("batch_size", 32)
+    chunk_rows = job["payload"].get("chunk_rows", 20000)
+    skip_languages = job["payload"].get("skip_unsupported_languages", True)
+    near_dedup = job["payload"].get("near_dedup", False)
+    dedup_threshold = job["payload"].get("dedup_threshold", 0.8)
+
+    input_path = os.path.join(job_dir, "input.csv")
+    result_path = os.path.join(job_dir, "result.csv")
+    parquet_path = os.path.join(job_dir, "result.parquet")
+    total_bytes = max(os.path.getsize(input_path), 1)
+
+    analyzer = get_model_pool().sentiment_analyzer()
+    router = LanguageRouter("sentiment") if skip_languages else None
+    # Blocchi di più batch: un aggiornamento di avanzamento per blocco
+    block_size = batch_size * 8
+
+    rows = 0
+    label_counts = Counter()
+    prep_totals = Counter()
+    languages = Counter()
+    parquet_writer = None
+    # Deduplica tra tutti i chunk: l'indice LSH tiene i rappresentanti già visti e `representative_results`
+    # i loro risultati, un blocco per chunk (id globale -> label e probabilità), così i duplicati in chunk
+    # diversi non vengono riclassificati. I blocchi non vengono mai ricopiati: costo lineare nel numero di righe
+    dedup_index = NearDuplicateIndex(threshold=dedup_threshold) if near_dedup else None
+    representative_results = []
+    representative_offsets = [0]
+
+    with open(input_path, "rb") as source, open(result_path, "w", encoding="utf-8", newline="") as csv_out:
+        # Tutte le colonne come stringhe nullable: lo schema è identico in ogni chunk e un valore
+        # "anomalo" a metà file (es. "n/a" in una colonna numerica) non fa fallire il job.
+        # Le colonne originali vengono riscritte così come sono, solo le colonne del modello sono tipizzate
+        reader = pd.read_csv(source, chunksize=chunk_rows, dtype="string", keep_default_na=False, na_values=[""])
+        for df in reader:
+            clean_df, prep_stats = preprocess_batch(df, text_col, drop_duplicates=False)
+            prep_totals.update({k: v for k, v in prep_stats.items() if k != "rows_per_s"})
+
+            # Language-ID a batch: le righe in lingue non supportate dall'adapter non vengono classificate
+            if router is not None:
+                keep, langs, language_stats = router.route(clean_df[text_col].tolist())
+                languages.update(language_stats["rows_by_language"])
+                df["language_detected"] = pd.Series(langs, index=clean_df.index, dtype="string")
+                clean_df = clean_df[keep]
+            texts = clean_df[text_col].tolist()
+
+            # Quasi-duplicati (opzionale): il modello classifica solo i nuovi rappresentanti
+            representative_ids = None
+            if dedup_index is not None and texts:
+                representatives, representative_ids, _ = dedup_index.add(texts)
+                texts = [texts[i] for i in representatives]
+
+            results = []
+            for block_start in range(0, len(texts), block_size):
+                results.append(analyzer.analyze_columnar(texts[block_start:block_start + block_size], batch_size=batch_size))
+                done = block_start + min(block_size, len(texts) - block_start)
+                report_progress(min(source.tell() / total_bytes, 0.99), f"{rows + done} righe analizzate")
+
+            # Label e probabilità di tutte le classi; le righe nulle/vuote restano senza sentiment.
+            # Le label sono categoriche con tutte le classi: lo schema è identico in ogni chunk
+            result = SentimentBatchResult.concat(results) if results else analyzer.analyze_columnar([])
+            if representative_ids is not None:
+                # I nuovi rappresentanti hanno id globali consecutivi: il loro blocco si accoda a quelli già noti
+                if len(result):
+                    representative_results.append(result)
+                    representative_offsets.append(representative_offsets[-1] + len(result))
+                result = _take_representatives(representative_results, representative_offsets, representative_ids)
+            scored = result.to_pandas(prob_prefix="p_").rename(columns={"label": "sentiment"})
+            scored.index = clean_df.index
+            # Un CSV già analizzato (es. un export precedente) ha già `sentiment` e `p_*`: vengono sostituite
+            df = df.drop(columns=[c for c in scored.columns if c in df.columns]).join(scored)
+            label_counts.update({str(k): int(v) for k, v in df["sentiment"].value_counts().items()})
+
+            df.to_csv(csv_out, header=(rows == 0), index=False)
+            # Stessi risultati in formato colonnare compatto (label categoriche, probabilità float32)
+            if parquet_writer is None:
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                parquet_writer = pq.ParquetWriter(parquet_path, table.schema)
+            else:
+                table = pa.Table.from_pandas(df, schema=parquet_writer.schema, preserve_index=False)
+            parquet_writer.write_table(table)
+
+            rows += len(df)
+            report_progress(min(source.tell() / total_bytes, 0.99), f"{rows} righe analizzate")
+
+    if parquet_writer is not None:
+        parquet_writer.close()
+
+    prep_seconds = prep_totals["seconds"]
+    prep_totals["rows_per_s"] = prep_totals["rows_in"] / prep_seconds if prep_seconds > 0 else float("inf")
+
+    language = None
+    if router is not None:
+        totals = router.totals
+        language = {
+            "backend": router.detector.backend,
+            "supported": sorted(router.languages),
+            "rows": totals["rows"],
+            "rows_by_language": dict(languages.most_common()),
+            "rows_routed": totals["rows_routed"],
+            "rows_skipped": totals["rows_skipped"],
+            "chars_skipped": totals["chars_skipped"],
+            "compute_saved_pct": 100.0 * totals["chars_skipped"] / totals["chars_total"] if totals["chars_total"] else 0.0,
+        }
+
+    return {
+        "result_path": result_path,
+        "parquet_path": parquet_path if parquet_writer is not None else None,
+        "rows": rows,
+        "label_counts": dict(label_counts),
+        "preprocessing": dict(prep_totals),
+        "language": language,
+        "dedup": {
+            **dedup_index.totals,
+            "dedup_ratio": dedup_index.totals["propagated"] / dedup_index.totals["rows"] if dedup_index.totals["rows"] else 0.0,
+            "indexed": dedup_index.size,
+        } if dedup_index is not None else None,
+    }
+
+JOB_HANDLERS: Dict[str, Callable] = {
+    "summarize": _run_summarize,
+    "sentiment_csv": _run_sentiment_csv,
+}
+
+
+# --- Worker ---
+
+def run_worker(jobs_dir: str = None, poll_interval: float = 1.0, metrics_port: Optional[int] = None,
+               retention_days: float = JOB_RETENTION_DAYS):
+    """
+    Loop principale di un processo worker: prende job dalla coda e li esegue.
+    Quando è inattivo elimina periodicamente i job più vecchi di `retention_days` giorni.
+    Con `metrics_port` espone le metriche del processo (modelli, coda, job) su /metrics.
+    """
+    setup_logging()
+    queue = JobQueue(jobs_dir)
+    if metrics_port:
+        # Calcolate al momento dello scrape
+        JOBS_QUEUE_DEPTH.set_function(queue.queue_depth)
+        JOBS_LIVE_WORKERS.set_function(queue.live_workers)
+        start_metrics_server(metrics_port)
+    worker_id = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+    queue.heartbeat(worker_id)
+
+    # Heartbeat in background: anche durante job lunghi il worker risulta vivo
+    stop = threading.Event()
+    def _beat():
+        while not stop.wait(HEARTBEAT_INTERVAL_S):
+            try:
+                queue.heartbeat(worker_id)
+            except sqlite3.Error as e:
+                logger.warning(f"Heartbeat non riuscito: {e}")
+    threading.Thread(target=_beat, daemon=True).start()
+
+    logger.info(f"Worker {worker_id} avviato, in attesa di job...")
+    last_cleanup = 0.0
+    try:
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                if time.time() - last_cleanup > CLEANUP_INTERVAL_S:
+                    queue.cleanup(retention_days)
+                    last_cleanup = time.time()
+                time.sleep(poll_interval)
+                continue
+
+            logger.info(f"Worker {worker_id}: esecuzione job {job['id']} ({job['kind']}, tentativo {job['attempts']}/{queue.max_attempts})")
+            report_progress = lambda progress, message=None, job_id=job["id"]: queue.update_progress(job_id, progress, message)
+            JOB_WAIT_SECONDS.labels(kind=job["kind"]).observe(max(time.time() - job["created_at"], 0.0))
+            start = time.perf_counter()
+            try:
+                result = JOB_HANDLERS[job["kind"]](job, queue.job_dir(job["id"]), report_progress)
+                queue.complete(job["id"], result)
+                JOBS_TOTAL.labels(kind=job["kind"], status=DONE).inc()
+                logger.info(f"Job {job['id']} completato.")
+            except Exception as e:  # noqa: BLE001 - l'errore viene salvato nel job
+                JOBS_TOTAL.labels(kind=job["kind"], status=FAILED).inc()
+                logger.error(f"Job {job['id']} fallito: {e}")
+                queue.fail(job["id"], str(e))
+            JOB_DURATION_SECONDS.labels(kind=job["kind"]).observe(time.perf_counter() - start)
+    except KeyboardInterrupt:
+        logger.info(f"Worker {worker_id} arrestato.")
+    finally:
+        stop.set()
+        queue.unregister(worker_id)
+
+def start_workers(num_workers: int = 1, jobs_dir: str = None, metrics_port: Optional[int] = None,
+                  retention_days: float = JOB_RETENTION_DAYS):
+    """
+    Avvia `num_workers` processi worker e attende la loro terminazione.
+    Ogni worker espone le sue metriche su una porta diversa: metrics_port, metrics_port + 1, ...
+    """
+    processes = [
+        multiprocessing.Process(
+            target=run_worker,
+            args=(jobs_dir, 1.0, metrics_port + i if metrics_port else None, retention_days),
+            daemon=False,
+        )
+        for i in range(num_workers)
+    ]
+    for p in processes:
+        p.start()
+    for p in processes:
+        p.join()
+
+def ensure_worker(queue: JobQueue, num_workers: int = 1, metrics_port: Optional[int] = None) -> bool:
+    """
+    Se non c'è nessun worker vivo, ne avvia uno in background (processo separato,
+    indipendente dalla sessione Streamlit). Ritorna True se è stato avviato un worker.
+    Con `metrics_port` il worker espone /metrics su quella porta (vedi run_worker).
+    """
+    if queue.live_workers() > 0:
+        return False
+
+    # Lock su file: più sessioni in contemporanea non devono avviare più worker
+    lock_path = os.path.join(queue.jobs_dir, "spawn.lock")
+    try:
+        if time.time() - os.path.getmtime(lock_path) < WORKER_TIMEOUT_S:
+            return False
+        os.remove(lock_path)
+    except FileNotFoundError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+    except FileExistsError:
+        return False
+
+    command = [sys.executable, "-m", "src.jobs", "--workers", str(num_workers), "--jobs_dir", queue.jobs_dir]
+    if metrics_port:
+        command += ["--metrics_port", str(metrics_port)]
+    log_path = os.path.join(queue.jobs_dir, "worker.log")
+    with open(log_path, "a") as log_file:
+        subprocess.Popen(
+            command,
+            cwd=BASE_DIR,
+            stdout=log_file,
+            stderr=subprocess.STDOUT,
+            start_new_session=True,
+        )
+    logger.info(f"Nessun worker attivo: avviato worker in background (log: {log_path}).")
+    return True
+
+
+# --- Download dei risultati ---
+
+# File dei job scaricabili: nome su disco -> (Content-Type, nome proposto al browser)
+RESULT_FILES = {
+    "result.csv": ("text/csv", "reviews_analyzed.csv"),
+    "result.parquet": ("application/octet-stream", "reviews_analyzed.parquet"),
+    "summary.txt": ("text/plain; charset=utf-8", "summary.txt"),
+}
+_RESULT_PATH_RE = re.compile(r"^/jobs/([0-9a-f]{32})/([\w.]+)$")
+
+def start_results_server(port: int, addr: str = "127.0.0.1", jobs_dir: str = None) -> ThreadingHTTPServer:
+    """
+    Serve i file dei risultati su `/jobs/<job_id>/<file>` in un thread daemon.
+    I file vengono copiati sul socket a blocchi: anche un CSV da qualche GB non passa
+    mai interamente in memoria (a differenza di st.download_button, che lo legge a ogni rerun).
+    Non c'è autenticazione (l'id del job, casuale a 128 bit, fa da chiave): di default ascolta
+    solo in locale, l'accesso remoto passa da un reverse proxy con l'autenticazione dell'app.
+    """
+    jobs_dir = jobs_dir or os.path.join(BASE_DIR, 'data', 'jobs')
+
+    class ResultsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = _RESULT_PATH_RE.match(self.path.split("?")[0])
+            if not match or match.group(2) not in RESULT_FILES:
+                self.send_error(404)
+                return
+            job_id, name = match.groups()
+            path = os.path.join(jobs_dir, job_id, name)
+            if not os.path.isfile(path):
+                self.send_error(404)
+                return
+            content_type, download_name = RESULT_FILES[name]
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(os.path.getsize(path)))
+            self.send_header("Content-Disposition", f'attachment; filename="{download_name}"')
+            self.end_headers()
+            with open(path, "rb") as f:
+                shutil.copyfileobj(f, self.wfile, 1 << 20)
+
+        def log_message(self, format, *args):
+            logger.debug(f"Download risultati: {format % args}")
+
+    server = ThreadingHTTPServer((addr, port), ResultsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="results-server").start()
+    logger.info(f"Download dei risultati attivo su http://{addr}:{server.server_address[1]}/jobs/")
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker della coda di job (summarization e scoring CSV)")
+    parser.add_argument("--workers", type=int, default=1, help="Numero di processi worker")
+    parser.add_argument("--jobs_dir", type=str, default=None, help="Cartella della coda (default: data/jobs)")
+    parser.add_argument("--metrics_port", type=int, default=None,
+                        help="Porta dell'endpoint /metrics del primo worker (default: env WORKER_METRICS_PORT, disattivo se assente)")
+    parser.add_argument("--retention_days", type=float, default=JOB_RETENTION_DAYS,
+                        help="Giorni di conservazione dei job terminati (default: env JOB_RETENTION_DAYS o 7; 0 = mai eliminati)")
+    args = parser.parse_args()
+    metrics_port = args.metrics_port or (int(os.environ["WORKER_METRICS_PORT"]) if os.getenv("WORKER_METRICS_PORT") else None)
+
+    if args.workers == 1:
+        run_worker(args.jobs_dir, metrics_port=metrics_port, retention_days=args.retention_days)
+    else:
+        start_workers(args.workers, args.jobs_dir, metrics_port=metrics_port, retention_days=args.retention_days)
@@ -0,0 +1,237 @@
+import logging
+import os
+import time
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.metrics import counter, histogram
+
+logger = logging.getLogger(__name__)
+
+LANGUAGE_ROUTING_ROWS = counter("language_routing_rows_total", "Testi per esito del routing di lingua", ["task", "result"])
+LANGUAGE_ROUTING_CHARS_SKIPPED = counter(
+    "language_routing_chars_skipped_total", "Caratteri non passati al modello perché in lingua non supportata", ["task"]
+)
+LANGUAGE_ID_SECONDS = histogram("language_id_seconds", "Durata del language-ID di un batch", ["backend"])
+
+# Codice per i testi di cui non è possibile stabilire la lingua (troppo corti, solo numeri/emoji...)
+UNDETERMINED = "und"
+
+# Lingue supportate dai modelli di ogni task
+# - summarization: IT5 è addestrato solo sull'italiano
+# - sentiment: l'adapter LoRA è addestrato su dati in inglese
+TASK_LANGUAGES = {
+    "summarization": ("it",),
+    "sentiment": ("en",),
+}
+
+# Modello fastText opzionale (lid.176.ftz, ~1 MB); se assente si usa l'euristica interna
+FASTTEXT_MODEL_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models', 'lid.176.ftz'))
+
+# Parole funzionali frequenti per le lingue con alfabeto latino. Una parola può stare in più
+# liste (es. "il", "una"): le parole in comune non spostano il margine tra le lingue
+STOPWORDS = {
+    "en": "the a an i in on and is are was were this that with for not it of you have has had be my "
+          "but so very would they their there what which just will from at its do don can after",
+    "it": "il lo la gli le i e di da in a al allo ai agli alla alle dal dalla dai dagli dalle del dello "
+          "della dei degli delle nel nello nella nei negli nelle sul sulla sui sulle dell nell dall sull "
+          "che è un una per non con sono questo questa questi quello quella molto anche ma più ho hai ha "
+          "hanno come cosa dove quando perché quale quali chi posso devo può puoi faccio mi si ci ti "
+          "mio mia tuo tua suo sua tutti già ancora",
+    "pt": "não muito uma com para os do da dos das eu isso mas ótimo bom está foi meu minha você em "
+          "são também mais",
+    "es": "el los las del y es muy pero con para una que está por su esto este fue bueno también "
+          "más como",
+    "fr": "le les des est et je pas une du pour avec très ce cette sur qui mais il bien au sont "
+          "aussi",
+    "de": "der die das und ist nicht ein eine ich mit sehr zu auf für den es war aber auch sich dem "
+          "gut sind",
+}
+
+# Alfabeti non latini: la lingua si deduce direttamente dal sistema di scrittura
+SCRIPT_PATTERNS = {
+    "hi": r"[ऀ-ॿ]",
+    "ar": r"[؀-ۿ]",
+    "ru": r"[Ѐ-ӿ]",
+    "el": r"[Ͱ-Ͽ]",
+    "zh": r"[一-鿿]",
+    "ja": r"[぀-ヿ]",
+    "ko": r"[가-힯]",
+}
+
+_LATIN_PATTERN = r"[a-zà-öø-ÿ]"
+# Qualsiasi carattere oltre il blocco Latin Extended-B (U+024F)
+_NON_LATIN_PATTERN = r"[^\x00-ɏ]"
+
+
+@lru_cache(maxsize=1)
+def _stopword_frame() -> pd.DataFrame:
+    """Tabella (word, lang): una parola può appartenere a più lingue."""
+    rows = [(word, lang) for lang, words in STOPWORDS.items() for word in words.split()]
+    return pd.DataFrame(rows, columns=["word", "lang"])
+
+
+def heuristic_detect(texts: pd.Series, min_hits: int = 1, min_margin: int = 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Language-ID vettorizzato senza dipendenze esterne.
+    1. conta i caratteri di ogni alfabeto non latino (Devanagari, arabo, cirillico...)
+    2. per il testo latino conta le stopword di ogni lingua con un'unica explode + merge;
+       la lingua con più stopword vince solo se supera la seconda di almeno `min_margin`,
+       altrimenti (pareggio o margine stretto) il testo resta 'und'
+    Ritorna (codici lingua ISO 639-1, confidenza in [0, 1]).
+    """
+    texts = texts.fillna("").astype(str).str.lower().reset_index(drop=True)
+    n = len(texts)
+    langs = np.full(n, UNDETERMINED, dtype=object)
+    confidence = np.zeros(n, dtype=np.float32)
+    if n == 0:
+        return langs, confidence
+
+    # 1. Stopword: explode dei token e join con la tabella delle parole funzionali
+    tokens = texts.str.findall(r"[^\W\d_]+").explode().dropna()
+    hits = (
+        tokens.rename("word").rename_axis("row").reset_index()
+        .merge(_stopword_frame(), on="word")
+    )
+    if not hits.empty:
+        scores = hits.groupby(["row", "lang"]).size().unstack(fill_value=0)
+        counts = scores.to_numpy()
+        best = counts.argmax(axis=1)
+        ranked = np.sort(counts, axis=1)
+        top = ranked[:, -1]
+        second = ranked[:, -2] if counts.shape[1] > 1 else np.zeros_like(top)
+        rows = scores.index.to_numpy()
+        valid = (top >= min_hits) & (top - second >= min_margin)
+        langs[rows[valid]] = scores.columns.to_numpy()[best[valid]]
+        confidence[rows[valid]] = top[valid] / counts.sum(axis=1)[valid]
+
+    # 2. Alfabeti non latini: prevalgono quando i loro caratteri superano quelli latini.
+    #    Il conteggio per alfabeto si fa solo sulle righe che contengono caratteri fuori dal latino esteso
+    candidates = np.flatnonzero(texts.str.contains(_NON_LATIN_PATTERN).to_numpy())
+    if len(candidates):
+        subset = texts.iloc[candidates]
+        latin = subset.str.count(_LATIN_PATTERN).to_numpy()
+        script_counts = np.stack([subset.str.count(p).to_numpy() for p in SCRIPT_PATTERNS.values()], axis=1)
+        script_top = script_counts.max(axis=1)
+        is_script = script_top > latin
+        rows = candidates[is_script]
+        langs[rows] = np.array(list(SCRIPT_PATTERNS), dtype=object)[script_counts.argmax(axis=1)[is_script]]
+        confidence[rows] = script_top[is_script] / (script_top[is_script] + latin[is_script])
+
+    return langs, confidence
+
+
+class LanguageDetector:
+    """
+    Riconoscimento della lingua a batch.
+    Usa il modello fastText `lid.176` se la libreria e il file del modello sono disponibili,
+    altrimenti l'euristica vettorizzata `heuristic_detect`.
+    """
+    def __init__(self, model_path: str = FASTTEXT_MODEL_PATH, min_confidence: float = 0.5):
+        self.min_confidence = min_confidence
+        self.model = None
+        if os.path.exists(model_path):
+            try:
+                import fasttext
+                self.model = fasttext.load_model(model_path)
+                logger.info(f"Language-ID: modello fastText caricato da {model_path}")
+            except ImportError:
+                logger.warning("fastText non installato: uso l'euristica interna per il language-ID.")
+        self.backend = "fasttext" if self.model is not None else "heuristic"
+
+    def detect(self, texts: Iterable[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Ritorna (codici lingua, confidenza) per ogni testo; 'und' sotto la soglia di confidenza."""
+        texts = pd.Series(list(texts), dtype=object)
+        if self.model is not None:
+            # fastText lavora per riga: gli a capo vanno rimossi
+            clean = texts.fillna("").astype(str).str.replace("\n", " ", regex=False).tolist()
+            labels, probs = self.model.predict(clean, k=1)
+            langs = np.array([l[0].replace("__label__", "") if l else UNDETERMINED for l in labels], dtype=object)
+            confidence = np.array([p[0] if len(p) else 0.0 for p in probs], dtype=np.float32)
+        else:
+            langs, confidence = heuristic_detect(texts)
+
+        langs[confidence < self.min_confidence] = UNDETERMINED
+        return langs, confidence
+
+
+@lru_cache(maxsize=1)
+def get_language_detector() -> LanguageDetector:
+    """Detector condiviso dal processo (il modello fastText viene caricato una sola volta)."""
+    return LanguageDetector()
+
+
+class LanguageRouter:
+    """
+    Stadio di routing per lingua da eseguire prima dell'inferenza.
+    Marca come da saltare i testi in lingue non supportate dal modello del task e tiene
+    contatori cumulativi del calcolo risparmiato (righe e caratteri non passati al modello).
+    """
+    def __init__(
+        self,
+        task: Optional[str] = None,
+        languages: Optional[Sequence[str]] = None,
+        keep_undetermined: bool = True,
+        detector: Optional[LanguageDetector] = None,
+    ):
+        if languages is None:
+            if task not in TASK_LANGUAGES:
+                raise ValueError(f"Task sconosciuto: {task}. Disponibili: {list(TASK_LANGUAGES)}")
+            languages = TASK_LANGUAGES[task]
+        self.task = task
+        self.languages = set(languages)
+        # I testi di lingua incerta (es. "ok!!") vengono passati al modello per prudenza
+        self.keep_undetermined = keep_undetermined
+        self.detector = detector or get_language_detector()
+        self.totals = Counter()
+
+    def route(self, texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, Dict]:
+        """
+        Ritorna (maschera dei testi da passare al modello, lingua di ogni testo, statistiche).
+        Statistiche: righe per lingua, righe instradate/saltate, caratteri saltati
+        e percentuale di calcolo risparmiato (stimata sui caratteri, proxy dei token).
+        """
+        start = time.perf_counter()
+        langs, _ = self.detector.detect(texts)
+        keep = np.isin(langs, list(self.languages))
+        if self.keep_undetermined:
+            keep |= langs == UNDETERMINED
+
+        lengths = np.fromiter((len(t) if isinstance(t, str) else 0 for t in texts), dtype=np.int64, count=len(langs))
+        chars_total = int(lengths.sum())
+        chars_skipped = int(lengths[~keep].sum())
+        stats = {
+            "backend": self.detector.backend,
+            "supported": sorted(self.languages),
+            "rows": len(langs),
+            "rows_by_language": {str(k): int(v) for k, v in Counter(langs.tolist()).most_common()},
+            "rows_routed": int(keep.sum()),
+            "rows_skipped": int((~keep).sum()),
+            "chars_skipped": chars_skipped,
+            "compute_saved_pct": 100.0 * chars_skipped / chars_total if chars_total else 0.0,
+            "seconds": time.perf_counter() - start,
+        }
+
+        task = self.task or "custom"
+        LANGUAGE_ID_SECONDS.labels(backend=self.detector.backend).observe(stats["seconds"])
+        LANGUAGE_ROUTING_ROWS.labels(task=task, result="routed").inc(stats["rows_routed"])
+        LANGUAGE_ROUTING_ROWS.labels(task=task, result="skipped").inc(stats["rows_skipped"])
+        LANGUAGE_ROUTING_CHARS_SKIPPED.labels(task=task).inc(chars_skipped)
+
+        self.totals.update({
+            "rows": stats["rows"],
+            "rows_routed": stats["rows_routed"],
+            "rows_skipped": stats["rows_skipped"],
+            "chars_total": chars_total,
+            "chars_skipped": chars_skipped,
+        })
+        logger.info(
+            f"Language routing ({self.task or ','.join(sorted(self.languages))}): "
+            f"{stats['rows_routed']}/{stats['rows']} righe al modello, {stats['rows_skipped']} saltate "
+            f"({stats['compute_saved_pct']:.1f}% di calcolo risparmiato)"
+        )
+        return keep, langs, stats
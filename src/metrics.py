@@ -0,0 +1,301 @@
+import abc
+import argparse
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Content-Type del formato di esposizione testuale di Prometheus
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Bucket di default per le latenze (secondi): dal singolo batch alla summarization di un documento
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if math.isnan(value):
+        return "NaN"
+    if float(value).is_integer() and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        f'{name}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for name, value in labels.items()
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+class _Metric(abc.ABC):
+    """Base delle metriche: un valore per ogni combinazione di label, protetto da lock."""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Label di '{self.name}' attese: {self.labelnames}, ricevute: {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def labels(self, **labels) -> "_BoundMetric":
+        """Metrica con le label fissate (stessa API di prometheus_client)."""
+        return _BoundMetric(self, self._key(labels))
+
+    @abc.abstractmethod
+    def samples(self):
+        """Ritorna le righe (nome, label, valore) da esporre."""
+
+
+class _BoundMetric:
+    def __init__(self, metric: _Metric, key: Tuple[str, ...]):
+        self._metric = metric
+        self._key = key
+
+    def __getattr__(self, attr):
+        method = getattr(self._metric, f"_{attr}")
+        return lambda *args, **kwargs: method(self._key, *args, **kwargs)
+
+
+class Counter(_Metric):
+    """Contatore monotono (es. token processati, cache hit). Per convenzione il nome finisce in `_total`."""
+    kind = "counter"
+
+    def _inc(self, key, amount: float = 1.0):
+        if amount < 0:
+            raise ValueError("Un counter può solo aumentare.")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc(self, amount: float = 1.0):
+        self._inc(self._key({}), amount)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge(_Metric):
+    """Valore istantaneo (es. profondità della coda). Può essere calcolato al momento dello scrape."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions = {}
+
+    def _set(self, key, value: float):
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _inc(self, key, amount: float = 1.0):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _dec(self, key, amount: float = 1.0):
+        self._inc(key, -amount)
+
+    def _set_function(self, key, fn: Callable[[], float]):
+        with self._lock:
+            self._functions[key] = fn
+
+    def set(self, value: float):
+        self._set(self._key({}), value)
+
+    def inc(self, amount: float = 1.0):
+        self._inc(self._key({}), amount)
+
+    def dec(self, amount: float = 1.0):
+        self._dec(self._key({}), amount)
+
+    def set_function(self, fn: Callable[[], float]):
+        self._set_function(self._key({}), fn)
+
+    def samples(self):
+        with self._lock:
+            items = dict(self._values)
+            functions = dict(self._functions)
+        for key, fn in functions.items():
+            try:
+                items[key] = float(fn())
+            except Exception as e:  # noqa: BLE001 - uno scrape non deve mai fallire
+                logger.warning(f"Gauge '{self.name}' non calcolabile: {e}")
+        for key, value in items.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    """Istogramma a bucket cumulativi (es. latenze, dimensioni dei batch)."""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _observe(self, key, value: float):
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # conteggi per bucket (+Inf incluso), somma, numero di osservazioni
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def _time(self, key):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._observe(key, time.perf_counter() - start)
+
+    def observe(self, value: float):
+        self._observe(self._key({}), value)
+
+    def time(self):
+        """Context manager che osserva la durata del blocco in secondi."""
+        return self._time(self._key({}))
+
+    def samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        for key, (counts, total, count) in items:
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class MetricsRegistry:
+    """Registro delle metriche del processo, esposto nel formato testuale di Prometheus."""
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, cls, name: str, documentation: str, labelnames=(), **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation, labelnames, **kwargs)
+            elif not isinstance(metric, cls) or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metrica '{name}' già registrata con tipo o label diversi.")
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._get_or_create(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, documentation, labelnames, buckets=buckets)
+
+    def render(self) -> str:
+        """Tutte le metriche nel formato di esposizione testuale (version 0.0.4)."""
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample_name, labels, value in metric.samples():
+                lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Registro globale del processo (app Streamlit o worker)
+REGISTRY = MetricsRegistry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+    return REGISTRY.counter(name, documentation, labelnames)
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+    return REGISTRY.gauge(name, documentation, labelnames)
+
+def histogram(name: str, documentation: str, labelnames: Sequence[str] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.histogram(name, documentation, labelnames, buckets=buckets)
+
+
+def start_metrics_server(port: int, addr: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY) -> ThreadingHTTPServer:
+    """Espone `/metrics` su HTTP in un thread daemon (endpoint di scrape per Prometheus)."""
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/metrics", "/"):
+                self.send_error(404)
+                return
+            body = registry.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Gli scrape periodici non vanno nei log applicativi
+            pass
+
+    server = ThreadingHTTPServer((addr, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-server").start()
+    logger.info(f"Endpoint metriche attivo su http://{addr}:{server.server_address[1]}/metrics")
+    return server
+
+
+_SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(\{.*\})?\s+(\S+)$')
+
+def parse_exposition(text: str) -> Dict[str, float]:
+    """Converte il formato testuale in {'nome{label}': valore}, ignorando commenti e righe vuote."""
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        match = _SAMPLE_RE.match(line)
+        if not match:
+            raise ValueError(f"Riga di esposizione non valida: {line}")
+        name, labels, value = match.groups()
+        samples[f"{name}{labels or ''}"] = float(value)
+    return samples
+
+def scrape(url: Optional[str] = None, registry: MetricsRegistry = REGISTRY, timeout: float = 5.0) -> Dict[str, float]:
+    """
+    Scraper di test: legge le metriche da un endpoint HTTP (`url`) oppure, senza url,
+    direttamente dal registro del processo corrente. Ritorna i campioni come dizionario.
+    """
+    if url is None:
+        return parse_exposition(registry.render())
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return parse_exposition(response.read().decode("utf-8"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Legge e stampa le metriche esposte da un processo (app o worker)")
+    parser.add_argument("url", nargs="?", default="http://localhost:9100/metrics", help="Endpoint di scrape")
+    parser.add_argument("--filter", type=str, default=None, help="Mostra solo le metriche che contengono questa stringa")
+    args = parser.parse_args()
+
+    for sample, value in sorted(scrape(args.url).items()):
+        if args.filter is None or args.filter in sample:
+            print(f"{sample} {value}")
@@ -0,0 +1,280 @@
+import argparse
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict
+
+import torch
+
+from src.metrics import gauge
+from src.utils import autotune_threads, get_memory_usage_mb, setup_logging
+
+logger = logging.getLogger(__name__)
+
+MODEL_LOAD_SECONDS = gauge("model_load_seconds", "Tempo di caricamento di un modulo del pool", ["module"])
+MODEL_WARMUP_SECONDS = gauge("model_warmup_seconds", "Tempo di warm-up di un modulo del pool", ["module"])
+PROCESS_RSS_MB = gauge("process_resident_memory_mb", "Memoria residente del processo (MB)")
+PROCESS_RSS_MB.set_function(lambda: get_memory_usage_mb()["rss_mb"])
+
+
+def _build_summarizer(weights_loader=None):
+    from src.summarization import SummarizerModule
+    return SummarizerModule(weights_loader=weights_loader)
+
+def _build_sentiment_analyzer(weights_loader=None):
+    from src.sentiment import SentimentAnalyzerModule
+    return SentimentAnalyzerModule(weights_loader=weights_loader)
+
+def _warmup_summarizer(module):
+    # Generazione cortissima: basta per inizializzare kernel e allocatori
+    module.summarizer(
+        "Questo è un breve testo di prova usato per riscaldare il modello di sintesi.",
+        max_length=8,
+        min_length=1,
+        num_beams=1,
+        truncation=True,
+    )
+
+def _warmup_sentiment_analyzer(module):
+    module.analyze_batch(["warm-up message", "another short warm-up message"])
+
+# Registro dei moduli gestiti dal pool: nome -> (costruttore, warm-up).
+# Il costruttore accetta `weights_loader` (vedi ModelPool.get): con i pesi già esportati
+# il modello viene costruito senza pesi e riceve direttamente i tensori mappati da disco
+MODULE_FACTORIES: Dict[str, tuple] = {
+    "summarizer": (_build_summarizer, _warmup_summarizer),
+    "sentiment": (_build_sentiment_analyzer, _warmup_sentiment_analyzer),
+}
+
+# Carichi rappresentativi per l'auto-tuning dei thread (vedi src.utils.autotune_threads)
+_BENCHMARK_TEXT = (
+    "Kubernetes automatizza il deployment, la scalabilità e la gestione delle applicazioni containerizzate. "
+    "Gli sviluppatori descrivono lo stato desiderato e la piattaforma si occupa di mantenerlo, "
+    "gestendo failover e bilanciamento del carico per architetture a microservizi distribuite."
+)
+
+def _benchmark_summarizer(module):
+    module._summarize_chunk(_BENCHMARK_TEXT)
+
+def _benchmark_sentiment_analyzer(module):
+    module.analyze_batch(["I have been feeling really tired and anxious lately, nothing seems to help."] * 32)
+
+MODULE_BENCHMARKS: Dict[str, Callable] = {
+    "summarizer": _benchmark_summarizer,
+    "sentiment": _benchmark_sentiment_analyzer,
+}
+
+def autotune_modules(names=None) -> dict:
+    """Esegue l'auto-tuning dei thread per ogni modulo e salva la configurazione migliore."""
+    results = {}
+    for name in names or MODULE_FACTORIES:
+        build, _ = MODULE_FACTORIES[name]
+        module = build()
+        results[name] = autotune_threads(name, lambda: MODULE_BENCHMARKS[name](module))
+        del module
+    return results
+
+
+def _weights_fingerprint(module) -> str:
+    """
+    Identifica univocamente i pesi di un modulo (modello base + eventuale adapter LoRA),
+    così il file mappato viene rigenerato se cambia il modello o l'adapter.
+    """
+    parts = [type(module).__name__, str(getattr(module, "model_name", ""))]
+    lora_path = getattr(module, "lora_path", None)
+    if lora_path:
+        parts.append(lora_path)
+        for fname in ("adapter_model.safetensors", "adapter_model.bin"):
+            fpath = os.path.join(lora_path, fname)
+            if os.path.exists(fpath):
+                parts.append(f"{fname}:{os.path.getmtime(fpath)}")
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+def export_weights(model: torch.nn.Module, weights_path: str):
+    """Esporta lo state_dict in `weights_path` (scrittura atomica: altri processi vedono solo il file completo)."""
+    os.makedirs(os.path.dirname(weights_path), exist_ok=True)
+    tmp_path = f"{weights_path}.{os.getpid()}.tmp"
+    torch.save(model.state_dict(), tmp_path)
+    os.replace(tmp_path, weights_path)
+    logger.info(f"Pesi esportati per il mapping condiviso: {weights_path}")
+
+
+def map_weights_from_disk(model: torch.nn.Module, weights_path: str) -> bool:
+    """
+    Sostituisce i parametri di un modello su CPU con tensori memory-mapped da `weights_path`,
+    in sola lettura: le pagine restano nella page cache del sistema e sono condivise
+    tra tutti i processi che servono lo stesso modello.
+    Funziona anche su un modello costruito senza pesi (device meta): i tensori vengono
+    assegnati, non copiati, quindi il processo non alloca mai i pesi in memoria anonima.
+    Ritorna False se il file non esiste ancora.
+    """
+    if not os.path.exists(weights_path):
+        return False
+
+    # mmap=True: i tensori puntano al file (copy-on-write), nessuna copia in memoria anonima
+    state = torch.load(weights_path, mmap=True, weights_only=True, map_location="cpu")
+    model.load_state_dict(state, assign=True)
+    # assign=True sostituisce i Parameter: ripristiniamo eventuali pesi condivisi (embedding/lm_head)
+    if hasattr(model, "tie_weights"):
+        model.tie_weights()
+    return True
+
+
+class ModelPool:
+    """
+    Pool di modelli "caldi" per processo.
+    - ogni modulo viene caricato una sola volta e riusato da tutte le sessioni Streamlit
+    - su CPU i pesi vengono mappati in sola lettura da `models/pool/`, così più processi
+      (worker o repliche dell'app sulla stessa macchina) condividono le stesse pagine fisiche
+    - al caricamento esegue un batch fittizio di warm-up
+    - registra tempo di caricamento e memoria residente
+    """
+    def __init__(self, pool_dir: str = None, share_weights: bool = True, warmup: bool = True):
+        if pool_dir is None:
+            base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            pool_dir = os.path.join(base_dir, 'models', 'pool')
+        self.pool_dir = pool_dir
+        self.share_weights = share_weights
+        self.warmup = warmup
+        self._modules = {}
+        self._stats = {}
+        self._router = None
+        self._lock = threading.Lock()
+
+    def get(self, name: str):
+        """Ritorna il modulo `name`, caricandolo (una volta sola) se necessario."""
+        if name in self._modules:
+            return self._modules[name]
+
+        with self._lock:
+            # Double-checked: un altro thread potrebbe averlo caricato nel frattempo
+            if name in self._modules:
+                return self._modules[name]
+            if name not in MODULE_FACTORIES:
+                raise ValueError(f"Modulo sconosciuto: {name}. Disponibili: {list(MODULE_FACTORIES)}")
+
+            build, warmup = MODULE_FACTORIES[name]
+            mem_before = get_memory_usage_mb()
+            start = time.perf_counter()
+
+            # Con i pesi già esportati da un altro processo il modulo viene costruito senza pesi
+            # e riceve direttamente i tensori mappati: né caricamento da checkpoint né picco di memoria
+            mapped = []
+            def load_shared(module):
+                if module.device.type != "cpu":
+                    return False
+                try:
+                    if map_weights_from_disk(module.model, self._weights_path(name, module)):
+                        mapped.append(True)
+                        return True
+                except Exception as e:  # noqa: BLE001 - si ripiega sul caricamento da checkpoint
+                    logger.warning(f"Mapping condiviso dei pesi non riuscito per '{name}': {e}")
+                return False
+
+            module = build(weights_loader=load_shared) if self.share_weights else build()
+
+            # Primo processo sulla macchina: pesi caricati da checkpoint, esportati e rimappati da disco
+            if self.share_weights and not mapped and module.device.type == "cpu":
+                try:
+                    weights_path = self._weights_path(name, module)
+                    if not os.path.exists(weights_path):
+                        export_weights(module.model, weights_path)
+                    mapped.append(map_weights_from_disk(module.model, weights_path))
+                except Exception as e:  # noqa: BLE001 - il pool funziona anche senza mapping
+                    logger.warning(f"Mapping condiviso dei pesi non riuscito per '{name}': {e}")
+            shared = bool(mapped)
+            load_time = time.perf_counter() - start
+
+            warmup_time = 0.0
+            if self.warmup:
+                start = time.perf_counter()
+                with torch.no_grad():
+                    warmup(module)
+                warmup_time = time.perf_counter() - start
+
+            mem_after = get_memory_usage_mb()
+            MODEL_LOAD_SECONDS.labels(module=name).set(load_time)
+            MODEL_WARMUP_SECONDS.labels(module=name).set(warmup_time)
+            self._stats[name] = {
+                "load_seconds": load_time,
+                "warmup_seconds": warmup_time,
+                "shared_weights": shared,
+                "rss_mb": mem_after["rss_mb"],
+                "rss_delta_mb": mem_after["rss_mb"] - mem_before["rss_mb"],
+                "rss_file_mb": mem_after["rss_file_mb"],
+            }
+            logger.info(
+                f"Modulo '{name}' pronto: caricamento {load_time:.1f}s, warm-up {warmup_time:.1f}s, "
+                f"RSS {mem_after['rss_mb']:.0f} MB (di cui da file {mem_after['rss_file_mb']:.0f} MB), "
+                f"pesi condivisi: {shared}"
+            )
+
+            self._modules[name] = module
+            return module
+
+    def _weights_path(self, name: str, module) -> str:
+        return os.path.join(self.pool_dir, f"{name}-{_weights_fingerprint(module)}.pt")
+
+    def summarizer(self):
+        return self.get("summarizer")
+
+    def sentiment_analyzer(self):
+        return self.get("sentiment")
+
+    def summarizer_router(self):
+        """Router dei tier di summarization; il tier di default riusa il summarizer del pool."""
+        with self._lock:
+            if self._router is None:
+                from src.summarization import DEFAULT_SUMMARIZER_MODEL, SummarizerModule, SummarizerRouter
+
+                def load_tier(model_name):
+                    if model_name == DEFAULT_SUMMARIZER_MODEL:
+                        return self.summarizer()
+                    return SummarizerModule(model_name=model_name)
+
+                self._router = SummarizerRouter(loader=load_tier)
+        return self._router
+
+    def preload(self, names=None):
+        """Carica e riscalda in anticipo i moduli indicati (default: tutti)."""
+        for name in names or MODULE_FACTORIES:
+            self.get(name)
+
+    def stats(self) -> dict:
+        """Statistiche di caricamento per modulo più la memoria attuale del processo."""
+        return {"modules": dict(self._stats), "memory": get_memory_usage_mb()}
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_model_pool() -> ModelPool:
+    """Pool singleton del processo corrente."""
+    global _POOL
+    if _POOL is None:
+        with _POOL_LOCK:
+            if _POOL is None:
+                share = os.getenv("MODEL_POOL_SHARE_WEIGHTS", "1") != "0"
+                _POOL = ModelPool(share_weights=share)
+    return _POOL
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Precaricamento dei modelli e tuning del parallelismo CPU")
+    parser.add_argument("--autotune", action="store_true", help="Misura diversi numeri di thread e salva il migliore per modulo")
+    parser.add_argument("--modules", nargs="*", default=None, help=f"Moduli da considerare (default: {list(MODULE_FACTORIES)})")
+    args = parser.parse_args()
+
+    setup_logging()
+    if args.autotune:
+        for module_name, config in autotune_modules(args.modules).items():
+            print(f"{module_name}: {config}")
+    else:
+        # Precarica i modelli: esporta i file mappati in models/pool e stampa le statistiche
+        pool = get_model_pool()
+        pool.preload(args.modules)
+        for module_name, module_stats in pool.stats()["modules"].items():
+            print(f"{module_name}: {module_stats}")
@@ -1,19 +1,28 @@
 import re
+import time
 import logging
-from typing import List
+from functools import lru_cache
+from typing import Any, List, Optional, Tuple, Dict
+
+import pandas as pd
 
 logger = logging.getLogger(__name__)
 
+# Separatore tra sezioni dei PDF strutturati (vedi extract_from_pdf): punto di taglio prioritario
+# solo per il chunker creato con section_separator, negli altri testi è un normale a capo multiplo
+SECTION_SEPARATOR = "\n\n\n"
+
 class RecursiveTokenChunker:
     """
     Divide il testo in chunk rispettando un limite massimo di caratteri (proxy per token),
     cercando di tagliare su separatori naturali (paragrafi, frasi, parole).
+    Con `section_separator` (es. SECTION_SEPARATOR per i PDF strutturati) taglia prima sui confini di sezione.
     """
-    def __init__(self, chunk_size: int = 2000, chunk_overlap: int = 200):
+    def __init__(self, chunk_size: int = 2000, chunk_overlap: int = 200, section_separator: Optional[str] = None):
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
-        # Separatori in ordine di priorità: Doppio a capo (paragrafo), A capo, Punto, Spazio
-        self.separators = ["\n\n", "\n", ". ", " ", ""]
+        # Separatori in ordine di priorità: (Sezione), Doppio a capo (paragrafo), A capo, Punto, Spazio
+        self.separators = ([section_separator] if section_separator else []) + ["\n\n", "\n", ". ", " ", ""]
 
     def split_text(self, text: str) -> List[str]:
         final_chunks = []
@@ -106,3 +115,194 @@ def clean_text(text: str) -> str:
     # Rimuove spazi multipli
     text = re.sub(r'\s+', ' ', text).strip()
     return text
+
+
+@lru_cache(maxsize=1)
+def _emoji_regex() -> str:
+    """
+    Regex per sequenze di emoji costruita come classe di caratteri a intervalli
+    (code point non ASCII usati dalle emoji note al pacchetto `emoji`, inclusi ZWJ,
+    variation selector e modificatori di tono). Un'alternanza delle ~5000 emoji
+    sarebbe ordini di grandezza più lenta sui kernel regex vettoriali.
+    """
+    import emoji
+
+    code_points = sorted({ord(ch) for e in emoji.EMOJI_DATA for ch in e if ord(ch) > 127})
+    ranges = []
+    for cp in code_points:
+        if ranges and cp == ranges[-1][1] + 1:
+            ranges[-1][1] = cp
+        else:
+            ranges.append([cp, cp])
+    char_class = "".join(
+        re.escape(chr(lo)) if lo == hi else f"{re.escape(chr(lo))}-{re.escape(chr(hi))}" for lo, hi in ranges
+    )
+    return f"[{char_class}]+"
+
+def _to_string_series(texts: pd.Series) -> pd.Series:
+    """
+    Converte una colonna in stringhe Arrow se pyarrow è disponibile
+    (operazioni .str eseguite in C dal kernel Arrow), altrimenti nel dtype 'string' di pandas.
+    """
+    try:
+        return texts.astype("string[pyarrow]")
+    except (ImportError, TypeError):
+        return texts.astype("string")
+
+def normalize_text_series(texts: pd.Series, emoji_mode: Optional[str] = None) -> pd.Series:
+    """
+    Versione vettoriale di clean_text per intere colonne (pandas/Arrow).
+    - collassa spazi multipli e fa strip
+    - valori nulli e stringhe vuote diventano <NA>
+    - emoji_mode: None (lascia le emoji), 'demojize' (emoji -> ':nome_emoji:'), 'remove'
+    """
+    texts = _to_string_series(texts)
+    
+    if emoji_mode == "remove":
+        texts = texts.str.replace(_emoji_regex(), " ", regex=True)
+    elif emoji_mode == "demojize":
+        import emoji
+
+        # demojize è per-stringa: lo applichiamo solo alle righe che contengono emoji
+        has_emoji = texts.str.contains(_emoji_regex(), regex=True).fillna(False).astype(bool)
+        if has_emoji.any():
+            texts = texts.copy()
+            texts[has_emoji] = texts[has_emoji].map(lambda t: emoji.demojize(t, delimiters=(" :", ": ")))
+    elif emoji_mode is not None:
+        raise ValueError(f"emoji_mode non valido: {emoji_mode} (atteso None, 'demojize' o 'remove')")
+    
+    texts = texts.str.replace(r"\s+", " ", regex=True).str.strip()
+    return texts.mask(texts == "")
+
+def preprocess_batch(
+    df: pd.DataFrame,
+    text_col: str,
+    emoji_mode: Optional[str] = None,
+    drop_duplicates: bool = True,
+    min_chars: int = 1,
+    max_chars: Optional[int] = None,
+) -> Tuple[pd.DataFrame, Dict]:
+    """
+    Pipeline di preprocessing batch su un DataFrame: normalizzazione del testo,
+    rimozione dei nulli, deduplica e filtro per lunghezza, tutto con operazioni vettoriali.
+    Ritorna il DataFrame filtrato (indice originale preservato) e un dizionario di statistiche
+    con il throughput in righe/s.
+    """
+    start = time.perf_counter()
+    rows_in = len(df)
+    
+    texts = normalize_text_series(df[text_col], emoji_mode=emoji_mode)
+    keep = texts.notna()
+    stats = {"rows_in": rows_in, "null_or_empty": int((~keep).sum())}
+    
+    lengths = texts.str.len()
+    too_short = keep & (lengths < min_chars)
+    too_long = keep & (lengths > max_chars) if max_chars is not None else pd.Series(False, index=df.index)
+    keep &= ~(too_short | too_long)
+    stats["too_short"] = int(too_short.sum())
+    stats["too_long"] = int(too_long.sum())
+    
+    if drop_duplicates:
+        duplicates = keep & texts.duplicated(keep="first")
+        keep &= ~duplicates
+        stats["duplicates"] = int(duplicates.sum())
+    
+    out = df.loc[keep.to_numpy()].copy()
+    out[text_col] = texts.loc[keep.to_numpy()].array
+    
+    elapsed = time.perf_counter() - start
+    stats["rows_out"] = len(out)
+    stats["seconds"] = elapsed
+    stats["rows_per_s"] = rows_in / elapsed if elapsed > 0 else float("inf")
+    logger.info(
+        f"Preprocessing batch: {rows_in} -> {len(out)} righe in {elapsed:.3f}s "
+        f"({stats['rows_per_s']:.0f} righe/s)."
+    )
+    return out, stats
+
+
+# --- Specifiche OpenAPI ---
+
+def openapi_endpoint_text(routes: List[str], summary: str, description: str) -> str:
+    endpoint_desc = f"Endpoint: {', '.join(routes)}"
+    if summary:
+        endpoint_desc += f"\nRiepilogo: {summary}"
+    if description:
+        endpoint_desc += f"\nDettagli: {description}"
+    return endpoint_desc
+
+def openapi_spec_header(spec_info: Dict[str, Any]) -> str:
+    return f"Titolo API: {spec_info['title']}\nDescrizione Generale: {spec_info['description']}\n"
+
+def pack_openapi_chunks(spec_info: Dict[str, Any], max_length: int = 2000, length_fn=len) -> List[str]:
+    """
+    Impacchetta gli endpoint (vedi src.data_ingestion.parse_openapi_endpoints)
+    in chunk coerenti per la summarization.
+    - endpoint con riepilogo e descrizione identici vengono deduplicati in un solo record
+    - gli endpoint sono raggruppati per tag/prefisso del path; un gruppo non viene diviso
+      se entra in un chunk, e più gruppi piccoli possono condividere lo stesso chunk
+    - un singolo endpoint non viene mai spezzato tra due chunk
+    max_length è espresso nell'unità di `length_fn` (caratteri di default, o token del modello).
+    """
+    # 1. Deduplica (l'ordine di prima apparizione viene mantenuto)
+    records = {}
+    for ep in spec_info["endpoints"]:
+        route = f"{ep['method']} {ep['path']}"
+        key = (ep["tag"], ep["summary"].lower(), ep["description"].lower())
+        if not ep["summary"] and not ep["description"]:
+            key = (ep["tag"], route)  # nessun testo: niente da deduplicare
+        if key in records:
+            records[key]["routes"].append(route)
+        else:
+            records[key] = {"tag": ep["tag"], "routes": [route], "summary": ep["summary"], "description": ep["description"]}
+    deduplicated = len(spec_info["endpoints"]) - len(records)
+    if deduplicated:
+        logger.info(f"OpenAPI: {deduplicated} endpoint con descrizione identica deduplicati.")
+
+    # 2. Raggruppamento per tag / prefisso
+    groups = {}
+    for rec in records.values():
+        groups.setdefault(rec["tag"], []).append(openapi_endpoint_text(rec["routes"], rec["summary"], rec["description"]))
+
+    # 3. Packing con misura additiva dei pezzi (evita di ri-misurare il chunk a ogni aggiunta)
+    separator = "\n\n"
+    sep_len = length_fn(separator)
+    chunks, current, current_len = [], [], 0
+
+    def flush():
+        nonlocal current, current_len
+        if current:
+            chunks.append(separator.join(current))
+        current, current_len = [], 0
+
+    header = openapi_spec_header(spec_info).strip()
+    current, current_len = [header], length_fn(header)
+
+    for tag, texts in groups.items():
+        group_title = f"Gruppo: {tag}"
+        pieces = [group_title] + texts
+        lengths = [length_fn(p) for p in pieces]
+        group_len = sum(lengths) + sep_len * (len(pieces) - 1)
+
+        # Il gruppo intero non entra nello spazio rimasto ma entra in un chunk vuoto: nuovo chunk
+        # (l'intestazione della specifica resta comunque attaccata al primo gruppo)
+        if current != [header] and current_len + sep_len + group_len > max_length and group_len <= max_length:
+            flush()
+
+        for i, (piece, piece_len) in enumerate(zip(pieces, lengths)):
+            if current and current_len + sep_len + piece_len > max_length:
+                if current[-1] == group_title:
+                    # Non lasciamo un titolo di gruppo senza endpoint in coda al chunk
+                    current.pop()
+                    current_len -= lengths[0] + sep_len
+                flush()
+                if i > 0:
+                    # Gruppo spezzato su più chunk: ripetiamo il titolo del gruppo per contesto
+                    title = f"{group_title} (continua)"
+                    current, current_len = [title], length_fn(title)
+            current_len += (sep_len if current else 0) + piece_len
+            current.append(piece)
+    flush()
+
+    logger.info(f"OpenAPI: {len(records)} endpoint in {len(groups)} gruppi impacchettati in {len(chunks)} chunk.")
+    return chunks
@@ -1,9 +1,12 @@
+import numpy as np
 import torch
-from transformers import pipeline, AutoTokenizer, AutoModelForSequenceClassification
+from transformers import pipeline, AutoConfig, AutoTokenizer, AutoModelForSequenceClassification
 from peft import PeftModel, PeftConfig
 import logging
 import os
-from src.utils import get_device
+import time
+from src.utils import get_device, apply_runtime_config
+from src.metrics import counter, gauge, histogram
 
 
 def _infer_num_labels_from_adapter(adapter_path: str) -> int | None:
@@ -34,21 +37,111 @@ def _infer_num_labels_from_adapter(adapter_path: str) -> int | None:
 
 logger = logging.getLogger(__name__)
 
+# Metriche di inferenza (method = analyze / analyze_long / analyze_batch / predict_proba)
+SENTIMENT_BATCH_SIZE = histogram(
+    "sentiment_batch_size", "Testi (o finestre) per batch di inferenza sentiment", ["method"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+SENTIMENT_BATCH_SECONDS = histogram("sentiment_batch_seconds", "Latenza di un batch di inferenza sentiment", ["method"])
+SENTIMENT_TOKENS = counter("sentiment_tokens_total", "Token (senza padding) processati dal modello di sentiment", ["method"])
+SENTIMENT_TOKENS_PER_SECOND = gauge("sentiment_tokens_per_second", "Throughput dell'ultimo batch di sentiment", ["method"])
+SENTIMENT_ERRORS = counter("sentiment_errors_total", "Errori di inferenza sentiment", ["method"])
+
+def _record_batch(method: str, batch_size: int, tokens: int, seconds: float):
+    SENTIMENT_BATCH_SIZE.labels(method=method).observe(batch_size)
+    SENTIMENT_BATCH_SECONDS.labels(method=method).observe(seconds)
+    SENTIMENT_TOKENS.labels(method=method).inc(tokens)
+    if seconds > 0:
+        SENTIMENT_TOKENS_PER_SECOND.labels(method=method).set(tokens / seconds)
+
+class SentimentBatchResult:
+    """
+    Risultato colonnare di un'analisi batch: al posto di un dizionario per testo
+    tiene un vettore di id di classe (int8) e una matrice di probabilità (float16/float32).
+    Conversioni verso pandas/Arrow senza copie dei dati dove possibile.
+    """
+    def __init__(self, label_ids: np.ndarray, probabilities: np.ndarray, labels: list):
+        self.label_ids = label_ids
+        self.probabilities = probabilities
+        self.labels = list(labels)
+
+    def __len__(self):
+        return len(self.label_ids)
+
+    @property
+    def scores(self) -> np.ndarray:
+        """Probabilità della classe predetta."""
+        return self.probabilities[np.arange(len(self)), self.label_ids]
+
+    @classmethod
+    def concat(cls, results: list) -> "SentimentBatchResult":
+        if not results:
+            raise ValueError("Nessun risultato da concatenare.")
+        return cls(
+            np.concatenate([r.label_ids for r in results]),
+            np.concatenate([r.probabilities for r in results]),
+            results[0].labels,
+        )
+
+    def take(self, indices: np.ndarray) -> "SentimentBatchResult":
+        """Righe selezionate (o ripetute) per indice, es. per propagare i risultati dei rappresentanti."""
+        return SentimentBatchResult(self.label_ids[indices], self.probabilities[indices], self.labels)
+
+    def to_pandas(self, prob_prefix: str = "p_"):
+        """DataFrame con label categoriche (codici = label_ids) e una colonna per classe."""
+        import pandas as pd
+
+        data = {"label": pd.Categorical.from_codes(self.label_ids, categories=self.labels)}
+        for i, label in enumerate(self.labels):
+            data[f"{prob_prefix}{label}"] = self.probabilities[:, i]
+        return pd.DataFrame(data, copy=False)
+
+    def to_arrow(self, prob_prefix: str = "p_"):
+        """Tabella Arrow: label come colonna dizionario (indici int8) e probabilità per classe."""
+        import pyarrow as pa
+
+        columns = {
+            "label": pa.DictionaryArray.from_arrays(pa.array(self.label_ids, type=pa.int8()), pa.array(self.labels)),
+        }
+        # Trasposta contigua: ogni colonna di probabilità diventa un buffer Arrow senza copia
+        by_class = np.ascontiguousarray(self.probabilities.T)
+        for i, label in enumerate(self.labels):
+            columns[f"{prob_prefix}{label}"] = pa.array(by_class[i])
+        return pa.table(columns)
+
+    def write_parquet(self, path: str, **kwargs):
+        import pyarrow.parquet as pq
+
+        pq.write_table(self.to_arrow(), path, **kwargs)
+
+    def write_ipc(self, path: str):
+        """Scrive in formato Arrow IPC (Feather v2), leggibile in memory-map."""
+        import pyarrow as pa
+
+        table = self.to_arrow()
+        with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
 class SentimentAnalyzerModule:
     def __init__(
         self,
         model_name: str = "xlm-roberta-base",
         lora_path: str = "models/sentiment_lora",
         fallback_lora_paths: tuple = ("models/xlmroberta_checkpoints",),
+        weights_loader=None,
     ):
         """
         Inizializza l'analizzatore di sentiment usando un adapter LoRA se disponibile.
         - model_name: modello base HF
         - lora_path: percorso predefinito per l'adapter LoRA fine-tunato (quello del notebook)
         - fallback_lora_paths: percorsi aggiuntivi provati in caso il principale non esista
+        - weights_loader: callable(module) -> bool. Se presente il modello viene prima costruito
+          senza pesi (device meta) e il loader li assegna, es. in mmap dal pool (vedi src.model_pool);
+          se ritorna False i pesi vengono caricati normalmente con from_pretrained
         """
 
         self.device = get_device()
+        apply_runtime_config("sentiment", self.device)
 
         # Percorsi assoluti
         base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
@@ -88,6 +181,8 @@ class SentimentAnalyzerModule:
             if adapter_num_labels is None and self.lora_path:
                 adapter_num_labels = _infer_num_labels_from_adapter(self.lora_path)
 
+            self.model_name = base_model_source
+
             # 2) Carica tokenizer (se esiste un adapter, usa il tokenizer salvato lì)
             tokenizer_source = self.lora_path if self.lora_path else base_model_source
             logger.info(f"Caricamento tokenizer da: {tokenizer_source}")
@@ -118,24 +213,36 @@ class SentimentAnalyzerModule:
             label2id = {lbl: i for i, lbl in enumerate(labels_order)}
             logger.info(f"Classi impostate: {labels_order}")
 
-            # 4) Modello base
-            self.base_model = AutoModelForSequenceClassification.from_pretrained(
-                base_model_source,
-                num_labels=len(id2label),
-                id2label=id2label,
-                label2id=label2id,
-                cache_dir=self.models_dir,
-            )
+            model_kwargs = dict(num_labels=len(id2label), id2label=id2label, label2id=label2id, cache_dir=self.models_dir)
 
-            # 5) Applica LoRA se presente
-            if self.lora_path:
-                logger.info(f"Trovato adapter LoRA in {self.lora_path}. Caricamento...")
-                self.model = PeftModel.from_pretrained(self.base_model, self.lora_path)
-                self.model.to(self.device)
-                logger.info("Modello LoRA caricato con successo.")
-            else:
-                logger.warning("Adapter LoRA non trovato. Uso il modello base (non finetunato).")
-                self.model = self.base_model.to(self.device)
+            # 4) Pesi forniti dal loader (es. mappati da disco): struttura su device meta, nessun peso in memoria
+            self.model = None
+            if weights_loader is not None:
+                from accelerate import init_empty_weights
+
+                with init_empty_weights():
+                    self.base_model = AutoModelForSequenceClassification.from_config(
+                        AutoConfig.from_pretrained(base_model_source, **model_kwargs)
+                    )
+                    # low_cpu_mem_usage: anche l'adapter resta su meta invece di essere copiato (no-op) nei pesi vuoti
+                    self.model = (
+                        PeftModel.from_pretrained(self.base_model, self.lora_path, low_cpu_mem_usage=True)
+                        if self.lora_path else self.base_model
+                    )
+                if not weights_loader(self):
+                    self.model = None
+
+            # 5) Altrimenti modello base caricato da checkpoint, con LoRA se presente
+            if self.model is None:
+                self.base_model = AutoModelForSequenceClassification.from_pretrained(base_model_source, **model_kwargs)
+                if self.lora_path:
+                    logger.info(f"Trovato adapter LoRA in {self.lora_path}. Caricamento...")
+                    self.model = PeftModel.from_pretrained(self.base_model, self.lora_path)
+                    logger.info("Modello LoRA caricato con successo.")
+                else:
+                    logger.warning("Adapter LoRA non trovato. Uso il modello base (non finetunato).")
+                    self.model = self.base_model
+            self.model.to(self.device)
 
             # Inference mode
             self.model.eval()
@@ -150,6 +257,7 @@ class SentimentAnalyzerModule:
         Ritorna: {'label': 'positive'/'negative'/'neutral', 'score': float}
         """
         try:
+            start = time.perf_counter()
             inputs = self.tokenizer(text, return_tensors="pt", truncation=True, max_length=512).to(self.device)
             
             with torch.no_grad():
@@ -161,18 +269,158 @@ class SentimentAnalyzerModule:
             # Ottieni la classe con probabilità maggiore
             score, class_id = torch.max(probabilities, dim=-1)
             label = self.model.config.id2label[class_id.item()]
+            _record_batch("analyze", 1, inputs["input_ids"].shape[1], time.perf_counter() - start)
             
             return {'label': label, 'score': score.item()}
             
         except Exception as e:
+            SENTIMENT_ERRORS.labels(method="analyze").inc()
             logger.error(f"Errore analisi sentiment: {e}")
             return {'label': 'error', 'score': 0.0}
 
-    def analyze_batch(self, texts: list):
+    def analyze_long(self, texts, window_size: int = 512, stride: int = 128, aggregation: str = "mean",
+                     batch_size: int = 16):
         """
-        Analizza una lista di testi.
+        Modalità documenti lunghi: invece di troncare a 512 token, divide ogni testo in finestre
+        di `window_size` token sovrapposte di `stride` token, classifica le finestre di tutti
+        i documenti in batch condivisi e aggrega le probabilità per documento.
+        - aggregation: 'mean' (media), 'max' (massimo per classe, rinormalizzato)
+          oppure 'attention' (media pesata con softmax della confidenza di ogni finestra)
+        Ritorna una lista di {'label', 'score', 'probabilities', 'windows'} (uno per testo).
         """
-        results = []
-        for text in texts:
-            results.append(self.analyze(text))
-        return results
\ No newline at end of file
+        if isinstance(texts, str):
+            texts = [texts]
+        if aggregation not in ("mean", "max", "attention"):
+            raise ValueError(f"Aggregazione non valida: {aggregation} (attese 'mean', 'max', 'attention')")
+        if not texts:
+            return []
+
+        try:
+            encodings = self.tokenizer(
+                list(texts),
+                truncation=True,
+                max_length=window_size,
+                stride=stride,
+                return_overflowing_tokens=True,
+            )
+            # Per ogni finestra, l'indice del documento da cui proviene
+            doc_index = torch.tensor(encodings["overflow_to_sample_mapping"], dtype=torch.long)
+            num_windows = len(encodings["input_ids"])
+            num_labels = self.model.config.num_labels
+
+            # Finestre ordinate per lunghezza: batch con poco padding
+            order = sorted(range(num_windows), key=lambda i: len(encodings["input_ids"][i]))
+            logits = torch.empty(num_windows, num_labels)
+
+            for start in range(0, num_windows, batch_size):
+                batch_start = time.perf_counter()
+                batch_ids = order[start:start + batch_size]
+                batch = self.tokenizer.pad(
+                    {
+                        "input_ids": [encodings["input_ids"][i] for i in batch_ids],
+                        "attention_mask": [encodings["attention_mask"][i] for i in batch_ids],
+                    },
+                    return_tensors="pt",
+                ).to(self.device)
+                with torch.no_grad():
+                    logits[batch_ids] = self.model(**batch).logits.float().cpu()
+                _record_batch(
+                    "analyze_long", len(batch_ids), int(batch["attention_mask"].sum()), time.perf_counter() - batch_start
+                )
+
+            probabilities = torch.nn.functional.softmax(logits, dim=-1)
+            num_docs = len(texts)
+            windows_per_doc = torch.bincount(doc_index, minlength=num_docs)
+
+            if aggregation == "mean":
+                doc_probs = torch.zeros(num_docs, num_labels).index_add_(0, doc_index, probabilities)
+                doc_probs /= windows_per_doc.unsqueeze(1)
+            elif aggregation == "max":
+                doc_probs = torch.zeros(num_docs, num_labels).scatter_reduce_(
+                    0, doc_index.unsqueeze(1).expand(-1, num_labels), probabilities, reduce="amax", include_self=False
+                )
+                doc_probs /= doc_probs.sum(dim=-1, keepdim=True)
+            else:
+                # Peso di ogni finestra = softmax (per documento) del suo logit massimo:
+                # le finestre in cui il modello è più sicuro contano di più
+                confidence = logits.max(dim=-1).values
+                weights = torch.exp(confidence - confidence.max())
+                doc_weight = torch.zeros(num_docs).index_add_(0, doc_index, weights)
+                doc_probs = torch.zeros(num_docs, num_labels).index_add_(
+                    0, doc_index, probabilities * weights.unsqueeze(1)
+                )
+                doc_probs /= doc_weight.unsqueeze(1)
+
+            scores, class_ids = torch.max(doc_probs, dim=-1)
+            id2label = self.model.config.id2label
+            return [
+                {
+                    'label': id2label[class_ids[i].item()],
+                    'score': scores[i].item(),
+                    'probabilities': {id2label[c]: doc_probs[i, c].item() for c in range(num_labels)},
+                    'windows': windows_per_doc[i].item(),
+                }
+                for i in range(num_docs)
+            ]
+
+        except Exception as e:
+            SENTIMENT_ERRORS.labels(method="analyze_long").inc()
+            logger.error(f"Errore analisi sentiment (documenti lunghi): {e}")
+            return [{'label': 'error', 'score': 0.0, 'probabilities': {}, 'windows': 0} for _ in texts]
+
+    def predict_proba(self, texts: list, batch_size: int = 32, max_length: int = 512) -> np.ndarray:
+        """
+        Probabilità di tutte le classi per una lista di testi, calcolate a batch.
+        I testi vengono ordinati per lunghezza in modo che ogni batch abbia poco padding.
+        Ritorna una matrice float32 (n_testi, n_classi) nell'ordine di model.config.id2label.
+        """
+        num_labels = self.model.config.num_labels
+        probabilities = np.empty((len(texts), num_labels), dtype=np.float32)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+
+        for start in range(0, len(texts), batch_size):
+            batch_start = time.perf_counter()
+            batch_ids = order[start:start + batch_size]
+            inputs = self.tokenizer(
+                [texts[i] for i in batch_ids],
+                return_tensors="pt",
+                truncation=True,
+                max_length=max_length,
+                padding=True,
+            ).to(self.device)
+            with torch.no_grad():
+                logits = self.model(**inputs).logits
+            probabilities[batch_ids] = torch.nn.functional.softmax(logits.float(), dim=-1).cpu().numpy()
+            _record_batch(
+                "predict_proba", len(batch_ids), int(inputs["attention_mask"].sum()), time.perf_counter() - batch_start
+            )
+
+        return probabilities
+
+    def analyze_columnar(self, texts: list, batch_size: int = 32, dtype=np.float32) -> SentimentBatchResult:
+        """
+        Analisi batch con risultato colonnare compatto (vedi SentimentBatchResult):
+        id di classe int8 e probabilità di tutte le classi in `dtype` (float32 o float16).
+        """
+        labels = [self.model.config.id2label[i] for i in range(self.model.config.num_labels)]
+        if not texts:
+            return SentimentBatchResult(np.empty(0, dtype=np.int8), np.empty((0, len(labels)), dtype=dtype), labels)
+        probabilities = self.predict_proba(texts, batch_size=batch_size)
+        return SentimentBatchResult(probabilities.argmax(axis=1).astype(np.int8), probabilities.astype(dtype), labels)
+
+    def analyze_batch(self, texts: list, batch_size: int = 32):
+        """
+        Analizza una lista di testi (inferenza a batch).
+        Ritorna un dizionario {'label', 'score'} per testo, come analyze.
+        """
+        try:
+            result = self.analyze_columnar(texts, batch_size=batch_size)
+        except Exception as e:
+            SENTIMENT_ERRORS.labels(method="analyze_batch").inc()
+            logger.error(f"Errore analisi sentiment batch: {e}")
+            return [{'label': 'error', 'score': 0.0} for _ in texts]
+        scores = result.scores
+        return [
+            {'label': result.labels[label_id], 'score': float(score)}
+            for label_id, score in zip(result.label_ids, scores)
+        ]
@@ -1,15 +1,77 @@
 import torch
-from transformers import pipeline, AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import pipeline, AutoConfig, AutoTokenizer, AutoModelForSeq2SeqLM
+import json
 import logging
 import os
-from src.utils import get_device
-from src.preprocessing import RecursiveTokenChunker
+import time
+from src.utils import get_device, apply_runtime_config
+from src.metrics import counter, gauge, histogram
+from src.preprocessing import SECTION_SEPARATOR, RecursiveTokenChunker, pack_openapi_chunks
+from src.summary_index import DocumentSummaryIndex, hash_text
 
 logger = logging.getLogger(__name__)
 
+SUMMARIZER_CHUNK_SECONDS = histogram("summarizer_chunk_seconds", "Latenza della summarization di un chunk", ["model"])
+SUMMARIZER_CHUNKS_PER_REQUEST = histogram(
+    "summarizer_chunks_per_request", "Chunk generati per richiesta di summarization", buckets=(1, 2, 4, 8, 16, 32, 64)
+)
+SUMMARIZER_INPUT_WORDS = counter("summarizer_input_words_total", "Parole in input al modello di summarization", ["model"])
+SUMMARIZER_WORDS_PER_SECOND = gauge("summarizer_words_per_second", "Throughput (parole in input) dell'ultimo chunk", ["model"])
+SUMMARIZER_ERRORS = counter("summarizer_errors_total", "Chunk la cui summarization è fallita", ["model"])
+SUMMARIZER_TIER_REQUESTS = counter("summarizer_tier_requests_total", "Richieste instradate per tier di modello", ["tier"])
+SUMMARY_INDEX_CHUNKS = counter(
+    "summary_index_chunks_total", "Chunk della summarization incrementale (reused = cache hit)", ["result"]
+)
+
+CHUNK_ERROR_MESSAGE = "Errore nell'elaborazione di questa sezione."
+
+DEFAULT_SUMMARIZER_MODEL = "efederici/it5-base-summarization"
+
+# Limite di token in input per chunk (i modelli IT5 sono addestrati su 512 token),
+# con un piccolo margine per i token speciali
+MAX_INPUT_TOKENS = 512
+TOKEN_MARGIN = 8
+
+# Tier di modelli in ordine di qualità crescente.
+# - max_input_words: lunghezza massima (in parole) per cui il tier è considerato sufficiente
+#   (None = nessun limite)
+# - ms_per_word: stima di latenza su CPU, sovrascritta dai benchmark (src/evaluation.py --tiers)
+# - provisional: limiti e latenze sono stime iniziali, non ancora misurate. Il router sceglie
+#   automaticamente solo i tier benchmarkati (il benchmark salva provisional=False) e altrimenti
+#   resta sul tier di default; un tier provvisorio si può comunque richiedere esplicitamente
+SUMMARIZER_TIERS = {
+    "small": {"model_name": "it5/it5-small-news-summarization", "max_input_words": 150, "ms_per_word": 4.0,
+              "provisional": True},
+    "base": {"model_name": DEFAULT_SUMMARIZER_MODEL, "max_input_words": None, "ms_per_word": 12.0,
+             "provisional": True},
+}
+DEFAULT_SUMMARIZER_TIER = "base"
+
+TIER_PROFILES_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models', 'summarizer_tiers.json'))
+
+def load_tier_profiles(path: str = TIER_PROFILES_PATH) -> dict:
+    """Tier di default aggiornati con le misure salvate dall'ultimo benchmark, se presenti."""
+    tiers = {name: dict(cfg) for name, cfg in SUMMARIZER_TIERS.items()}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                measured = json.load(f)
+            for name, cfg in measured.items():
+                tiers.setdefault(name, {}).update(cfg)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Profili dei tier non leggibili ({path}): {e}")
+    return tiers
+
 class SummarizerModule:
-    def __init__(self, model_name: str = "efederici/it5-base-summarization"):
+    def __init__(self, model_name: str = DEFAULT_SUMMARIZER_MODEL, weights_loader=None):
+        """
+        - weights_loader: callable(module) -> bool. Se presente il modello viene costruito senza pesi
+          (device meta) e il loader li assegna, es. in mmap dal pool (vedi src.model_pool);
+          se ritorna False i pesi vengono caricati normalmente con from_pretrained
+        """
         self.device = get_device()
+        apply_runtime_config("summarizer", self.device)
+        self.model_name = model_name
         
         # Definisci il percorso per la cache locale dei modelli
         self.models_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
@@ -19,7 +81,17 @@ class SummarizerModule:
         
         try:
             self.tokenizer = AutoTokenizer.from_pretrained(model_name, cache_dir=self.models_dir)
-            self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, cache_dir=self.models_dir).to(self.device)
+            self.model = None
+            if weights_loader is not None:
+                from accelerate import init_empty_weights
+
+                with init_empty_weights():
+                    self.model = AutoModelForSeq2SeqLM.from_config(AutoConfig.from_pretrained(model_name, cache_dir=self.models_dir))
+                if not weights_loader(self):
+                    self.model = None
+            if self.model is None:
+                self.model = AutoModelForSeq2SeqLM.from_pretrained(model_name, cache_dir=self.models_dir)
+            self.model.to(self.device)
             
             # Crea pipeline
             self.summarizer = pipeline(
@@ -37,32 +109,130 @@ class SummarizerModule:
         # Inizializza il chunker
         # Aumentiamo leggermente la dimensione del chunk per dare più contesto
         self.chunker = RecursiveTokenChunker(chunk_size=3000, chunk_overlap=300)
+        # Testi estratti dai PDF: taglio prioritario sui confini di sezione
+        self.section_chunker = RecursiveTokenChunker(chunk_size=3000, chunk_overlap=300, section_separator=SECTION_SEPARATOR)
 
-    def summarize(self, text: str) -> str:
+    def summarize(self, text: str, progress_callback=None, sections: bool = False) -> str:
         """
         Esegue la summarization.
         Se il testo è lungo, restituisce un riassunto strutturato per punti (sezioni),
         evitando di comprimere eccessivamente l'informazione.
+        progress_callback(done, total), se fornita, viene chiamata dopo ogni chunk.
+        sections: il testo viene da extract_from_pdf e le sezioni sono separate da SECTION_SEPARATOR.
         """
         if not text.strip():
             return "Nessun testo fornito."
 
         # 1. Chunking
-        chunks = self.chunker.split_text(text)
+        chunks = (self.section_chunker if sections else self.chunker).split_text(text)
+        return self.summarize_chunks(chunks, progress_callback=progress_callback)
+
+    def summarize_chunks(self, chunks: list, progress_callback=None) -> str:
+        """Riassume chunk già preparati (uno per sezione) e assembla l'output."""
         logger.info(f"Avvio summarization su {len(chunks)} chunk.")
+        SUMMARIZER_CHUNKS_PER_REQUEST.observe(len(chunks))
         
         # Caso semplice: testo breve
         if len(chunks) == 1:
-            return self._summarize_chunk(chunks[0])
+            summary = self._summarize_chunk(chunks[0])
+            if progress_callback:
+                progress_callback(1, 1)
+            return summary
         
         # Caso complesso: testo lungo -> Lista puntata delle sezioni
-        partial_summaries = []
+        section_summaries = []
         for i, chunk in enumerate(chunks):
             logger.info(f"Processing chunk {i+1}/{len(chunks)}...")
-            # Aggiungiamo un indicatore di sezione per chiarezza
-            section_summary = self._summarize_chunk(chunk)
-            partial_summaries.append(f"**Sezione {i+1}:** {section_summary}")
-            
+            section_summaries.append(self._summarize_chunk(chunk))
+            if progress_callback:
+                progress_callback(i + 1, len(chunks))
+
+        return self._assemble_output(section_summaries)
+
+    def token_length(self, text: str) -> int:
+        """Numero di token di `text` secondo il tokenizer del modello."""
+        return len(self.tokenizer(text, add_special_tokens=False)["input_ids"])
+
+    @property
+    def max_input_tokens(self) -> int:
+        return min(self.tokenizer.model_max_length, MAX_INPUT_TOKENS) - TOKEN_MARGIN
+
+    def summarize_openapi(self, spec_info: dict, progress_callback=None) -> str:
+        """
+        Summarization di una specifica OpenAPI a partire dai record degli endpoint
+        (vedi src.data_ingestion.parse_openapi_endpoints).
+        Gli endpoint vengono deduplicati e impacchettati per tag/prefisso del path fino al
+        limite di token del modello: meno chunk, ognuno con un contesto coerente.
+        """
+        if not spec_info.get("endpoints"):
+            return "Nessun endpoint trovato nella specifica."
+
+        chunks = pack_openapi_chunks(spec_info, max_length=self.max_input_tokens, length_fn=self.token_length)
+        return self.summarize_chunks(chunks, progress_callback=progress_callback)
+
+    def summarize_incremental(self, doc_id: str, text: str, index: DocumentSummaryIndex = None) -> str:
+        """
+        Summarization incrementale per documenti rigenerati periodicamente.
+        Usa l'indice persistente del documento per riutilizzare i riassunti dei chunk invariati:
+        solo i chunk nuovi o modificati vengono passati al modello, quindi il costo
+        scala con la dimensione della modifica e non con quella del documento.
+        """
+        if not text.strip():
+            return "Nessun testo fornito."
+
+        index = index or DocumentSummaryIndex()
+        # Stessa normalizzazione del chunker, così gli offset salvati restano coerenti
+        text = text.replace('\r\n', '\n')
+        doc_hash = hash_text(text)
+
+        entry = index.load(doc_id)
+        if entry and entry.get("model") != self.model_name:
+            logger.info(f"Indice di '{doc_id}' generato con un altro modello: ricostruzione completa.")
+            entry = None
+
+        # Documento identico all'ultima versione: nessuna inferenza
+        if entry and entry.get("doc_hash") == doc_hash:
+            logger.info(f"Documento '{doc_id}' invariato, riuso del riassunto salvato.")
+            SUMMARY_INDEX_CHUNKS.labels(result="reused").inc(len(entry["chunks"]))
+            return self._assemble_output([c["summary"] for c in entry["chunks"]])
+
+        segments = index.plan(text, self.chunker, entry)
+        to_summarize = [seg for seg in segments if seg["summary"] is None]
+        logger.info(
+            f"Summarization incrementale di '{doc_id}': {len(segments)} chunk, "
+            f"{len(segments) - len(to_summarize)} riutilizzati, {len(to_summarize)} da generare."
+        )
+        SUMMARY_INDEX_CHUNKS.labels(result="reused").inc(len(segments) - len(to_summarize))
+        SUMMARY_INDEX_CHUNKS.labels(result="generated").inc(len(to_summarize))
+
+        for i, seg in enumerate(to_summarize):
+            logger.info(f"Processing chunk modificato {i+1}/{len(to_summarize)}...")
+            seg["summary"] = self._summarize_chunk(text[seg["start"]:seg["end"]])
+
+        summaries = [seg["summary"] for seg in segments]
+        # I chunk falliti non vanno in cache: saranno ritentati alla prossima versione
+        failed = False
+        for seg in segments:
+            if seg["summary"] == CHUNK_ERROR_MESSAGE:
+                seg["summary"] = None
+                failed = True
+
+        index.save(doc_id, {
+            "doc_id": doc_id,
+            "model": self.model_name,
+            "doc_hash": None if failed else doc_hash,
+            "chunks": segments,
+        })
+
+        return self._assemble_output(summaries)
+
+    def _assemble_output(self, section_summaries: list) -> str:
+        if len(section_summaries) == 1:
+            return section_summaries[0]
+
+        # Aggiungiamo un indicatore di sezione per chiarezza
+        partial_summaries = [f"**Sezione {i+1}:** {summary}" for i, summary in enumerate(section_summaries)]
+
         # Uniamo i riassunti con doppio a capo invece di ri-riassumerli
         # Questo mantiene il dettaglio di ogni parte.
         final_output = "Il documento è stato analizzato in più parti per mantenere i dettagli:\n\n" + "\n\n".join(partial_summaries)
@@ -83,6 +253,7 @@ class SummarizerModule:
             if min_len >= max_len:
                 min_len = int(max_len * 0.8)
 
+            start = time.perf_counter()
             output = self.summarizer(
                 text, 
                 max_length=max_len, 
@@ -93,7 +264,93 @@ class SummarizerModule:
                 early_stopping=True,
                 truncation=True
             )
+            elapsed = time.perf_counter() - start
+            SUMMARIZER_CHUNK_SECONDS.labels(model=self.model_name).observe(elapsed)
+            SUMMARIZER_INPUT_WORDS.labels(model=self.model_name).inc(input_len)
+            if elapsed > 0:
+                SUMMARIZER_WORDS_PER_SECOND.labels(model=self.model_name).set(input_len / elapsed)
             return output[0]['summary_text']
         except Exception as e:
+            SUMMARIZER_ERRORS.labels(model=self.model_name).inc()
             logger.error(f"Errore durante summarization chunk: {e}")
-            return "Errore nell'elaborazione di questa sezione."
+            return CHUNK_ERROR_MESSAGE
+
+
+def _word_count(text: str) -> int:
+    return len(text.split())
+
+
+class SummarizerRouter:
+    """
+    Instrada ogni richiesta al tier di modello più adatto.
+    Il tier viene scelto dalla lunghezza dell'input (per testi brevi, es. descrizioni
+    di endpoint OpenAPI, basta il modello small) e dal budget di latenza del chiamante.
+    I modelli dei tier vengono caricati solo al primo utilizzo.
+    """
+    def __init__(self, tiers: dict = None, loader=None):
+        self.tiers = tiers or load_tier_profiles()
+        # Tier ordinati dal più veloce al più accurato
+        self.order = sorted(self.tiers, key=lambda name: self.tiers[name]["ms_per_word"])
+        self.default_tier = DEFAULT_SUMMARIZER_TIER if DEFAULT_SUMMARIZER_TIER in self.tiers else self.order[-1]
+        # Scelta automatica solo tra tier misurati (più quello di default)
+        self.routable = [name for name in self.order
+                         if name == self.default_tier or not self.tiers[name].get("provisional")]
+        self._loader = loader or (lambda model_name: SummarizerModule(model_name=model_name))
+        self._modules = {}
+
+    def estimate_latency(self, tier: str, text: str) -> float:
+        """Stima in secondi del tempo di summarization di `text` con il tier indicato."""
+        return len(text.split()) * self.tiers[tier]["ms_per_word"] / 1000
+
+    def choose_tier(self, text: str, latency_budget: float = None, unit_words: int = None) -> str:
+        """
+        1. parte dal tier più piccolo sufficiente per la lunghezza del testo
+           (o per `unit_words`, la lunghezza della più lunga unità riassunta in modo indipendente)
+        2. se la stima supera il budget (secondi), scende al tier più accurato che ci sta
+        3. se nessun tier rispetta il budget, usa il più veloce
+        I tier con profilo provvisorio (non benchmarkato) sono esclusi: senza benchmark si usa il default.
+        """
+        words = unit_words if unit_words is not None else len(text.split())
+        sufficient = next(
+            (name for name in self.routable
+             if self.tiers[name].get("max_input_words") is None or words <= self.tiers[name]["max_input_words"]),
+            self.routable[-1],
+        )
+        if latency_budget is None or self.estimate_latency(sufficient, text) <= latency_budget:
+            return sufficient
+
+        candidates = self.routable[:self.routable.index(sufficient)]
+        fitting = [name for name in candidates if self.estimate_latency(name, text) <= latency_budget]
+        return fitting[-1] if fitting else self.routable[0]
+
+    def get_module(self, tier: str) -> SummarizerModule:
+        if tier not in self._modules:
+            self._modules[tier] = self._loader(self.tiers[tier]["model_name"])
+        return self._modules[tier]
+
+    def summarize(self, text: str, latency_budget: float = None, tier: str = None, progress_callback=None,
+                  sections: bool = False) -> str:
+        """Summarization con il tier indicato o scelto automaticamente (`sections`: vedi SummarizerModule.summarize)."""
+        tier = tier or self.choose_tier(text, latency_budget)
+        SUMMARIZER_TIER_REQUESTS.labels(tier=tier).inc()
+        logger.info(
+            f"Tier di summarization: {tier} ({self.tiers[tier]['model_name']}), "
+            f"latenza stimata {self.estimate_latency(tier, text):.1f}s"
+        )
+        return self.get_module(tier).summarize(text, progress_callback=progress_callback, sections=sections)
+
+    def summarize_openapi(self, spec_info: dict, latency_budget: float = None, tier: str = None, progress_callback=None) -> str:
+        """
+        Summarization di una specifica OpenAPI con il tier indicato o scelto automaticamente.
+        Il modello riceve gli endpoint impacchettati fino al limite di token: la sufficienza del tier
+        è valutata sul chunk più lungo, la latenza sull'insieme dei chunk. I chunk sono stimati
+        contando parole al posto dei token (una parola è almeno un token): sono grandi almeno quanto
+        quelli del modello, senza doverne caricare il tokenizer prima di scegliere il tier.
+        """
+        if tier is None:
+            chunks = pack_openapi_chunks(spec_info, max_length=MAX_INPUT_TOKENS - TOKEN_MARGIN, length_fn=_word_count)
+            unit_words = max((_word_count(c) for c in chunks), default=0)
+            tier = self.choose_tier(" ".join(chunks), latency_budget, unit_words=unit_words)
+        SUMMARIZER_TIER_REQUESTS.labels(tier=tier).inc()
+        logger.info(f"Tier di summarization OpenAPI: {tier} ({self.tiers[tier]['model_name']})")
+        return self.get_module(tier).summarize_openapi(spec_info, progress_callback=progress_callback)
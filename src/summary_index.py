@@ -0,0 +1,148 @@
+import bisect
+import hashlib
+import json
+import logging
+import os
+import re
+from typing import Dict, List, Optional
+
+from src.preprocessing import RecursiveTokenChunker
+
+logger = logging.getLogger(__name__)
+
+
+# Caratteri iniziali di un chunk usati per ritrovarlo nella nuova versione (vedi chunk_prefix_hash)
+_PREFIX_CHARS = 64
+# Posizioni candidate verificate al massimo per ogni chunk della versione precedente
+_MAX_CANDIDATES = 64
+
+
+def hash_text(text: str) -> str:
+    """Hash stabile (SHA-256) di un chunk o di un documento."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def chunk_prefix_hash(text: str) -> str:
+    """Hash corto dell'inizio di un chunk: individua le posizioni candidate senza salvare il testo."""
+    return hashlib.blake2b(text[:_PREFIX_CHARS].encode("utf-8"), digest_size=8).hexdigest()
+
+
+class DocumentSummaryIndex:
+    """
+    Indice persistente per documento usato per la ri-summarization incrementale.
+    Per ogni documento salva i confini dei chunk prodotti da RecursiveTokenChunker (offset di carattere),
+    l'hash di ogni chunk e del suo inizio e il relativo riassunto, senza il testo del documento.
+    Quando arriva una nuova versione, i chunk invariati vengono ritrovati nel nuovo testo
+    e riutilizzati: solo le parti modificate vengono ri-chunkate e ri-riassunte.
+    """
+    def __init__(self, index_dir: Optional[str] = None):
+        if index_dir is None:
+            base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+            index_dir = os.path.join(base_dir, 'data', 'processed', 'summary_index')
+        self.index_dir = index_dir
+        os.makedirs(self.index_dir, exist_ok=True)
+
+    def _entry_path(self, doc_id: str) -> str:
+        # L'id del documento può essere un URL o un path: usiamo un hash come nome file
+        return os.path.join(self.index_dir, f"{hash_text(doc_id)[:32]}.json")
+
+    def load(self, doc_id: str) -> Optional[Dict]:
+        path = self._entry_path(doc_id)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"Indice corrotto per il documento '{doc_id}', verrà ricostruito: {e}")
+            return None
+
+    def save(self, doc_id: str, entry: Dict):
+        path = self._entry_path(doc_id)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        # Rename atomico: un crash a metà scrittura non corrompe l'indice esistente
+        os.replace(tmp_path, path)
+
+    def plan(self, text: str, chunker: RecursiveTokenChunker, entry: Optional[Dict] = None) -> List[Dict]:
+        """
+        Calcola i segmenti della nuova versione del documento.
+        Ritorna una lista ordinata di {'start', 'end', 'hash', 'prefix', 'summary'} dove 'summary'
+        è None per i chunk nuovi o modificati (da ri-riassumere).
+        """
+        known_summaries = {}
+        anchors = []
+
+        if entry:
+            known_summaries = {c["hash"]: c["summary"] for c in entry.get("chunks", []) if c.get("summary")}
+
+            # 1. Ancore: chunk della versione precedente ritrovati identici (e in ordine) nel nuovo testo.
+            # Posizioni provate: stesso spostamento dell'ultima ancora, stessa posizione, poi gli inizi
+            # di parola con lo stesso hash iniziale; ogni candidato è verificato sull'hash del chunk
+            cursor, shift = 0, 0
+            word_starts = None
+            for chunk in entry.get("chunks", []):
+                if "prefix" not in chunk:
+                    continue
+                length = chunk["end"] - chunk["start"]
+                candidates = [chunk["start"] + shift, chunk["start"]]
+                pos = next((p for p in candidates if p >= cursor and hash_text(text[p:p + length]) == chunk["hash"]), -1)
+                if pos == -1:
+                    if word_starts is None:
+                        word_starts = {}
+                        for match in re.finditer(r"(?<!\S)\S", text):
+                            start = match.start()
+                            word_starts.setdefault(chunk_prefix_hash(text[start:start + _PREFIX_CHARS]), []).append(start)
+                    positions = word_starts.get(chunk["prefix"], [])
+                    candidates = positions[bisect.bisect_left(positions, cursor):][:_MAX_CANDIDATES]
+                    pos = next((p for p in candidates if hash_text(text[p:p + length]) == chunk["hash"]), -1)
+                if pos == -1:
+                    continue
+                anchors.append({
+                    "start": pos,
+                    "end": pos + length,
+                    "hash": chunk["hash"],
+                    "prefix": chunk["prefix"],
+                    "summary": chunk["summary"],
+                })
+                cursor, shift = pos + length, pos - chunk["start"]
+
+        # 2. Le parti di testo tra le ancore sono nuove o modificate: vanno ri-chunkate
+        segments = []
+        gap_start = 0
+        for anchor in anchors + [None]:
+            gap_end = anchor["start"] if anchor else len(text)
+            gap = text[gap_start:gap_end]
+            if gap.strip():
+                # I separatori a bordo delle ancore non fanno parte dei chunk
+                lead = len(gap) - len(gap.lstrip())
+                gap_start += lead
+                gap = gap.strip()
+                offset, prev_pos = 0, -1
+                for chunk_text in chunker.split_text(gap):
+                    # Pezzi di soli separatori: nessun testo da riassumere
+                    if not chunk_text.strip():
+                        continue
+                    pos = gap.find(chunk_text, offset)
+                    if pos == -1:
+                        # Chunk in overlap con il precedente (taglio brutale del chunker)
+                        pos = gap.find(chunk_text, prev_pos + 1)
+                    if pos == -1:
+                        pos = offset
+                    prev_pos = pos
+                    chunk_hash = hash_text(chunk_text)
+                    segments.append({
+                        "start": gap_start + pos,
+                        "end": gap_start + pos + len(chunk_text),
+                        "hash": chunk_hash,
+                        "prefix": chunk_prefix_hash(chunk_text),
+                        # Un chunk spostato ma identico mantiene il suo riassunto
+                        "summary": known_summaries.get(chunk_hash),
+                    })
+                    offset = pos + len(chunk_text)
+            if anchor:
+                segments.append(anchor)
+                gap_start = anchor["end"]
+
+        return segments
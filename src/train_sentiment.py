@@ -1,16 +1,20 @@
 import argparse
+import hashlib
+import sys
 import pandas as pd
 import torch
 import os
+import time
 import logging
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score, f1_score
-from datasets import Dataset, DatasetDict
+from datasets import Dataset, DatasetDict, load_from_disk
 from transformers import (
     AutoTokenizer, 
     AutoModelForSequenceClassification, 
     TrainingArguments, 
     Trainer, 
+    TrainerCallback,
     DataCollatorWithPadding
 )
 from peft import (
@@ -21,6 +25,11 @@ from peft import (
     PeftConfig
 )
 
+# Add project root to sys.path (lo script viene lanciato come `python src/train_sentiment.py`)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.preprocessing import normalize_text_series
+
 # Configurazione Logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -44,44 +53,106 @@ def compute_metrics(eval_pred):
     
     return {"accuracy": acc, "f1": f1}
 
-def load_and_clean_data(file_path, text_col, label_col, test_size=0.2):
+class ThroughputCallback(TrainerCallback):
     """
-    Carica il CSV, rinomina le colonne, mappa le label e divide in train/val.
+    Misura il throughput di training (campioni/s) per ogni epoca.
+    """
+    def __init__(self, num_train_samples: int):
+        self.num_train_samples = num_train_samples
+        self.epoch_start = None
+        self.history = []
+
+    def on_epoch_begin(self, args, state, control, **kwargs):
+        self.epoch_start = time.perf_counter()
+
+    def on_epoch_end(self, args, state, control, **kwargs):
+        if self.epoch_start is None:
+            return
+        elapsed = time.perf_counter() - self.epoch_start
+        samples_per_s = self.num_train_samples / elapsed if elapsed > 0 else 0.0
+        epoch = int(round(state.epoch)) if state.epoch is not None else len(self.history) + 1
+        self.history.append({"epoch": epoch, "seconds": elapsed, "samples_per_s": samples_per_s})
+        logger.info(f"Epoca {epoch}: {self.num_train_samples} campioni in {elapsed:.1f}s ({samples_per_s:.1f} campioni/s)")
+
+def tokenized_cache_key(file_path, text_col, label_col, tokenizer, max_length, test_size=0.2, streaming=False,
+                        emoji_mode=None):
+    """
+    Chiave della cache del dataset tokenizzato: hash del file dati, delle colonne usate
+    e della configurazione del tokenizer. Se uno di questi cambia, la cache viene rigenerata.
+    """
+    hasher = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(block)
+    hasher.update(
+        f"|{text_col}|{label_col}|{max_length}|{test_size}|{streaming}|{emoji_mode}"
+        f"|{type(tokenizer).__name__}|{tokenizer.name_or_path}|{len(tokenizer)}".encode("utf-8")
+    )
+    return hasher.hexdigest()[:24]
+
+def streaming_cache_key(file_path, text_col, label_col, emoji_mode=None):
+    """
+    Chiave del Parquet pulito della modalità streaming: percorso assoluto, dimensione e mtime del CSV
+    (senza rileggere un file da qualche GB) più le opzioni di pulizia. Un CSV modificato
+    o un altro file con lo stesso nome producono una chiave diversa.
+    """
+    stat = os.stat(file_path)
+    hasher = hashlib.sha256(
+        f"{os.path.abspath(file_path)}|{stat.st_size}|{stat.st_mtime_ns}|{text_col}|{label_col}|{emoji_mode}".encode("utf-8")
+    )
+    return hasher.hexdigest()[:24]
+
+def clean_label_frame(df, text_col, label_col, emoji_mode=None):
+    """
+    Pulizia vettoriale di un DataFrame (o di un chunk): rinomina le colonne,
+    rimuove i nulli, normalizza il testo e mappa le label a interi.
+    Tutte le operazioni sono a livello di colonna, senza loop Python per riga.
     """
-    logger.info(f"Caricamento dati da {file_path}...")
-    df = pd.read_csv(file_path)
-    
-    # Verifica colonne
-    if text_col not in df.columns or label_col not in df.columns:
-        raise ValueError(f"Colonne '{text_col}' o '{label_col}' non trovate nel CSV. Colonne disponibili: {df.columns.tolist()}")
-    
     # Rinomina per standardizzazione
-    df = df.rename(columns={text_col: "text", label_col: "label"})
+    df = df[[text_col, label_col]].rename(columns={text_col: "text", label_col: "label"})
+    
+    # Pulizia base testo (opzionale, si affida al tokenizer per il grosso)
+    df["text"] = normalize_text_series(df["text"], emoji_mode=emoji_mode)
     
-    # Rimuovi righe con valori nulli
+    # Rimuovi righe con valori nulli (o testo vuoto dopo la normalizzazione)
     initial_len = len(df)
     df = df.dropna(subset=["text", "label"])
     if len(df) < initial_len:
         logger.warning(f"Rimosse {initial_len - len(df)} righe con valori mancanti.")
     
-    # Pulizia base testo (opzionale, si affida al tokenizer per il grosso)
-    df["text"] = df["text"].astype(str).str.strip()
-    
     # Mappatura label
     # Se le label sono già interi, verifica che siano 0, 1, 2
     if pd.api.types.is_integer_dtype(df["label"]):
         unique_labels = sorted(df["label"].unique())
-        logger.info(f"Label numeriche rilevate: {unique_labels}")
         if not set(unique_labels).issubset({0, 1, 2}):
              raise ValueError(f"Label numeriche fuori range (atteso 0,1,2), trovato: {unique_labels}")
     else:
         # Tenta mappatura stringa -> int
-        df["label"] = df["label"].astype(str).str.lower().map(DEFAULT_LABEL_MAP)
+        raw_labels = df["label"]
+        df["label"] = raw_labels.astype(str).str.lower().map(DEFAULT_LABEL_MAP)
         if df["label"].isnull().any():
-            unmapped = df[df["label"].isnull()][label_col].unique()
+            unmapped = raw_labels[df["label"].isnull()].unique()
             raise ValueError(f"Impossibile mappare alcune label: {unmapped}. Verifica DEFAULT_LABEL_MAP o i dati.")
-        df["label"] = df["label"].astype(int)
-        
+    
+    df["label"] = df["label"].astype("int64")
+    return df
+
+def _check_columns(columns, text_col, label_col):
+    if text_col not in columns or label_col not in columns:
+        raise ValueError(f"Colonne '{text_col}' o '{label_col}' non trovate nel CSV. Colonne disponibili: {list(columns)}")
+
+def load_and_clean_data(file_path, text_col, label_col, test_size=0.2, emoji_mode=None):
+    """
+    Carica il CSV, rinomina le colonne, mappa le label e divide in train/val.
+    """
+    logger.info(f"Caricamento dati da {file_path}...")
+    df = pd.read_csv(file_path)
+    
+    # Verifica colonne
+    _check_columns(df.columns, text_col, label_col)
+    
+    df = clean_label_frame(df, text_col, label_col, emoji_mode=emoji_mode)
+    logger.info(f"Label numeriche: {sorted(df['label'].unique())}")
     logger.info(f"Dataset pronto. {len(df)} righe totali.")
     
     # Split
@@ -92,6 +163,62 @@ def load_and_clean_data(file_path, text_col, label_col, test_size=0.2):
         "validation": Dataset.from_pandas(val_df, preserve_index=False)
     })
 
+def load_and_clean_data_streaming(file_path, text_col, label_col, test_size=0.2, chunksize=100_000,
+                                  cache_dir="data/processed/streaming_cache", emoji_mode=None):
+    """
+    Variante out-of-core di load_and_clean_data per CSV più grandi della RAM.
+    Il CSV viene letto a chunk, pulito con operazioni vettoriali e scritto in Parquet;
+    il Parquet viene poi materializzato come dataset Arrow memory-mapped su disco.
+    Lo split stratificato lavora sugli indici (carica in RAM solo la colonna label).
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from datasets import ClassLabel
+
+    logger.info(f"Caricamento dati in streaming da {file_path} (chunk da {chunksize} righe)...")
+    
+    # Verifica colonne leggendo solo l'header
+    _check_columns(pd.read_csv(file_path, nrows=0).columns, text_col, label_col)
+    
+    os.makedirs(cache_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(file_path))[0]
+    parquet_path = os.path.join(cache_dir, f"{stem}-{streaming_cache_key(file_path, text_col, label_col, emoji_mode)}.parquet")
+    
+    if os.path.exists(parquet_path):
+        # Stesso CSV (percorso, dimensione, mtime) e stesse opzioni: il Parquet pulito è riusabile
+        logger.info(f"Parquet pulito trovato in cache: {parquet_path}")
+        labels = pq.read_table(parquet_path, columns=["label"]).column("label").to_pandas()
+        total_rows, label_counts = len(labels), labels.value_counts()
+    else:
+        schema = pa.schema([("text", pa.string()), ("label", pa.int64())])
+        total_rows = 0
+        label_counts = pd.Series(dtype="int64")
+        # Scrittura su file temporaneo: un'esecuzione interrotta non lascia un Parquet parziale in cache
+        tmp_path = f"{parquet_path}.{os.getpid()}.tmp"
+        with pq.ParquetWriter(tmp_path, schema) as writer:
+            for chunk in pd.read_csv(file_path, usecols=[text_col, label_col], chunksize=chunksize):
+                chunk = clean_label_frame(chunk, text_col, label_col, emoji_mode=emoji_mode)
+                writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+                total_rows += len(chunk)
+                label_counts = label_counts.add(chunk["label"].value_counts(), fill_value=0)
+                logger.info(f"Processate {total_rows} righe...")
+        os.replace(tmp_path, parquet_path)
+    
+    logger.info(f"Distribuzione label: {label_counts.astype(int).to_dict()}")
+    logger.info(f"Dataset pronto. {total_rows} righe totali.")
+    
+    # Dataset Arrow su disco (memory-mapped), non caricato in RAM
+    dataset = Dataset.from_parquet(parquet_path, cache_dir=cache_dir)
+    # ClassLabel è richiesto da datasets per lo split stratificato
+    dataset = dataset.cast_column("label", ClassLabel(names=["negative", "neutral", "positive"]))
+    
+    split = dataset.train_test_split(test_size=test_size, stratify_by_column="label", seed=42)
+    
+    return DatasetDict({
+        "train": split["train"],
+        "validation": split["test"]
+    })
+
 def main():
     parser = argparse.ArgumentParser(description="Fine-tuning LoRA per Sentiment Analysis con XLM-RoBERTa")
     parser.add_argument("--data_path", type=str, required=True, help="Percorso al file CSV dei dati")
@@ -102,20 +229,56 @@ def main():
     parser.add_argument("--epochs", type=int, default=3, help="Numero di epoche")
     parser.add_argument("--batch_size", type=int, default=16, help="Batch size")
     parser.add_argument("--lr", type=float, default=2e-5, help="Learning rate")
+    parser.add_argument("--max_length", type=int, default=128, help="Lunghezza massima in token (troncamento)")
+    parser.add_argument("--num_proc", type=int, default=min(4, os.cpu_count() or 1), help="Processi per la tokenizzazione")
+    parser.add_argument("--cache_dir", type=str, default="data/processed/tokenized_cache", help="Cache su disco dei dataset tokenizzati")
+    parser.add_argument("--no_cache", action="store_true", help="Ignora la cache e ri-tokenizza i dati")
+    parser.add_argument("--emoji_mode", type=str, default=None, choices=["demojize", "remove"], help="Normalizzazione delle emoji nel testo")
+    parser.add_argument("--streaming", action="store_true", help="Caricamento out-of-core a chunk per CSV molto grandi")
+    parser.add_argument("--chunksize", type=int, default=100_000, help="Righe per chunk in modalità streaming")
+    parser.add_argument("--bf16", action="store_true", help="Autocast bf16 (anche su CPU con supporto AVX512-BF16/AMX)")
     
     args = parser.parse_args()
     
-    # 1. Preparazione Dati
-    dataset = load_and_clean_data(args.data_path, args.text_col, args.label_col)
-    
-    # 2. Tokenizer
+    # 1. Tokenizer
     logger.info(f"Caricamento tokenizer {args.model_name}...")
     tokenizer = AutoTokenizer.from_pretrained(args.model_name)
     
-    def tokenize_function(examples):
-        return tokenizer(examples["text"], padding="max_length", truncation=True, max_length=128)
+    # 2. Preparazione Dati (con cache su disco del dataset già tokenizzato)
+    cache_key = tokenized_cache_key(
+        args.data_path, args.text_col, args.label_col, tokenizer, args.max_length,
+        streaming=args.streaming, emoji_mode=args.emoji_mode
+    )
+    cache_path = os.path.join(args.cache_dir, cache_key)
     
-    tokenized_datasets = dataset.map(tokenize_function, batched=True)
+    if not args.no_cache and os.path.exists(os.path.join(cache_path, "dataset_dict.json")):
+        logger.info(f"Dataset tokenizzato trovato in cache: {cache_path}")
+        tokenized_datasets = load_from_disk(cache_path)
+    else:
+        if args.streaming:
+            dataset = load_and_clean_data_streaming(
+                args.data_path, args.text_col, args.label_col, chunksize=args.chunksize, emoji_mode=args.emoji_mode
+            )
+        else:
+            dataset = load_and_clean_data(args.data_path, args.text_col, args.label_col, emoji_mode=args.emoji_mode)
+        
+        # Niente padding qui: il padding dinamico per batch lo fa il DataCollator.
+        # 'length' serve al sampler per raggruppare esempi di lunghezza simile.
+        def tokenize_function(examples):
+            return tokenizer(examples["text"], truncation=True, max_length=args.max_length, return_length=True)
+        
+        start = time.perf_counter()
+        tokenized_datasets = dataset.map(
+            tokenize_function,
+            batched=True,
+            num_proc=args.num_proc if args.num_proc > 1 else None,
+            remove_columns=["text"],
+        )
+        logger.info(f"Tokenizzazione completata in {time.perf_counter() - start:.1f}s.")
+        
+        if not args.no_cache:
+            tokenized_datasets.save_to_disk(cache_path)
+            logger.info(f"Dataset tokenizzato salvato in cache: {cache_path}")
     
     # 3. Modello Base
     logger.info("Caricamento modello base...")
@@ -152,9 +315,15 @@ def main():
         load_best_model_at_end=True,
         logging_dir=f"{args.output_dir}_logs",
         logging_steps=10,
-        use_cpu=not torch.cuda.is_available()
+        use_cpu=not torch.cuda.is_available(),
+        # Batch con lunghezze simili -> meno token di padding per batch
+        group_by_length=True,
+        length_column_name="length",
+        bf16=args.bf16,
     )
     
+    throughput = ThroughputCallback(len(tokenized_datasets["train"]))
+    
     trainer = Trainer(
         model=model,
         args=training_args,
@@ -163,11 +332,15 @@ def main():
         tokenizer=tokenizer,
         data_collator=DataCollatorWithPadding(tokenizer=tokenizer),
         compute_metrics=compute_metrics,
+        callbacks=[throughput],
     )
     
     logger.info("Avvio training...")
     trainer.train()
     
+    for epoch_stats in throughput.history:
+        logger.info(f"Throughput epoca {epoch_stats['epoch']}: {epoch_stats['samples_per_s']:.1f} campioni/s")
+    
     # 6. Salvataggio
     logger.info(f"Salvataggio modello LoRA in {args.output_dir}...")
     model.save_pretrained(args.output_dir)
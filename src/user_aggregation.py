@@ -0,0 +1,359 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+# Add project root to sys.path (lo script può essere lanciato come `python src/user_aggregation.py`)
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from src.preprocessing import preprocess_batch
+from src.utils import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SERIOUS_LABELS = ("Serious",)
+DEFAULT_ALPHA = 0.3
+
+# Ordinamento dei messaggi nello stato: timestamp reali o posizione nell'export
+CLOCKS = ("time", "row")
+
+
+class UserAggregator:
+    """
+    Aggregati incrementali per utente sulle predizioni del modello di salute mentale.
+    Lo stato è tenuto in array NumPy compatti (una riga per utente):
+    - EWMA delle probabilità di ogni classe
+    - numero di messaggi, conteggio per classe predetta e numero di predizioni "gravi"
+    - "orologio" dell'ultimo messaggio visto: secondi dall'epoch (clock="time") oppure
+      posizione del messaggio tra quelli dell'utente nell'export (clock="row")
+    - hash dei messaggi con quell'orologio: con timestamp al giorno o al secondo più messaggi
+      possono avere lo stesso istante, e solo quelli già visti vanno esclusi
+    Nuovi messaggi aggiornano lo stato senza ri-analizzare lo storico dell'utente.
+    """
+    def __init__(self, labels: Sequence[str], alpha: float = DEFAULT_ALPHA,
+                 serious_labels: Sequence[str] = DEFAULT_SERIOUS_LABELS, capacity: int = 1024,
+                 clock: str = "time"):
+        if not 0 < alpha <= 1:
+            raise ValueError(f"alpha deve essere in (0, 1], trovato: {alpha}")
+        if clock not in CLOCKS:
+            raise ValueError(f"clock deve essere uno tra {CLOCKS}, trovato: {clock}")
+        self.labels = list(labels)
+        self.alpha = alpha
+        self.clock = clock
+        self.serious_labels = [lbl for lbl in serious_labels if lbl in self.labels]
+        self.serious_ids = np.array([self.labels.index(lbl) for lbl in self.serious_labels], dtype=np.int64)
+
+        num_labels = len(self.labels)
+        self.user_ids: List[str] = []
+        self.user_index: Dict[str, int] = {}
+        self.ewma = np.zeros((capacity, num_labels), dtype=np.float32)
+        self.class_counts = np.zeros((capacity, num_labels), dtype=np.int32)
+        self.message_count = np.zeros(capacity, dtype=np.int64)
+        self.serious_count = np.zeros(capacity, dtype=np.int64)
+        self.last_seen = np.full(capacity, -np.inf, dtype=np.float64)
+        # riga utente -> hash dei messaggi già aggregati con orologio uguale a last_seen
+        self.last_seen_hashes: Dict[int, set] = {}
+
+    @property
+    def num_users(self) -> int:
+        return len(self.user_ids)
+
+    def _grow(self, min_capacity: int):
+        capacity = len(self.message_count)
+        while capacity < min_capacity:
+            capacity *= 2
+        def _resize(arr, fill):
+            out = np.full((capacity,) + arr.shape[1:], fill, dtype=arr.dtype)
+            out[:len(arr)] = arr
+            return out
+        self.ewma = _resize(self.ewma, 0)
+        self.class_counts = _resize(self.class_counts, 0)
+        self.message_count = _resize(self.message_count, 0)
+        self.serious_count = _resize(self.serious_count, 0)
+        self.last_seen = _resize(self.last_seen, -np.inf)
+
+    def _rows_for(self, user_ids: Sequence[str]) -> np.ndarray:
+        """Indici di riga per gli utenti, registrando quelli nuovi."""
+        for user in pd.unique(np.asarray(user_ids, dtype=object)):
+            if user not in self.user_index:
+                self.user_index[user] = len(self.user_ids)
+                self.user_ids.append(user)
+        if self.num_users > len(self.message_count):
+            self._grow(self.num_users)
+        return np.fromiter((self.user_index[u] for u in user_ids), dtype=np.int64, count=len(user_ids))
+
+    def new_message_mask(self, user_ids: Sequence[str], timestamps: np.ndarray,
+                         message_hashes: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        True per i messaggi non ancora aggregati: più recenti dell'ultimo visto per quell'utente
+        oppure con lo stesso istante ma un hash (`message_hashes`) non ancora visto.
+        """
+        rows = np.array([self.user_index.get(u, -1) for u in user_ids], dtype=np.int64)
+        last_seen = np.where(rows >= 0, self.last_seen[np.maximum(rows, 0)], -np.inf) if len(rows) else np.empty(0)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        new = timestamps > last_seen
+        ties = np.flatnonzero(timestamps == last_seen)
+        if message_hashes is not None and len(ties):
+            new[ties] = [int(message_hashes[i]) not in self.last_seen_hashes.get(int(rows[i]), ()) for i in ties]
+        return new
+
+    def update(self, user_ids: Sequence[str], timestamps: np.ndarray, probabilities: np.ndarray,
+               message_hashes: Optional[np.ndarray] = None):
+        """
+        Aggiorna lo stato con un batch di messaggi già classificati
+        (`message_hashes`: hash dei testi, vedi new_message_mask).
+        L'EWMA viene aggiornata in forma chiusa per ogni utente: con k nuovi messaggi
+        ewma' = (1-a)^k * ewma + sum_i a * (1-a)^(k-1-i) * p_i
+        (per un utente nuovo il primo messaggio inizializza l'EWMA).
+        """
+        if len(user_ids) == 0:
+            return
+        probabilities = np.asarray(probabilities, dtype=np.float32)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        rows = self._rows_for(user_ids)
+
+        # Ordina per utente e, dentro l'utente, per tempo
+        order = np.lexsort((timestamps, rows))
+        rows, timestamps, probabilities = rows[order], timestamps[order], probabilities[order]
+
+        users, starts, counts = np.unique(rows, return_index=True, return_counts=True)
+        position = np.arange(len(rows)) - np.repeat(starts, counts)
+        from_end = np.repeat(counts, counts) - 1 - position
+
+        decay = 1.0 - self.alpha
+        weights = self.alpha * decay ** from_end
+        # Utenti senza storico: il messaggio più vecchio fa da valore iniziale dell'EWMA
+        is_new = self.message_count[users] == 0
+        first = starts[is_new]
+        weights[first] = decay ** from_end[first]
+
+        contributions = np.add.reduceat(weights[:, None] * probabilities, starts, axis=0)
+        self.ewma[users] = (decay ** counts)[:, None] * self.ewma[users] + contributions
+
+        predicted = probabilities.argmax(axis=1)
+        np.add.at(self.class_counts, (rows, predicted), 1)
+        self.message_count[users] += counts
+        if len(self.serious_ids):
+            serious = np.isin(predicted, self.serious_ids).astype(np.int64)
+            self.serious_count[users] += np.add.reduceat(serious, starts)
+        previous_last_seen = self.last_seen[users]
+        self.last_seen[users] = np.maximum(previous_last_seen, np.maximum.reduceat(timestamps, starts))
+
+        if message_hashes is not None:
+            # Hash dei messaggi all'istante più recente: si azzerano se l'istante è avanzato
+            for user in users[self.last_seen[users] > previous_last_seen]:
+                self.last_seen_hashes.pop(int(user), None)
+            message_hashes = np.asarray(message_hashes)[order]
+            for i in np.flatnonzero(timestamps == self.last_seen[rows]):
+                self.last_seen_hashes.setdefault(int(rows[i]), set()).add(int(message_hashes[i]))
+
+    def to_frame(self) -> pd.DataFrame:
+        """Vista tabellare dello stato (una riga per utente)."""
+        n = self.num_users
+        df = pd.DataFrame(self.ewma[:n], columns=[f"ewma_{lbl}" for lbl in self.labels])
+        df.insert(0, "user", self.user_ids)
+        df["messages"] = self.message_count[:n]
+        df["serious_predictions"] = self.serious_count[:n]
+        df["serious_rate"] = np.divide(
+            self.serious_count[:n], self.message_count[:n],
+            out=np.zeros(n), where=self.message_count[:n] > 0
+        )
+        df["current_state"] = np.asarray(self.labels, dtype=object)[self.ewma[:n].argmax(axis=1)] if n else []
+        df["last_seen"] = self.last_seen[:n]
+        return df
+
+    def save(self, path: str):
+        n = self.num_users
+        meta = {"labels": self.labels, "alpha": self.alpha, "serious_labels": self.serious_labels,
+                "clock": self.clock, "user_ids": self.user_ids}
+        np.savez_compressed(
+            path,
+            meta=np.array(json.dumps(meta)),
+            ewma=self.ewma[:n],
+            class_counts=self.class_counts[:n],
+            message_count=self.message_count[:n],
+            serious_count=self.serious_count[:n],
+            last_seen=self.last_seen[:n],
+            last_seen_rows=np.array([row for row, hashes in self.last_seen_hashes.items() for _ in hashes], dtype=np.int64),
+            last_seen_hashes=np.array([h for hashes in self.last_seen_hashes.values() for h in hashes], dtype=np.uint64),
+        )
+        logger.info(f"Stato aggregati salvato in {path} ({n} utenti).")
+
+    @classmethod
+    def load(cls, path: str) -> "UserAggregator":
+        with np.load(path) as data:
+            meta = json.loads(str(data["meta"]))
+            n = len(meta["user_ids"])
+            agg = cls(meta["labels"], alpha=meta["alpha"], serious_labels=meta["serious_labels"],
+                      capacity=max(n, 1024), clock=meta.get("clock", "time"))
+            agg.user_ids = meta["user_ids"]
+            agg.user_index = {u: i for i, u in enumerate(agg.user_ids)}
+            agg.ewma[:n] = data["ewma"]
+            agg.class_counts[:n] = data["class_counts"]
+            agg.message_count[:n] = data["message_count"]
+            agg.serious_count[:n] = data["serious_count"]
+            agg.last_seen[:n] = data["last_seen"]
+            # Stati salvati prima dell'introduzione degli hash: solo il confronto sull'orologio
+            if "last_seen_hashes" in data.files:
+                for row, message_hash in zip(data["last_seen_rows"], data["last_seen_hashes"]):
+                    agg.last_seen_hashes.setdefault(int(row), set()).add(int(message_hash))
+        return agg
+
+
+def epoch_seconds(times: pd.Series) -> np.ndarray:
+    """
+    Secondi dall'epoch (float) indipendenti dalla risoluzione del dtype datetime64
+    (ns, us, s... cambia con la versione di pandas e con il formato dell'input).
+    I timestamp con fuso orario vengono convertiti in UTC.
+    """
+    times = pd.to_datetime(times)
+    if times.dt.tz is not None:
+        times = times.dt.tz_convert("UTC").dt.tz_localize(None)
+    return ((times - pd.Timestamp(0)) / pd.Timedelta(seconds=1)).to_numpy(dtype=np.float64)
+
+
+def window_summary(user_ids: Sequence[str], times: pd.Series, probabilities: np.ndarray,
+                   labels: Sequence[str], serious_labels: Sequence[str] = DEFAULT_SERIOUS_LABELS,
+                   window: str = "1D") -> pd.DataFrame:
+    """
+    Riepilogo per (utente, finestra temporale): probabilità medie per classe,
+    numero di messaggi e di predizioni gravi.
+    """
+    df = pd.DataFrame(probabilities, columns=[f"p_{lbl}" for lbl in labels])
+    df["user"] = np.asarray(user_ids, dtype=object)
+    df["time"] = pd.to_datetime(pd.Series(times).reset_index(drop=True))
+    predicted = np.asarray(labels, dtype=object)[probabilities.argmax(axis=1)]
+    df["serious"] = np.isin(predicted, list(serious_labels))
+    grouped = df.groupby(["user", pd.Grouper(key="time", freq=window)])
+    summary = grouped[[f"p_{lbl}" for lbl in labels]].mean()
+    summary["messages"] = grouped.size()
+    summary["serious_predictions"] = grouped["serious"].sum()
+    return summary.reset_index()
+
+
+def score_messages(analyzer, df: pd.DataFrame, text_col: str, user_col: Optional[str] = None,
+                   time_col: Optional[str] = None, aggregator: Optional[UserAggregator] = None,
+                   batch_size: int = 32, window: str = "1D"):
+    """
+    Pipeline su un export di chat: pulizia, filtro dei messaggi già aggregati,
+    inferenza batch e aggiornamento incrementale degli aggregati per utente.
+    Senza `time_col` i messaggi già aggregati si riconoscono dalla posizione tra quelli
+    dell'utente: l'export deve essere cumulativo (i nuovi messaggi in coda), così
+    rilanciare lo stesso file non conta due volte gli stessi messaggi.
+    Ritorna (aggregator, riepilogo per finestra temporale o None se manca la colonna tempo).
+    """
+    labels = [analyzer.model.config.id2label[i] for i in range(analyzer.model.config.num_labels)]
+    clock = "time" if time_col else "row"
+    aggregator = aggregator or UserAggregator(labels, clock=clock)
+    if aggregator.labels != labels:
+        raise ValueError(f"Le classi dello stato ({aggregator.labels}) non coincidono con quelle del modello ({labels}).")
+    if aggregator.num_users == 0:
+        aggregator.clock = clock
+    elif aggregator.clock != clock:
+        raise ValueError(
+            f"Lo stato salvato usa clock='{aggregator.clock}' ma questa esecuzione usa clock='{clock}': "
+            f"{'passa' if time_col is None else 'non passare'} la colonna tempo o usa un altro file di stato."
+        )
+
+    # Indice posizionale: export concatenati possono avere etichette ripetute
+    df = df.reset_index(drop=True)
+    users_all = df[user_col].astype(str) if user_col else pd.Series("anonymous", index=df.index, dtype=object)
+    if not time_col:
+        # Posizione del messaggio tra quelli dell'utente, calcolata sull'export grezzo
+        # (prima dei filtri) perché resti stabile tra un'esecuzione e l'altra
+        positions = users_all.groupby(users_all, sort=False).cumcount()
+
+    df, _ = preprocess_batch(df, text_col, drop_duplicates=False)
+    users = users_all.loc[df.index].to_numpy(dtype=object)
+    if time_col:
+        times = pd.to_datetime(df[time_col])
+        timestamps = epoch_seconds(times)
+    else:
+        times = None
+        timestamps = positions.loc[df.index].to_numpy(dtype=np.float64)
+
+    # Hash del testo e della sua occorrenza tra i messaggi uguali dello stesso utente nello stesso istante:
+    # distingue i messaggi con timestamp identico (es. solo la data) senza confondere i ripetuti
+    occurrence = df.groupby([users, timestamps, df[text_col]], sort=False).cumcount()
+    message_hashes = pd.util.hash_pandas_object(
+        pd.DataFrame({"text": df[text_col].to_numpy(dtype=object), "occurrence": occurrence.to_numpy()}), index=False
+    ).to_numpy()
+
+    # Solo i messaggi non ancora aggregati per l'utente vanno classificati
+    new_mask = aggregator.new_message_mask(users, timestamps, message_hashes)
+    skipped = int((~new_mask).sum())
+    if skipped:
+        logger.info(f"{skipped} messaggi già aggregati in precedenza: saltati.")
+    df, users, timestamps, message_hashes = df[new_mask], users[new_mask], timestamps[new_mask], message_hashes[new_mask]
+    if times is not None:
+        times = times[new_mask]
+
+    if len(df) == 0:
+        logger.info("Nessun nuovo messaggio da analizzare.")
+        return aggregator, None
+
+    start = time.perf_counter()
+    probabilities = analyzer.predict_proba(df[text_col].tolist(), batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+    logger.info(f"Classificati {len(df)} messaggi in {elapsed:.1f}s ({len(df) / max(elapsed, 1e-9):.1f} msg/s).")
+
+    aggregator.update(users, timestamps, probabilities, message_hashes)
+
+    summary = None
+    if times is not None:
+        summary = window_summary(users, times, probabilities, labels, aggregator.serious_labels, window=window)
+    return aggregator, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Aggregazione per utente dei punteggi di salute mentale su export di chat")
+    parser.add_argument("--data_path", type=str, required=True, help="CSV con i messaggi")
+    parser.add_argument("--text_col", type=str, default="message", help="Colonna del testo")
+    parser.add_argument("--user_col", type=str, default=None, help="Colonna con l'id utente (se assente: un solo utente)")
+    parser.add_argument("--time_col", type=str, default=None, help="Colonna con il timestamp del messaggio")
+    parser.add_argument("--window", type=str, default="1D", help="Finestra temporale del riepilogo (frequenza pandas)")
+    parser.add_argument("--alpha", type=float, default=None,
+                        help=f"Fattore di smoothing dell'EWMA per un nuovo stato (default: {DEFAULT_ALPHA}; uno stato esistente mantiene il suo)")
+    parser.add_argument("--batch_size", type=int, default=32, help="Batch size di inferenza")
+    parser.add_argument("--state_path", type=str, default="data/processed/user_aggregates.npz", help="Stato incrementale")
+    parser.add_argument("--output_dir", type=str, default="data/processed", help="Cartella dei CSV di output")
+    args = parser.parse_args()
+
+    setup_logging()
+    from src.model_pool import get_model_pool
+    analyzer = get_model_pool().sentiment_analyzer()
+
+    if os.path.exists(args.state_path):
+        aggregator = UserAggregator.load(args.state_path)
+        logger.info(f"Stato esistente caricato: {aggregator.num_users} utenti.")
+        if args.alpha is not None and args.alpha != aggregator.alpha:
+            logger.warning(
+                f"--alpha {args.alpha} ignorato: lo stato {args.state_path} usa alpha={aggregator.alpha} "
+                f"(usa un altro --state_path per un'EWMA con alpha diverso)."
+            )
+    else:
+        labels = [analyzer.model.config.id2label[i] for i in range(analyzer.model.config.num_labels)]
+        aggregator = UserAggregator(labels, alpha=args.alpha if args.alpha is not None else DEFAULT_ALPHA,
+                                    clock="time" if args.time_col else "row")
+
+    df = pd.read_csv(args.data_path)
+    aggregator, summary = score_messages(
+        analyzer, df, args.text_col, args.user_col, args.time_col, aggregator,
+        batch_size=args.batch_size, window=args.window,
+    )
+    aggregator.save(args.state_path)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    aggregator.to_frame().to_csv(os.path.join(args.output_dir, "user_aggregates.csv"), index=False)
+    if summary is not None:
+        summary.to_csv(os.path.join(args.output_dir, "user_windows.csv"), index=False)
+    logger.info(f"Aggregati scritti in {args.output_dir}.")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,15 @@
+import os
+import json
+import time
+import platform
+import statistics
 import torch
 import logging
 
+logger = logging.getLogger(__name__)
+
+RUNTIME_CONFIG_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models', 'runtime_config.json'))
+
 def get_device():
     """
     Rileva automaticamente il miglior dispositivo disponibile per l'inferenza.
@@ -26,3 +35,165 @@ def setup_logging():
         format='%(asctime)s - %(levelname)s - %(message)s',
         datefmt='%H:%M:%S'
     )
+
+def get_memory_usage_mb() -> dict:
+    """
+    Memoria residente del processo corrente in MB.
+    Su Linux distingue la parte anonima (privata del processo) da quella mappata da file
+    (condivisibile tra processi tramite page cache, es. pesi caricati in mmap).
+    """
+    usage = {}
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile", "VmHWM"):
+                    usage[key] = int(value.split()[0]) / 1024  # kB -> MB
+        return {
+            "rss_mb": usage.get("VmRSS", 0.0),
+            "rss_anon_mb": usage.get("RssAnon", 0.0),
+            "rss_file_mb": usage.get("RssFile", 0.0),
+            "peak_rss_mb": usage.get("VmHWM", 0.0),
+        }
+    except OSError:
+        # Fallback non-Linux: solo il picco di memoria residente
+        import resource
+        import sys
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss è in byte su macOS, in kB altrove
+        peak_mb = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+        return {"rss_mb": peak_mb, "rss_anon_mb": 0.0, "rss_file_mb": 0.0, "peak_rss_mb": peak_mb}
+
+def parse_cpu_list(spec: str) -> set:
+    """Converte una lista di core in formato '0-3,6' nell'insieme {0, 1, 2, 3, 6}."""
+    cpus = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            lo, hi = part.split("-")
+            cpus.update(range(int(lo), int(hi) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+def apply_thread_config(intra_op_threads: int = None, inter_op_threads: int = None, cpu_affinity=None) -> dict:
+    """
+    Applica la configurazione di parallelismo CPU di PyTorch al processo corrente.
+    - intra_op_threads: thread usati dentro un singolo operatore (matmul, conv, ...)
+    - inter_op_threads: thread per operatori indipendenti; PyTorch permette di impostarlo
+      una sola volta e prima di qualsiasi lavoro parallelo
+    - cpu_affinity: insieme di core (o stringa '0-3,6') a cui vincolare il processo (solo Linux)
+    Ritorna la configurazione effettiva.
+    """
+    if cpu_affinity:
+        if isinstance(cpu_affinity, str):
+            cpu_affinity = parse_cpu_list(cpu_affinity)
+        if hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpu_affinity)
+        else:
+            logger.warning("Affinità CPU non supportata su questo sistema, ignorata.")
+    if intra_op_threads:
+        torch.set_num_threads(int(intra_op_threads))
+    if inter_op_threads and inter_op_threads != torch.get_num_interop_threads():
+        try:
+            torch.set_num_interop_threads(int(inter_op_threads))
+        except RuntimeError as e:
+            logger.warning(f"Impossibile impostare inter-op threads (già avviato lavoro parallelo): {e}")
+
+    return {
+        "intra_op_threads": torch.get_num_threads(),
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "cpu_affinity": sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else None,
+    }
+
+def _machine_key() -> str:
+    # La configurazione ottimale dipende dalla macchina: la salviamo per host e numero di core
+    return f"{platform.node()}-{os.cpu_count()}cpu"
+
+def load_runtime_config(module_name: str, path: str = RUNTIME_CONFIG_PATH) -> dict:
+    """
+    Configurazione di parallelismo salvata per un modulo su questa macchina.
+    Le variabili d'ambiente NLP_INTRA_OP_THREADS, NLP_INTER_OP_THREADS e NLP_CPU_AFFINITY
+    hanno la precedenza sui valori salvati.
+    """
+    config = {}
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = dict(json.load(f).get(_machine_key(), {}).get(module_name, {}))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Configurazione runtime non leggibile ({path}): {e}")
+
+    env_overrides = {
+        "intra_op_threads": os.getenv("NLP_INTRA_OP_THREADS"),
+        "inter_op_threads": os.getenv("NLP_INTER_OP_THREADS"),
+        "cpu_affinity": os.getenv("NLP_CPU_AFFINITY"),
+    }
+    for key, value in env_overrides.items():
+        if value:
+            config[key] = value if key == "cpu_affinity" else int(value)
+    return config
+
+def save_runtime_config(module_name: str, config: dict, path: str = RUNTIME_CONFIG_PATH):
+    data = {}
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    data.setdefault(_machine_key(), {})[module_name] = config
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+
+def apply_runtime_config(module_name: str, device: torch.device = None) -> dict:
+    """
+    Applica la configurazione salvata per `module_name` (chiamata alla creazione dei moduli).
+    Le impostazioni di thread sono globali per il processo: se più moduli convivono,
+    vale quella dell'ultimo modulo creato.
+    """
+    if device is not None and device.type != "cpu":
+        return {}
+    config = load_runtime_config(module_name)
+    if not config:
+        return {}
+    applied = apply_thread_config(
+        config.get("intra_op_threads"), config.get("inter_op_threads"), config.get("cpu_affinity")
+    )
+    logger.info(f"Configurazione runtime '{module_name}': {applied['intra_op_threads']} thread intra-op, "
+                f"{applied['inter_op_threads']} inter-op")
+    return applied
+
+def autotune_threads(module_name: str, benchmark_fn, candidates=None, repeats: int = 3, save: bool = True) -> dict:
+    """
+    Misura `benchmark_fn` con diversi numeri di thread intra-op e salva il più veloce.
+    Il numero di thread inter-op non viene variato: PyTorch lo fissa al primo lavoro parallelo.
+    """
+    if candidates is None:
+        max_threads = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else (os.cpu_count() or 1)
+        candidates = sorted({n for n in (1, 2, 4, 8, 16, max_threads // 2, max_threads) if 1 <= n <= max_threads})
+
+    timings = {}
+    for n in candidates:
+        torch.set_num_threads(n)
+        benchmark_fn()  # warm-up con questo numero di thread
+        runs = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            benchmark_fn()
+            runs.append(time.perf_counter() - start)
+        timings[n] = statistics.median(runs)
+        logger.info(f"[{module_name}] {n} thread intra-op: {timings[n] * 1000:.1f} ms")
+
+    best = min(timings, key=timings.get)
+    config = {
+        "intra_op_threads": best,
+        "inter_op_threads": torch.get_num_interop_threads(),
+        "benchmark_ms": {str(n): round(t * 1000, 2) for n, t in timings.items()},
+    }
+    torch.set_num_threads(best)
+    if save:
+        save_runtime_config(module_name, config)
+    logger.info(f"[{module_name}] configurazione migliore: {best} thread intra-op")
+    return config
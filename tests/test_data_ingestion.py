@@ -0,0 +1,28 @@
+from src.data_ingestion import _edge_lines, _looks_like_heading
+
+
+def _line(y0, y1):
+    return {"text": "x", "y0": y0, "y1": y1}
+
+
+def test_edge_lines_are_first_and_last_lines_of_the_text_area():
+    # Righe in coordinate relative all'altezza della pagina; l'header è sulla stessa riga di un titolo di colonna
+    lines = [_line(0.05, 0.07), _line(0.06, 0.075), _line(0.10, 0.12), _line(0.50, 0.52), _line(0.90, 0.92)]
+    assert _edge_lines(lines) == {"top": [0, 1], "bottom": [4]}
+
+
+def test_edge_lines_follow_the_text_area_not_the_page_margin():
+    # Documento con margini ampi: numero di pagina a metà pagina in basso, niente nel 10% superiore
+    lines = [_line(0.20, 0.22), _line(0.30, 0.32), _line(0.61, 0.63)]
+    assert _edge_lines(lines) == {"top": [0], "bottom": [2]}
+    assert _edge_lines([]) == {"top": [], "bottom": []}
+
+
+def test_headings_are_accepted():
+    for text in ("Introduction", "2.1", "3.", "2 Background", "BERT Pre-training"):
+        assert _looks_like_heading(text), text
+
+
+def test_sentence_fragments_are_rejected():
+    for text in ("derstanding):", "eration", "and the model,", "Fig", "see below;", "Input -"):
+        assert not _looks_like_heading(text), text
@@ -0,0 +1,51 @@
+import numpy as np
+
+from src.dedup import NearDuplicateIndex, deduplicate
+
+BASE = "the battery of this phone lasts two full days with heavy use"
+NEAR = "the battery of this phone lasts two full days with light use"   # Jaccard sugli shingle 8/12 ≈ 0.67
+OTHER = "the camera is blurry in low light and the screen scratches easily"
+
+
+def test_exact_and_near_duplicates_are_counted_separately():
+    representatives, ids, stats = deduplicate([BASE, NEAR, BASE, OTHER], threshold=0.5)
+    assert list(representatives) == [0, 3]
+    assert list(ids) == [0, 0, 0, 1]
+    assert stats["exact_duplicates"] == 1
+    assert stats["near_duplicates"] == 1
+    assert stats["propagated"] == 2
+
+
+def test_threshold_controls_near_duplicate_merging():
+    _, loose_ids, _ = deduplicate([BASE, NEAR], threshold=0.5)
+    _, strict_ids, strict_stats = deduplicate([BASE, NEAR], threshold=0.9)
+    assert loose_ids[0] == loose_ids[1]
+    assert strict_ids[0] != strict_ids[1]
+    assert strict_stats["near_duplicates"] == 0
+
+
+def test_ids_are_stable_across_calls():
+    index = NearDuplicateIndex(threshold=0.5)
+    first, first_ids, _ = index.add([BASE, OTHER])
+    second, second_ids, stats = index.add(["a completely new sentence about shipping delays", NEAR, BASE])
+
+    assert list(first) == [0, 1] and list(first_ids) == [0, 1]
+    # Solo il testo nuovo diventa rappresentante, con l'id successivo
+    assert list(second) == [0]
+    assert list(second_ids) == [2, 0, 0]
+    assert stats["from_previous_chunks"] == 2
+    assert stats["exact_duplicates"] == 1 and stats["near_duplicates"] == 1
+    assert index.num_representatives == 3 and index.size == 3
+
+
+def test_index_grows_and_stops_at_max_size():
+    texts = [f"review number {i} says the product {i} arrived on day {i % 7}" for i in range(1500)]
+    index = NearDuplicateIndex(threshold=0.9, max_size=1200)
+    index.add(texts[:1000])
+    representatives, ids, _ = index.add(texts[1000:] + texts[:5])
+
+    assert index.size == 1200
+    assert index.num_representatives == 1500
+    assert len(representatives) == 500
+    # I testi già indicizzati ritrovano il proprio id
+    np.testing.assert_array_equal(ids[-5:], np.arange(5))
@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+import src.model_pool
+from src.jobs import DONE, FAILED, QUEUED, RUNNING, JobQueue, _run_sentiment_csv, _take_representatives
+from src.sentiment import SentimentBatchResult
+
+LABELS = ["negative", "neutral", "positive"]
+
+
+class FakeAnalyzer:
+    """Classifica come positivo ogni testo che contiene "good", negativo gli altri."""
+    def __init__(self):
+        self.scored = []
+
+    def analyze_columnar(self, texts, batch_size=32):
+        self.scored.extend(texts)
+        label_ids = np.array([2 if "good" in t else 0 for t in texts], dtype=np.int8)
+        probabilities = np.eye(len(LABELS), dtype=np.float32)[label_ids]
+        return SentimentBatchResult(label_ids, probabilities.reshape(len(texts), len(LABELS)), LABELS)
+
+
+class FakePool:
+    def __init__(self):
+        self.analyzer = FakeAnalyzer()
+
+    def sentiment_analyzer(self):
+        return self.analyzer
+
+
+def _score_csv(tmp_path, monkeypatch, df, pool=None, **payload):
+    pool = pool or FakePool()
+    monkeypatch.setattr(src.model_pool, "get_model_pool", lambda: pool)
+    df.to_csv(tmp_path / "input.csv", index=False)
+    job = {"payload": {"text_col": "Message", "skip_unsupported_languages": False, "chunk_rows": 2, **payload}}
+    result = _run_sentiment_csv(job, str(tmp_path), lambda progress, message=None: None)
+    return result, pd.read_csv(result["result_path"])
+
+
+def test_sentiment_csv_replaces_existing_sentiment_columns(tmp_path, monkeypatch):
+    df = pd.DataFrame({
+        "Message": ["good movie", "bad food", "good service", "awful"],
+        "sentiment": ["negative", "positive", "neutral", "positive"],
+        "p_positive": ["x", "y", "z", "w"],
+        "id": [1, 2, 3, 4],
+    })
+    result, out = _score_csv(tmp_path, monkeypatch, df)
+
+    assert result["rows"] == 4
+    assert list(out.columns) == ["Message", "id", "sentiment", "p_negative", "p_neutral", "p_positive"]
+    assert list(out["sentiment"]) == ["positive", "negative", "positive", "negative"]
+    assert list(out["p_positive"]) == [1.0, 0.0, 1.0, 0.0]
+    assert result["label_counts"] == {"positive": 2, "negative": 2, "neutral": 0}
+    assert len(pd.read_parquet(result["parquet_path"])) == 4
+
+
+def test_sentiment_csv_dedup_reuses_results_across_chunks(tmp_path, monkeypatch):
+    texts = ["good phone, great battery life", "bad screen and slow charging", "good phone, great battery life",
+             "bad screen and slow charging", "good camera and good price", "good phone, great battery life"]
+    pool = FakePool()
+    result, out = _score_csv(tmp_path, monkeypatch, pd.DataFrame({"Message": texts}), pool=pool, near_dedup=True)
+
+    # Chunk da 2 righe: ogni testo distinto viene classificato una sola volta
+    assert pool.analyzer.scored == ["good phone, great battery life", "bad screen and slow charging", "good camera and good price"]
+    assert list(out["sentiment"]) == ["positive", "negative", "positive", "negative", "positive", "positive"]
+    assert result["dedup"]["representatives"] == 3
+    assert result["dedup"]["exact_duplicates"] == 3
+    assert result["dedup"]["from_previous_chunks"] == 3
+
+
+def test_take_representatives_across_blocks():
+    blocks = [
+        SentimentBatchResult(np.array([0, 2], dtype=np.int8), np.eye(3, dtype=np.float32)[[0, 2]], LABELS),
+        SentimentBatchResult(np.array([1], dtype=np.int8), np.eye(3, dtype=np.float32)[[1]], LABELS),
+    ]
+    taken = _take_representatives(blocks, [0, 2, 3], [2, 0, 1, 2])
+    assert list(taken.label_ids) == [1, 0, 2, 1]
+    np.testing.assert_array_equal(taken.probabilities, np.eye(3, dtype=np.float32)[[1, 0, 2, 1]])
+
+
+def test_claim_requeues_jobs_of_dead_workers_until_attempts_run_out(tmp_path):
+    queue = JobQueue(str(tmp_path), max_attempts=2)
+    first = queue.submit("summarize", {"n": 1})
+    second = queue.submit("summarize", {"n": 2})
+
+    # I job vengono presi in ordine di arrivo; "w-dead" non ha mai mandato heartbeat
+    job = queue.claim("w-dead")
+    assert job["id"] == first and job["status"] == RUNNING and job["attempts"] == 1
+
+    # Il worker risulta morto: il job torna in coda e viene ripreso (secondo tentativo)
+    queue.heartbeat("w-live")
+    job = queue.claim("w-live")
+    assert job["id"] == first and job["worker"] == "w-live" and job["attempts"] == 2
+
+    # Anche il secondo worker muore: tentativi esauriti, il job fallisce e si passa al successivo
+    queue.unregister("w-live")
+    queue.heartbeat("w-other")
+    job = queue.claim("w-other")
+    assert job["id"] == second
+    assert queue.get(first)["status"] == FAILED
+    assert queue.claim("w-other") is None
+
+
+def test_cleanup_removes_only_expired_finished_jobs_and_orphan_dirs(tmp_path):
+    queue = JobQueue(str(tmp_path))
+    old_done, old_failed, recent_done, queued = (queue.submit("summarize", {}, {"input.txt": "x"}) for _ in range(4))
+    queue.complete(old_done, {})
+    queue.fail(old_failed, "errore")
+    queue.complete(recent_done, {})
+    long_ago = time.time() - 10 * 86400
+    with sqlite3.connect(queue.db_path) as conn:
+        conn.execute("UPDATE jobs SET finished_at = ? WHERE id IN (?, ?)", (long_ago, old_done, old_failed))
+
+    orphan = tmp_path / ("f" * 32)
+    orphan.mkdir()
+    os.utime(orphan, (long_ago, long_ago))
+    other_dir = tmp_path / "not-a-job"
+    other_dir.mkdir()
+    os.utime(other_dir, (long_ago, long_ago))
+
+    assert queue.cleanup(retention_days=7) == 2
+    assert queue.get(old_done) is None and queue.get(old_failed) is None
+    assert not os.path.exists(queue.job_dir(old_done)) and not orphan.exists()
+    assert queue.get(recent_done)["status"] == DONE and os.path.isdir(queue.job_dir(recent_done))
+    assert queue.get(queued)["status"] == QUEUED and os.path.isdir(queue.job_dir(queued))
+    assert other_dir.exists()
+    assert queue.cleanup(retention_days=0) == 0
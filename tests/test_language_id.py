@@ -0,0 +1,36 @@
+import pandas as pd
+
+from src.language_id import UNDETERMINED, LanguageRouter, heuristic_detect
+
+ITALIAN = [
+    "Devo portare il diploma originale?",
+    "Posso iscrivermi con riserva?",
+    "Posso accedere alle risorse digitali da casa?",
+    "Cosa è incluso nell'affitto dello studentato?",
+    "Come cerco un libro nel catalogo?",
+    "Quando apre la segreteria e dove si trova?",
+]
+
+
+def test_italian_sentences_are_not_assigned_to_other_languages():
+    langs, _ = heuristic_detect(pd.Series(ITALIAN))
+    assert set(langs) <= {"it", UNDETERMINED}
+    assert (langs == "it").sum() >= len(ITALIAN) - 1
+
+
+def test_tie_between_languages_is_undetermined():
+    # "il" è sia italiano sia francese, "una" sia italiano sia spagnolo/portoghese
+    langs, confidence = heuristic_detect(pd.Series(["il", "una"]))
+    assert list(langs) == [UNDETERMINED, UNDETERMINED]
+    assert (confidence == 0).all()
+
+
+def test_english_sentences():
+    langs, _ = heuristic_detect(pd.Series(["I had a bad experience", "The phone is very good but the battery is not"]))
+    assert list(langs) == ["en", "en"]
+
+
+def test_summarization_router_keeps_italian_input():
+    keep, _, stats = LanguageRouter("summarization").route(ITALIAN)
+    assert keep.all()
+    assert stats["rows_skipped"] == 0
@@ -0,0 +1,65 @@
+import pytest
+
+from src.metrics import MetricsRegistry, _Metric, parse_exposition, scrape, start_metrics_server
+
+
+def test_render_counter_gauge_and_histogram():
+    registry = MetricsRegistry()
+    tokens = registry.counter("tokens_total", "Token processati", ["model"])
+    tokens.labels(model="it5").inc(3)
+    tokens.labels(model='x"y').inc()
+    depth = registry.gauge("queue_depth", "Job in coda")
+    depth.set_function(lambda: 7)
+    latency = registry.histogram("latency_seconds", "Latenza", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 2.0):
+        latency.observe(value)
+
+    text = registry.render()
+    assert text.endswith("\n")
+    # Metriche ordinate per nome, ognuna con HELP e TYPE
+    assert text.splitlines()[:2] == ["# HELP latency_seconds Latenza", "# TYPE latency_seconds histogram"]
+    assert "# TYPE tokens_total counter" in text and "# TYPE queue_depth gauge" in text
+    assert 'tokens_total{model="x\\"y"} 1' in text
+
+    samples = parse_exposition(text)
+    assert samples['tokens_total{model="it5"}'] == 3
+    assert samples["queue_depth"] == 7
+    # Bucket cumulativi, +Inf uguale al conteggio
+    assert samples['latency_seconds_bucket{le="0.1"}'] == 1
+    assert samples['latency_seconds_bucket{le="1"}'] == 2
+    assert samples['latency_seconds_bucket{le="+Inf"}'] == 3
+    assert samples["latency_seconds_count"] == 3
+    assert samples["latency_seconds_sum"] == pytest.approx(2.55)
+
+
+def test_registry_rejects_conflicting_metrics_and_labels():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs_total", "Job", ["kind"])
+    assert registry.counter("jobs_total", "Job", ["kind"]) is counter
+    with pytest.raises(ValueError):
+        registry.gauge("jobs_total", "Job", ["kind"])
+    with pytest.raises(ValueError):
+        counter.labels(status="done")
+    with pytest.raises(ValueError):
+        counter.labels(kind="csv").inc(-1)
+    with pytest.raises(TypeError):
+        _Metric("base", "Metrica astratta")
+
+
+def test_failing_gauge_function_does_not_break_the_scrape():
+    registry = MetricsRegistry()
+    registry.gauge("broken", "Non calcolabile").set_function(lambda: 1 / 0)
+    registry.gauge("ok", "Calcolabile").set(2)
+    assert scrape(registry=registry) == {"ok": 2}
+
+
+def test_metrics_server_serves_the_registry():
+    registry = MetricsRegistry()
+    registry.counter("requests_total", "Richieste").inc(5)
+    server = start_metrics_server(0, addr="127.0.0.1", registry=registry)
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}/metrics"
+        assert scrape(url) == {"requests_total": 5}
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,80 @@
+import pandas as pd
+
+from src.preprocessing import SECTION_SEPARATOR, RecursiveTokenChunker, pack_openapi_chunks, preprocess_batch
+
+SECTIONS = SECTION_SEPARATOR.join(["Intro\n\n" + "a" * 30, "Metodo\n\n" + "b" * 30])
+
+
+def test_plain_chunker_does_not_split_on_section_separator():
+    text = "uno due tre.\n\n\nquattro cinque sei."
+    assert RecursiveTokenChunker(chunk_size=100).split_text(text) == [text]
+    # Testo lungo: il primo taglio è sul paragrafo, non sulla tripla riga vuota
+    assert RecursiveTokenChunker(chunk_size=40).separators[0] == "\n\n"
+
+
+def test_section_chunker_splits_on_section_boundaries_first():
+    chunker = RecursiveTokenChunker(chunk_size=40, section_separator=SECTION_SEPARATOR)
+    assert chunker.split_text(SECTIONS) == ["Intro\n\n" + "a" * 30, "Metodo\n\n" + "b" * 30]
+
+
+def test_preprocess_batch_normalizes_and_filters():
+    df = pd.DataFrame({
+        "text": ["  ciao   mondo ", "ciao mondo", None, "   ", "ok", "un testo troppo lungo", "altro  testo"],
+        "label": list(range(7)),
+    }, index=[10, 11, 12, 13, 14, 15, 16])
+    out, stats = preprocess_batch(df, "text", min_chars=3, max_chars=15)
+
+    assert out["text"].tolist() == ["ciao mondo", "altro testo"]
+    # Indice e colonne non testuali della riga originale preservati
+    assert out.index.tolist() == [10, 16]
+    assert out["label"].tolist() == [0, 6]
+    assert {k: stats[k] for k in ("rows_in", "null_or_empty", "too_short", "too_long", "duplicates", "rows_out")} == {
+        "rows_in": 7, "null_or_empty": 2, "too_short": 1, "too_long": 1, "duplicates": 1, "rows_out": 2,
+    }
+    assert stats["rows_per_s"] > 0
+
+
+def test_preprocess_batch_keeps_duplicates_and_removes_emoji_on_request():
+    df = pd.DataFrame({"text": ["bravo 👍", "bravo", "bravo"]})
+    out, stats = preprocess_batch(df, "text", emoji_mode="remove", drop_duplicates=False)
+    assert out["text"].tolist() == ["bravo", "bravo", "bravo"]
+    assert "duplicates" not in stats
+
+
+def _spec(endpoints):
+    return {
+        "title": "Demo",
+        "description": "API di prova",
+        "endpoints": [
+            {"method": m, "path": p, "tag": t, "summary": s, "description": ""} for m, p, t, s in endpoints
+        ],
+    }
+
+
+def test_openapi_group_is_never_split_when_it_fits_a_chunk():
+    spec = _spec(
+        [("GET", f"/users/{i}", "users", f"Utente {i}") for i in range(3)]
+        + [("GET", f"/orders/{i}", "orders", f"Ordine {i}") for i in range(3)]
+    )
+    chunks = pack_openapi_chunks(spec, max_length=220)
+
+    # Intestazione della specifica attaccata al primo gruppo
+    assert chunks[0].startswith("Titolo API: Demo\nDescrizione Generale: API di prova")
+    assert "Gruppo: users" in chunks[0]
+    for tag in ("users", "orders"):
+        holding = [c for c in chunks if f"/{tag}/" in c]
+        assert len(holding) == 1 and all(f"/{tag}/{i}" in holding[0] for i in range(3))
+    assert len(chunks) == 2 and all(len(c) <= 220 for c in chunks)
+
+
+def test_openapi_oversized_group_repeats_its_title_and_keeps_endpoints_whole():
+    spec = _spec([("GET", f"/items/{i}", "items", f"Elemento numero {i}") for i in range(8)])
+    chunks = pack_openapi_chunks(spec, max_length=150)
+
+    assert len(chunks) > 1
+    assert all(c.startswith("Gruppo: items (continua)") for c in chunks[1:])
+    # Nessun titolo di gruppo rimasto senza endpoint in coda a un chunk
+    assert not any(c.endswith("Gruppo: items") for c in chunks)
+    for i in range(8):
+        endpoint = f"Endpoint: GET /items/{i}\nRiepilogo: Elemento numero {i}"
+        assert sum(endpoint in c for c in chunks) == 1
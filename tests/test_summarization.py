@@ -0,0 +1,25 @@
+from src.summarization import SUMMARIZER_TIERS, SummarizerRouter
+
+SHORT = "breve descrizione di un endpoint"
+LONG = " ".join(["parola"] * 400)
+
+
+def _router(measured=()):
+    tiers = {name: dict(cfg) for name, cfg in SUMMARIZER_TIERS.items()}
+    for name in measured:
+        tiers[name]["provisional"] = False
+    return SummarizerRouter(tiers=tiers, loader=lambda model_name: None)
+
+
+def test_router_stays_on_base_while_tiers_are_provisional():
+    router = _router()
+    assert router.choose_tier(SHORT) == "base"
+    assert router.choose_tier(LONG, latency_budget=0.1) == "base"
+
+
+def test_router_uses_benchmarked_small_tier():
+    router = _router(measured=["small"])
+    assert router.choose_tier(SHORT) == "small"
+    assert router.choose_tier(LONG) == "base"
+    # Budget stretto: si scende al tier più veloce che ci sta
+    assert router.choose_tier(LONG, latency_budget=2.0) == "small"
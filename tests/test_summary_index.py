@@ -0,0 +1,50 @@
+import json
+
+from src.preprocessing import RecursiveTokenChunker
+from src.summary_index import DocumentSummaryIndex
+
+PARAGRAPHS = [f"Paragrafo {i}: " + " ".join(f"parola{i}_{j}" for j in range(12)) for i in range(6)]
+TEXT = "\n\n".join(PARAGRAPHS)
+
+
+def _summarized(segments):
+    for seg in segments:
+        seg["summary"] = seg["summary"] or f"riassunto {seg['hash'][:8]}"
+    return {"chunks": segments}
+
+
+def test_plan_covers_the_document_without_empty_segments():
+    chunker = RecursiveTokenChunker(chunk_size=250)
+    segments = DocumentSummaryIndex.plan(None, TEXT + "\n\n\n\n", chunker)
+    assert segments and all(TEXT[s["start"]:s["end"]].strip() for s in segments)
+    assert all(s["summary"] is None for s in segments)
+    assert "".join(TEXT[s["start"]:s["end"]] for s in segments).replace("\n", "") == TEXT.replace("\n", "")
+
+
+def test_unchanged_chunks_are_reused_after_edits(tmp_path):
+    chunker = RecursiveTokenChunker(chunk_size=250)
+    index = DocumentSummaryIndex(str(tmp_path))
+    entry = _summarized(index.plan(TEXT, chunker))
+
+    # Paragrafo aggiunto in testa (sposta tutti gli offset) e ultimo paragrafo modificato
+    last = PARAGRAPHS[-1].replace("parola5_3", "modificata")
+    edited = "Nuova introduzione.\n\n" + "\n\n".join(PARAGRAPHS[:-1] + [last])
+    segments = index.plan(edited, chunker, entry)
+
+    reused = [s for s in segments if s["summary"] is not None]
+    regenerated = [s for s in segments if s["summary"] is None]
+    assert len(reused) == len(entry["chunks"]) - 1
+    assert [edited[s["start"]:s["end"]] for s in regenerated] == ["Nuova introduzione.", last]
+
+
+def test_index_stores_hashes_and_offsets_not_text(tmp_path):
+    chunker = RecursiveTokenChunker(chunk_size=250)
+    index = DocumentSummaryIndex(str(tmp_path))
+    index.save("doc", {"doc_id": "doc", "doc_hash": "x", **_summarized(index.plan(TEXT, chunker))})
+
+    raw = open(next(tmp_path.glob("*.json")), encoding="utf-8").read()
+    assert "parola0_1" not in raw
+    entry = json.loads(raw)
+    assert set(entry["chunks"][0]) == {"start", "end", "hash", "prefix", "summary"}
+    # Documento identico: tutti i chunk ritrovati alle stesse posizioni
+    assert all(s["summary"] is not None for s in index.plan(TEXT, chunker, index.load("doc")))
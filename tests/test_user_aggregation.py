@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.user_aggregation import UserAggregator, score_messages
+
+LABELS = ["Depression", "Light", "Normal", "Serious"]
+
+
+class FakeAnalyzer:
+    """Probabilità one-hot: classe "Serious" per i testi che contengono "help", "Normal" per gli altri."""
+    class model:
+        class config:
+            id2label = dict(enumerate(LABELS))
+            num_labels = len(LABELS)
+
+    def __init__(self):
+        self.scored = []
+
+    def predict_proba(self, texts, batch_size=32):
+        self.scored.extend(texts)
+        return np.eye(len(LABELS), dtype=np.float32)[[3 if "help" in t else 2 for t in texts]]
+
+
+def test_update_matches_sequential_ewma():
+    rng = np.random.default_rng(0)
+    probabilities = rng.dirichlet(np.ones(len(LABELS)), size=6).astype(np.float32)
+    users = np.array(["a", "b", "a", "a", "b", "a"], dtype=object)
+    # Dentro un batch l'ordine è quello dei timestamp; il secondo batch è successivo al primo
+    timestamps = np.array([5, 1, 1, 6, 2, 9], dtype=np.float64)
+
+    agg = UserAggregator(LABELS, alpha=0.4)
+    agg.update(users[:3], timestamps[:3], probabilities[:3])
+    agg.update(users[3:], timestamps[3:], probabilities[3:])
+
+    for user in ("a", "b"):
+        mask = users == user
+        expected = None
+        for p in probabilities[mask][np.argsort(timestamps[mask], kind="stable")]:
+            expected = p if expected is None else 0.6 * expected + 0.4 * p
+        row = agg.user_index[user]
+        np.testing.assert_allclose(agg.ewma[row], expected, rtol=1e-5)
+        assert agg.message_count[row] == mask.sum()
+        assert agg.last_seen[row] == timestamps[mask].max()
+
+
+def test_save_and_load_roundtrip(tmp_path):
+    agg = UserAggregator(LABELS, alpha=0.2, clock="row")
+    agg.update(["u1", "u2"], np.array([0.0, 0.0]), np.eye(len(LABELS))[[3, 2]], np.array([11, 12], dtype=np.uint64))
+    path = str(tmp_path / "state.npz")
+    agg.save(path)
+
+    loaded = UserAggregator.load(path)
+    assert loaded.alpha == 0.2 and loaded.clock == "row"
+    assert loaded.user_ids == ["u1", "u2"]
+    np.testing.assert_array_equal(loaded.serious_count[:2], [1, 0])
+    np.testing.assert_array_equal(loaded.ewma[:2], agg.ewma[:2])
+    assert loaded.last_seen_hashes == {0: {11}, 1: {12}}
+
+
+def test_same_timestamp_messages_are_not_dropped_or_double_counted():
+    day1 = pd.DataFrame({"user": ["a", "a"], "time": ["2024-05-01", "2024-05-01"], "message": ["hello there", "please help me"]})
+    # Export successivo: stessi messaggi più uno nuovo con la stessa data (timestamp solo al giorno)
+    day1_later = pd.concat([day1, pd.DataFrame({"user": ["a"], "time": ["2024-05-01"], "message": ["still need help"]})])
+    analyzer = FakeAnalyzer()
+
+    agg, _ = score_messages(analyzer, day1, "message", "user", "time")
+    agg, _ = score_messages(analyzer, day1_later, "message", "user", "time", agg)
+    agg, summary = score_messages(analyzer, day1_later, "message", "user", "time", agg)
+
+    assert analyzer.scored == ["hello there", "please help me", "still need help"]
+    assert agg.message_count[0] == 3 and agg.serious_count[0] == 2
+    assert summary is None
+
+
+def test_repeated_message_in_the_same_instant_is_counted_once_per_occurrence():
+    df = pd.DataFrame({"user": ["a", "a"], "time": ["2024-05-01 10:00:00"] * 2, "message": ["ok", "ok"]})
+    agg, _ = score_messages(FakeAnalyzer(), df.iloc[:1], "message", "user", "time")
+    agg, _ = score_messages(FakeAnalyzer(), df, "message", "user", "time", agg)
+    assert agg.message_count[0] == 2
+
+
+def test_row_clock_skips_rows_already_aggregated():
+    df = pd.DataFrame({"user": ["a", "b", "a"], "message": ["fine", "need help", "fine again"]})
+    analyzer = FakeAnalyzer()
+    agg, _ = score_messages(analyzer, df.iloc[:2], "message", "user")
+    agg, _ = score_messages(analyzer, df, "message", "user", aggregator=agg)
+    assert analyzer.scored == ["fine", "need help", "fine again"]
+    with pytest.raises(ValueError):
+        score_messages(analyzer, df.assign(time="2024-05-01"), "message", "user", "time", agg)